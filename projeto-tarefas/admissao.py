@@ -0,0 +1,147 @@
+"""
+Módulo de Controlo de Admissão (Load Shedding)
+
+Quando o PostgreSQL fica lento, as requisições acumulam-se à espera de uma
+ligação do pool do `SessionLocal` e a latência cresce para todos. Este
+ficheiro mede a carga da instância (requisições em voo e tempo de espera pelo
+pool) e, acima dos limites configurados, rejeita o tráfego de baixa
+prioridade com `503 Service Unavailable` + `Retry-After`, em vez de o deixar
+esperar indefinidamente.
+
+- Leituras (GET/HEAD) são de baixa prioridade: são as primeiras a ser rejeitadas.
+- Escritas (POST/PUT/PATCH/DELETE) só são rejeitadas no limite máximo.
+- `/`, `/health`, `/ready`, a documentação e os pedidos OPTIONS (CORS) nunca são rejeitados.
+
+O mesmo estado alimenta o endpoint `/ready`, para que o orquestrador deixe de
+encaminhar tráfego para uma instância sobrecarregada.
+"""
+import json
+import math
+import os
+import time
+
+
+# --- Configuração ---
+
+def _env_float(nome: str, padrao: float) -> float:
+    return float(os.getenv(nome, str(padrao)))
+
+
+# Caminhos que nunca são rejeitados nem contados como carga.
+CAMINHOS_ISENTOS = {"/", "/health", "/ready", "/docs", "/redoc", "/openapi.json"}
+
+# Métodos considerados de baixa prioridade (leituras).
+METODOS_BAIXA_PRIORIDADE = {"GET", "HEAD"}
+
+
+# --- Estado de Carga da Instância ---
+
+class EstadoDeCarga:
+    """
+    Guarda as métricas de carga desta instância da API.
+
+    Atributos configuráveis (por variáveis de ambiente):
+        limite_escritas: Requisições em voo a partir das quais até as escritas
+                         são rejeitadas (ADMISSAO_MAX_EM_VOO, padrão 64).
+        limite_leituras: Requisições em voo a partir das quais as leituras são
+                         rejeitadas (ADMISSAO_MAX_EM_VOO_LEITURAS, padrão 75% do anterior).
+        limite_espera_pool: Espera média pelo pool, em segundos, a partir da qual as
+                            leituras são rejeitadas (ADMISSAO_MAX_ESPERA_POOL_MS, padrão 250).
+        retry_after: Valor do cabeçalho `Retry-After`, em segundos (ADMISSAO_RETRY_AFTER, padrão 1).
+    """
+
+    # Meia-vida, em segundos, da média da espera pelo pool. Sem novas amostras,
+    # a média decai sozinha, para que a instância recupere mesmo que só receba
+    # leituras (que, enquanto rejeitadas, não produzem amostras).
+    MEIA_VIDA_ESPERA = 2.0
+
+    def __init__(self):
+        self.limite_escritas = int(_env_float("ADMISSAO_MAX_EM_VOO", 64))
+        self.limite_leituras = int(_env_float("ADMISSAO_MAX_EM_VOO_LEITURAS", self.limite_escritas * 0.75))
+        self.limite_espera_pool = _env_float("ADMISSAO_MAX_ESPERA_POOL_MS", 250) / 1000
+        self.retry_after = int(_env_float("ADMISSAO_RETRY_AFTER", 1))
+        self.em_voo = 0
+        self.rejeitadas = 0
+        self._espera_media = 0.0
+        self._ultima_amostra = time.monotonic()
+
+    def registar_espera_pool(self, segundos: float):
+        """Regista quanto tempo uma requisição esperou por uma ligação do pool."""
+        agora = time.monotonic()
+        media = self.espera_pool()
+        # Média móvel exponencial: a amostra nova pesa 20%.
+        self._espera_media = media + 0.2 * (segundos - media)
+        self._ultima_amostra = agora
+
+    def espera_pool(self) -> float:
+        """Espera média pelo pool, em segundos, com decaimento temporal."""
+        decorrido = time.monotonic() - self._ultima_amostra
+        return self._espera_media * math.pow(0.5, decorrido / self.MEIA_VIDA_ESPERA)
+
+    def deve_rejeitar(self, baixa_prioridade: bool) -> bool:
+        """Indica se uma nova requisição com esta prioridade deve ser rejeitada."""
+        if self.em_voo >= self.limite_escritas:
+            return True
+        if baixa_prioridade:
+            return self.em_voo >= self.limite_leituras or self.espera_pool() >= self.limite_espera_pool
+        return False
+
+    def sobrecarregado(self) -> bool:
+        """True quando a instância já está a rejeitar tráfego de baixa prioridade."""
+        return self.deve_rejeitar(baixa_prioridade=True)
+
+    def resumo(self) -> dict:
+        """Métricas atuais, usadas pelo endpoint `/ready`."""
+        return {
+            "em_voo": self.em_voo,
+            "espera_pool_ms": round(self.espera_pool() * 1000, 1),
+            "rejeitadas": self.rejeitadas,
+        }
+
+
+# Estado global da instância, partilhado entre o middleware, `get_db` e `/ready`.
+estado = EstadoDeCarga()
+
+
+# --- Middleware ASGI ---
+
+class MiddlewareDeAdmissao:
+    """
+    Middleware que conta as requisições em voo e rejeita o excesso.
+
+    É um middleware ASGI "puro" (sem `BaseHTTPMiddleware`) para não acrescentar
+    custo às requisições aceites e para contar corretamente respostas em streaming.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in CAMINHOS_ISENTOS or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        if estado.deve_rejeitar(baixa_prioridade=scope["method"] in METODOS_BAIXA_PRIORIDADE):
+            estado.rejeitadas += 1
+            await self._rejeitar(send, estado.retry_after)
+            return
+
+        estado.em_voo += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            estado.em_voo -= 1
+
+    @staticmethod
+    async def _rejeitar(send, retry_after: int):
+        corpo = json.dumps({"detail": "Servidor sobrecarregado, tente novamente mais tarde"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(corpo)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": corpo})
@@ -0,0 +1,115 @@
+"""
+Módulo de Arquivamento de Tarefas Concluídas
+
+As tarefas concluídas acumulam-se na tabela `tarefas` e tornam maiores os
+índices que todas as listagens percorrem. Este ficheiro implementa um
+arquivador em segundo plano que, periodicamente, move as tarefas concluídas
+há mais de uma certa idade para a tabela `tarefas_arquivo`, em lotes de
+tamanho limitado (uma transação curta por lote).
+
+As tarefas arquivadas continuam acessíveis em `GET /tarefas/arquivo` e podem
+ser restauradas. O arquivador é ativado por variáveis de ambiente (ver
+`configurar_a_partir_do_ambiente`) e iniciado no `lifespan` da aplicação.
+"""
+import asyncio
+import os
+from datetime import timedelta
+
+import crud
+import registos
+import shards
+
+
+class Arquivador:
+    """
+    Tarefa em segundo plano que arquiva as tarefas concluídas há mais tempo.
+
+    Args:
+        fabrica_de_sessoes: Fábrica de sessões assíncronas (ex.: `database.SessionLocal`).
+        idade: Tempo desde a conclusão a partir do qual uma tarefa é arquivada.
+        intervalo: Segundos entre duas execuções.
+        tamanho_lote: Número máximo de tarefas movidas por transação.
+    """
+
+    def __init__(self, fabrica_de_sessoes, idade: timedelta, intervalo: float = 3600, tamanho_lote: int = 1000):
+        self.fabrica_de_sessoes = fabrica_de_sessoes
+        self.idade = idade
+        self.intervalo = intervalo
+        self.tamanho_lote = tamanho_lote
+        self._tarefa_de_fundo: asyncio.Task | None = None
+
+    async def iniciar(self):
+        """Arranca o ciclo do arquivador em segundo plano."""
+        if self._tarefa_de_fundo is None:
+            self._tarefa_de_fundo = asyncio.create_task(self._executar())
+
+    async def parar(self):
+        """Termina o arquivador. Um lote interrompido é desfeito pelo rollback da sua transação."""
+        if self._tarefa_de_fundo is not None:
+            self._tarefa_de_fundo.cancel()
+            try:
+                await self._tarefa_de_fundo
+            except asyncio.CancelledError:
+                pass
+            self._tarefa_de_fundo = None
+
+    async def arquivar(self) -> int:
+        """
+        Arquiva, lote a lote, todas as tarefas que já atingiram a idade
+        (em cada shard, no modo de sharding).
+
+        Returns:
+            O número total de tarefas arquivadas.
+        """
+        limite = crud.agora_utc() - self.idade
+        total = 0
+        for fabrica in shards.todas_as_fabricas(self.fabrica_de_sessoes):
+            while True:
+                async with fabrica() as db:
+                    movidas = await crud.arquivar_tarefas_concluidas(db, limite, self.tamanho_lote)
+                total += movidas
+                if movidas < self.tamanho_lote:
+                    break
+                await asyncio.sleep(0)  # Deixa as requisições correr entre lotes
+        return total
+
+    async def _executar(self):
+        """Ciclo principal: arquiva e espera pelo próximo intervalo, até ser cancelado."""
+        while True:
+            try:
+                total = await self.arquivar()
+                if total:
+                    registos.logger.info("Arquivo: %d tarefas concluídas arquivadas", total)
+            except Exception:
+                # Uma falha (ex.: banco de dados indisponível) não termina o ciclo.
+                registos.logger.exception("Arquivo: falha ao arquivar tarefas")
+            await asyncio.sleep(self.intervalo)
+
+
+# --- Instância Global da Aplicação ---
+
+# None quando o arquivamento está desativado (o padrão).
+arquivador: Arquivador | None = None
+
+
+def configurar_a_partir_do_ambiente(fabrica_de_sessoes) -> Arquivador | None:
+    """
+    Cria o arquivador global se `ARQUIVO_ATIVO` estiver ativa.
+
+    Variáveis de ambiente:
+        ARQUIVO_ATIVO: "1"/"true" para ativar (padrão: desativado).
+        ARQUIVO_IDADE_DIAS: dias desde a conclusão até ao arquivamento (padrão: 30).
+        ARQUIVO_INTERVALO_S: segundos entre execuções (padrão: 3600).
+        ARQUIVO_TAMANHO_LOTE: tarefas por transação (padrão: 1000).
+    """
+    global arquivador
+    if os.getenv("ARQUIVO_ATIVO", "").lower() not in ("1", "true", "sim"):
+        arquivador = None
+        return None
+    arquivador = Arquivador(
+        fabrica_de_sessoes,
+        idade=timedelta(days=float(os.getenv("ARQUIVO_IDADE_DIAS", "30"))),
+        intervalo=float(os.getenv("ARQUIVO_INTERVALO_S", "3600")),
+        tamanho_lote=int(os.getenv("ARQUIVO_TAMANHO_LOTE", "1000")),
+    )
+    return arquivador
@@ -8,6 +8,7 @@ para proteger os endpoints da API.
 
 # 1. Imports da Biblioteca Padrão
 import os
+import time
 from datetime import datetime, timedelta, timezone
 
 # 2. Imports de Terceiros (Libs)
@@ -20,6 +21,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from typing import TYPE_CHECKING
 
 # 3. Imports Locais da Aplicação
+import admissao
+import shards
 from database import SessionLocal
 
 if TYPE_CHECKING:
@@ -83,8 +86,22 @@ async def get_db():
     """
     Dependência do FastAPI que cria e fornece uma sessão de banco de dados
     para uma requisição e garante que ela seja fechada ao final.
+
+    No modo de sharding, a sessão ainda não aponta para nenhum banco de dados:
+    o shard é escolhido a partir do token (`get_usuario_atual`) ou do email
+    (`crud.get_usuario_por_email`), e a espera pelo pool é medida nesse momento.
     """
+    if shards.mapa is not None:
+        async with shards.mapa.fabrica_roteada() as db:
+            yield db
+        return
+
     async with SessionLocal() as db:
+        # Obtém já a ligação do pool para medir a espera; o controlo de admissão
+        # usa esta métrica para detetar a saturação do banco de dados.
+        inicio = time.perf_counter()
+        await db.connection()
+        admissao.estado.registar_espera_pool(time.perf_counter() - inicio)
         try:
             yield db
         finally:
@@ -117,13 +134,24 @@ async def get_usuario_atual(
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
+        # O "uid" liga o token à conta concreta: se a conta for apagada e o email
+        # registado de novo, os tokens antigos não dão acesso à nova conta.
+        usuario_id = payload.get("uid")
+        # No modo de sharding, o "shd" indica o shard do utilizador, evitando
+        # consultar o diretório em cada requisição.
+        shard = payload.get("shd")
     except JWTError:
         # Se a decodificação falhar (token inválido, expirado, etc.), levanta a exceção
         raise credentials_exception
 
+    if shards.mapa is not None and shard is not None:
+        if not isinstance(shard, int) or not 0 <= shard < len(shards.mapa):
+            raise credentials_exception
+        await shards.selecionar(db, shard)
+
     # Com o email extraído, busca o utilizador no banco de dados
     usuario = await crud.get_usuario_por_email(db, email=email)
-    if usuario is None:
+    if usuario is None or (usuario_id is not None and usuario.id != usuario_id):
         # Se o utilizador não for encontrado no banco, o token não é mais válido
         raise credentials_exception
 
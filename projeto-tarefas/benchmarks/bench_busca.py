@@ -0,0 +1,120 @@
+"""
+Benchmark da Pesquisa de Texto
+
+Preenche um banco SQLite temporário com N tarefas (padrão: 1 milhão) repartidas
+por U utilizadores (padrão: 10, ou seja, contas muito grandes) e compara, para
+termos de frequências diferentes, a consulta FTS5 usada pelo endpoint
+`GET /tarefas/busca` com um `LIKE '%termo%'` sobre o título e a descrição.
+
+O texto é gerado com um vocabulário de 20 000 palavras com distribuição de Zipf,
+como numa língua natural: poucas palavras muito frequentes e muitas raras.
+
+Uso (a partir da pasta `projeto-tarefas`):
+
+    python -m benchmarks.bench_busca [numero_de_tarefas] [numero_de_utilizadores]
+"""
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert, or_, select
+from sqlalchemy.orm import Session
+
+import busca
+import models
+from database import Base
+
+SILABAS = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "xo", "zu", "tra", "cre", "pli"]
+
+
+def gerar_vocabulario(tamanho: int = 20_000) -> list[str]:
+    """Palavras artificiais distintas (3 a 4 sílabas), ordenadas por frequência decrescente."""
+    palavras = ["".join(s) for n in (3, 4) for s in itertools.product(SILABAS, repeat=n)]
+    random.Random(7).shuffle(palavras)
+    return palavras[:tamanho]
+
+
+def preencher(engine, quantidade: int, utilizadores: int, vocabulario: list[str]):
+    """Cria as tabelas (com o índice FTS5 e os triggers) e insere as tarefas."""
+    Base.metadata.create_all(engine)
+    aleatorio = random.Random(42)
+    pesos = list(itertools.accumulate(1 / posicao for posicao in range(1, len(vocabulario) + 1)))
+
+    def texto(k: int) -> str:
+        return " ".join(aleatorio.choices(vocabulario, cum_weights=pesos, k=k))
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.Usuario), [
+            {"id": i, "email": f"u{i}@exemplo.com", "senha_hash": "x"} for i in range(1, utilizadores + 1)
+        ])
+        for inicio in range(0, quantidade, 50_000):
+            conn.execute(insert(models.Tarefa), [
+                {
+                    "titulo": texto(3).capitalize(),
+                    "descricao": texto(8),
+                    "concluida": False,
+                    "prioridade": "verde",
+                    "dono_id": aleatorio.randint(1, utilizadores),
+                }
+                for _ in range(inicio, min(inicio + 50_000, quantidade))
+            ])
+
+
+def consulta_like(dono_id: int, termos: list[str]):
+    query = select(models.Tarefa).filter(models.Tarefa.dono_id == dono_id)
+    for termo in termos:
+        padrao = f"%{termo}%"
+        query = query.filter(or_(models.Tarefa.titulo.like(padrao), models.Tarefa.descricao.like(padrao)))
+    return query
+
+
+def medir(engine, query, repeticoes: int = 5) -> tuple[float, int]:
+    """Tempo médio (ms) e número de linhas de uma página de 20 resultados, como na API."""
+    with Session(engine) as db:
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            linhas = db.execute(query.limit(20)).scalars().all()
+            db.expunge_all()
+        return (time.perf_counter() - inicio) / repeticoes * 1000, len(linhas)
+
+
+def main(quantidade: int = 1_000_000, utilizadores: int = 10):
+    vocabulario = gerar_vocabulario()
+    pesquisas = {
+        "muito frequente": vocabulario[0],
+        "frequência média": vocabulario[200],
+        "rara": vocabulario[15_000],
+        "dois termos": f"{vocabulario[3]} {vocabulario[40]}",
+        "prefixo": vocabulario[500][:5],
+        "inexistente": "inexistente",
+    }
+
+    with tempfile.TemporaryDirectory() as pasta:
+        engine = create_engine(f"sqlite:///{os.path.join(pasta, 'bench.db')}")
+        inicio = time.perf_counter()
+        preencher(engine, quantidade, utilizadores, vocabulario)
+        print(f"{quantidade} tarefas de {utilizadores} utilizadores inseridas em {time.perf_counter() - inicio:.1f} s\n")
+
+        print(f"{'pesquisa':<20}{'termos':<22}{'FTS5 (ms)':>11}{'LIKE (ms)':>11}{'linhas':>8}")
+        for nome, q in pesquisas.items():
+            termos = busca.extrair_termos(q)
+            tempo_fts, linhas = medir(engine, busca.consulta_de_busca("sqlite", 1, termos))
+            tempo_like, _ = medir(engine, consulta_like(1, termos))
+            print(f"{nome:<20}{q:<22}{tempo_fts:>11.2f}{tempo_like:>11.2f}{linhas:>8}")
+        engine.dispose()
+
+    print(
+        "\nNota: o LIKE não ordena por relevância e pára nos primeiros 20 resultados,"
+        "\npor isso só é rápido quando o termo é muito frequente; o FTS5 ordena todas"
+        "\nas correspondências pelo bm25, mas nunca percorre a tabela inteira."
+    )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+    )
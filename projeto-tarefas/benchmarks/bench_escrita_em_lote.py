@@ -0,0 +1,88 @@
+"""
+Benchmark da Escrita em Lote (Group Commit)
+
+Cria N tarefas com C pedidos concorrentes, primeiro com um commit por tarefa
+(`crud.create_tarefa_para_usuario`) e depois através do `EscritorEmLote`.
+Conta os commits emitidos (cada commit custa um fsync no SQLite) e mede o
+tempo total, num banco SQLite em ficheiro temporário.
+
+Uso (a partir da pasta `projeto-tarefas`):
+
+    python -m benchmarks.bench_escrita_em_lote [tarefas] [concorrencia] [janela_ms]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import crud
+import models
+import schemas
+from database import Base
+from escrita_em_lote import EscritorEmLote
+
+
+async def _medir(quantidade: int, concorrencia: int, criar):
+    """Executa `criar` `quantidade` vezes com no máximo `concorrencia` pedidos em voo."""
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def um_pedido(i: int):
+        async with semaforo:
+            await criar(schemas.TarefaCreate(titulo=f"Tarefa {i}"))
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(um_pedido(i) for i in range(quantidade)))
+    return time.perf_counter() - inicio
+
+
+async def main(quantidade: int = 2000, concorrencia: int = 100, janela_ms: float = 5):
+    with tempfile.TemporaryDirectory() as pasta:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(pasta, 'bench.db')}")
+        fabrica = async_sessionmaker(engine, expire_on_commit=False)
+        commits = {"total": 0}
+        event.listen(engine.sync_engine, "commit", lambda conn: commits.__setitem__("total", commits["total"] + 1))
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with fabrica() as db:
+            db.add(models.Usuario(id=1, email="bench@exemplo.com", senha_hash="x"))
+            await db.commit()
+
+        async def individual(tarefa):
+            async with fabrica() as db:
+                await crud.create_tarefa_para_usuario(db, tarefa, dono_id=1)
+
+        commits["total"] = 0
+        tempo_individual = await _medir(quantidade, concorrencia, individual)
+        commits_individual = commits["total"]
+
+        escritor = EscritorEmLote(fabrica, janela=janela_ms / 1000)
+        await escritor.iniciar()
+        commits["total"] = 0
+        tempo_lote = await _medir(
+            quantidade, concorrencia, lambda tarefa: escritor.criar_tarefa(tarefa, dono_id=1)
+        )
+        commits_lote = commits["total"]
+        await escritor.parar()
+        await engine.dispose()
+
+    print(f"{quantidade} tarefas, concorrência {concorrencia}, janela {janela_ms} ms\n")
+    print(f"{'modo':<14}{'commits':>9}{'tempo (s)':>12}{'tarefas/s':>12}")
+    for nome, n_commits, tempo in (
+        ("individual", commits_individual, tempo_individual),
+        ("em lote", commits_lote, tempo_lote),
+    ):
+        print(f"{nome:<14}{n_commits:>9}{tempo:>12.2f}{quantidade / tempo:>12.0f}")
+
+
+if __name__ == "__main__":
+    argumentos = sys.argv[1:]
+    asyncio.run(main(
+        quantidade=int(argumentos[0]) if len(argumentos) > 0 else 2000,
+        concorrencia=int(argumentos[1]) if len(argumentos) > 1 else 100,
+        janela_ms=float(argumentos[2]) if len(argumentos) > 2 else 5,
+    ))
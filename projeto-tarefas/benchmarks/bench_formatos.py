@@ -0,0 +1,72 @@
+"""
+Benchmark dos Formatos de Resposta
+
+Compara o tamanho do payload e o tempo de codificação de uma lista de tarefas
+nos três formatos suportados por `formatos.py`, usando como referência o JSON
+produzido a partir de `schemas.Tarefa` (o caminho padrão da API).
+
+Uso (a partir da pasta `projeto-tarefas`):
+
+    python -m benchmarks.bench_formatos [numero_de_tarefas]
+"""
+import gzip
+import json
+import sys
+import timeit
+from datetime import date, timedelta
+
+import formatos
+import models
+import schemas
+
+
+def gerar_tarefas(quantidade: int) -> list[models.Tarefa]:
+    """Gera tarefas em memória com conteúdo realista (sem banco de dados)."""
+    prioridades = [p.value for p in schemas.Prioridade]
+    return [
+        models.Tarefa(
+            id=i,
+            dono_id=1,
+            titulo=f"Tarefa número {i}",
+            descricao="Compilar os dados do trimestre e criar os gráficos." if i % 3 else None,
+            concluida=i % 2 == 0,
+            data_vencimento=date(2025, 1, 1) + timedelta(days=i % 365) if i % 4 else None,
+            prioridade=prioridades[i % 3],
+        )
+        for i in range(1, quantidade + 1)
+    ]
+
+
+def codificar_json(tarefas: list[models.Tarefa]) -> bytes:
+    """Reproduz o caminho padrão: validação com `schemas.Tarefa` e `json.dumps`."""
+    dados = [schemas.Tarefa.model_validate(t).model_dump(mode="json") for t in tarefas]
+    return json.dumps(dados, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def codificar_colunar(tarefas: list[models.Tarefa]) -> bytes:
+    dados = formatos.codificar_colunar(tarefas)
+    return json.dumps(dados, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def main(quantidade: int = 1000, repeticoes: int = 20):
+    tarefas = gerar_tarefas(quantidade)
+    codificadores = {
+        "json (schemas.Tarefa)": codificar_json,
+        "msgpack": formatos.codificar_msgpack,
+        "json colunar": codificar_colunar,
+    }
+
+    referencia = len(codificar_json(tarefas))
+    print(f"{quantidade} tarefas, {repeticoes} repetições\n")
+    print(f"{'formato':<24}{'bytes':>10}{'gzip':>10}{'% json':>9}{'ms/lista':>11}")
+    for nome, codificar in codificadores.items():
+        payload = codificar(tarefas)
+        tempo = timeit.timeit(lambda: codificar(tarefas), number=repeticoes) / repeticoes
+        print(
+            f"{nome:<24}{len(payload):>10}{len(gzip.compress(payload)):>10}"
+            f"{100 * len(payload) / referencia:>8.0f}%{tempo * 1000:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
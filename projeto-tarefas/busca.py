@@ -0,0 +1,137 @@
+"""
+Módulo de Pesquisa de Texto (Full-Text Search)
+
+Este ficheiro cria e consulta o índice de pesquisa sobre o título e a
+descrição das tarefas, usado pelo endpoint `GET /tarefas/busca`:
+
+- SQLite: uma tabela virtual FTS5 (`tarefas_fts`) com "conteúdo externo"
+  apontando para `tarefas`, mantida por triggers.
+- PostgreSQL: uma coluna gerada `tarefas.busca` (tsvector, título com peso A
+  e descrição com peso B) com um índice GIN.
+
+Em ambos os casos é o próprio banco de dados que mantém o índice sincronizado,
+em todas as escritas feitas por `crud.py` — incluindo as inserções em lote e
+as remoções em cascata, que não passam por objetos do ORM.
+
+A consulta suporta vários termos (todos obrigatórios), correspondência por
+prefixo ("relat" encontra "Relatório") e ordenação por relevância.
+"""
+import re
+
+from sqlalchemy import Column, DDL, Integer, MetaData, Table, event, func, literal_column, or_, select, text
+
+import models
+
+
+# --- Definição do Índice ---
+
+# A tabela FTS5 fica numa MetaData própria: o `create_all` da aplicação não a
+# cria diretamente (é criada pelos comandos DDL abaixo), mas as consultas podem usá-la.
+tarefas_fts = Table("tarefas_fts", MetaData(), Column("rowid", Integer))
+
+_DDL_SQLITE = [
+    # "remove_diacritics 2" faz com que "relatorio" encontre "Relatório".
+    """CREATE VIRTUAL TABLE IF NOT EXISTS tarefas_fts USING fts5(
+        titulo, descricao, content='tarefas', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS tarefas_fts_insert AFTER INSERT ON tarefas BEGIN
+        INSERT INTO tarefas_fts(rowid, titulo, descricao) VALUES (new.id, new.titulo, new.descricao);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tarefas_fts_delete AFTER DELETE ON tarefas BEGIN
+        INSERT INTO tarefas_fts(tarefas_fts, rowid, titulo, descricao)
+        VALUES ('delete', old.id, old.titulo, old.descricao);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tarefas_fts_update AFTER UPDATE OF titulo, descricao ON tarefas BEGIN
+        INSERT INTO tarefas_fts(tarefas_fts, rowid, titulo, descricao)
+        VALUES ('delete', old.id, old.titulo, old.descricao);
+        INSERT INTO tarefas_fts(rowid, titulo, descricao) VALUES (new.id, new.titulo, new.descricao);
+    END""",
+]
+
+_DDL_POSTGRES = [
+    """ALTER TABLE tarefas ADD COLUMN IF NOT EXISTS busca tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(titulo, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(descricao, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_tarefas_busca ON tarefas USING GIN (busca)",
+]
+
+
+def criar_indice(conn) -> None:
+    """
+    Cria o índice de pesquisa, se ainda não existir (operação idempotente).
+
+    Chamado automaticamente quando a tabela `tarefas` é criada e, no arranque,
+    por `database.create_tables`, para bancos de dados criados antes deste índice.
+    No SQLite, quando o índice é novo, é preenchido com as tarefas já existentes.
+
+    Args:
+        conn: Uma ligação síncrona (ex.: dentro de `run_sync`).
+    """
+    if conn.dialect.name == "sqlite":
+        existia = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tarefas_fts'")
+        ).first() is not None
+        for comando in _DDL_SQLITE:
+            conn.execute(text(comando))
+        if not existia:
+            conn.execute(text("INSERT INTO tarefas_fts(tarefas_fts) VALUES ('rebuild')"))
+    elif conn.dialect.name == "postgresql":
+        # A coluna gerada é calculada para as linhas existentes no próprio ALTER TABLE.
+        for comando in _DDL_POSTGRES:
+            conn.execute(text(comando))
+
+
+event.listen(models.Tarefa.__table__, "after_create", lambda tabela, conn, **kw: criar_indice(conn))
+event.listen(
+    models.Tarefa.__table__, "before_drop",
+    DDL("DROP TABLE IF EXISTS tarefas_fts").execute_if(dialect="sqlite"),
+)
+
+
+# --- Consulta ---
+
+def extrair_termos(q: str) -> list[str]:
+    """
+    Divide a pesquisa em termos (apenas letras, dígitos e '_').
+    Descartar a pontuação evita que o texto do utilizador seja interpretado
+    como sintaxe de consulta do FTS5 ou do tsquery.
+    """
+    return re.findall(r"\w+", q.lower())
+
+
+def consulta_de_busca(dialeto: str, dono_id: int, termos: list[str]):
+    """
+    Constrói o SELECT das tarefas de um utilizador que contêm todos os termos,
+    por prefixo, ordenadas por relevância (e pelo ID, para uma paginação estável).
+
+    Args:
+        dialeto: O nome do dialeto do banco de dados ("sqlite", "postgresql", ...).
+        dono_id: O ID do utilizador dono das tarefas.
+        termos: Os termos devolvidos por `extrair_termos` (não vazio).
+    """
+    query = select(models.Tarefa).filter(models.Tarefa.dono_id == dono_id)
+
+    if dialeto == "sqlite":
+        correspondencia = " ".join(f'"{termo}"*' for termo in termos)
+        return (
+            query.join(tarefas_fts, tarefas_fts.c.rowid == models.Tarefa.id)
+            .filter(text("tarefas_fts MATCH :correspondencia").bindparams(correspondencia=correspondencia))
+            # bm25: menor é melhor; o título pesa 10 vezes mais do que a descrição.
+            .order_by(text("bm25(tarefas_fts, 10.0, 1.0)"), models.Tarefa.id)
+        )
+
+    if dialeto == "postgresql":
+        tsquery = func.to_tsquery("simple", " & ".join(f"{termo}:*" for termo in termos))
+        vetor = literal_column("tarefas.busca")
+        return (
+            query.filter(vetor.op("@@")(tsquery))
+            .order_by(func.ts_rank(vetor, tsquery).desc(), models.Tarefa.id)
+        )
+
+    # Outros bancos de dados: sem índice, cada termo tem de aparecer no título ou na descrição.
+    for termo in termos:
+        padrao = f"%{termo}%"
+        query = query.filter(or_(models.Tarefa.titulo.ilike(padrao), models.Tarefa.descricao.ilike(padrao)))
+    return query.order_by(models.Tarefa.id)
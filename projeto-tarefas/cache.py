@@ -0,0 +1,342 @@
+"""
+Módulo de Cache de Leitura (Read-Through)
+
+Este ficheiro implementa uma camada de cache à volta das leituras de tarefas
+(`crud.get_tarefa` e `crud.get_tarefas_por_usuario`), para que pedidos
+repetidos sobre dados que não mudaram não cheguem ao banco de dados.
+
+- Dois backends: `CacheEmMemoria` (LRU no processo, com limite de tamanho e TTL)
+  e `CacheRedis` (qualquer servidor que fale o protocolo Redis/RESP).
+- As escritas em `crud.py` invalidam com precisão, depois do commit: a chave
+  de cada tarefa alterada leva a sua "versão", e as páginas da lista do dono a
+  sua "geração"; a escrita incrementa ambas, e as entradas antigas deixam de
+  ser lidas. Um carregamento que leu a linha antiga grava-a com a versão (ou a
+  geração) anterior, pelo que nunca é servida depois da escrita.
+- Várias falhas (misses) simultâneas para a mesma chave fazem uma única
+  consulta ao banco de dados (single-flight).
+- Qualquer erro do backend é tratado como um miss: o cache nunca faz falhar uma requisição.
+
+Configuração: CACHE_URL ("" desativa, "memoria" ou "redis://host:porta/db"),
+CACHE_TTL_S (padrão 60), CACHE_MAX_ITENS (padrão 10000, só para a memória) e
+CACHE_TEMPO_LIMITE_S (padrão 1, por comando do Redis).
+"""
+import asyncio
+import json
+import os
+import ssl
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Awaitable, Callable, Iterable
+from urllib.parse import quote, urlparse
+
+import registos
+
+
+# --- Backends ---
+
+class CacheEmMemoria:
+    """
+    Cache LRU no próprio processo, com limite de itens e TTL por item.
+    Cada worker tem a sua cópia; use o `CacheRedis` com vários workers.
+    """
+
+    def __init__(self, max_itens: int = 10000):
+        self.max_itens = max_itens
+        self._itens: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        # Os contadores ficam fora do LRU: perder um faria voltar a uma geração
+        # antiga, cujas listas podem ainda estar em cache. Os de geração não
+        # expiram; os que têm prazo (as versões das tarefas) ficam por ordem de prazo.
+        self._contadores: dict[str, int] = {}
+        self._contadores_com_prazo: OrderedDict[str, tuple[float, int]] = OrderedDict()
+
+    async def obter(self, chave: str) -> str | None:
+        if chave in self._contadores:
+            return str(self._contadores[chave])
+        contador = self._contadores_com_prazo.get(chave)
+        if contador is not None and contador[0] >= time.monotonic():
+            return str(contador[1])
+        item = self._itens.get(chave)
+        if item is None:
+            return None
+        expira_em, valor = item
+        if expira_em < time.monotonic():
+            del self._itens[chave]
+            return None
+        self._itens.move_to_end(chave)
+        return valor
+
+    async def definir(self, chave: str, valor: str, ttl: float):
+        self._itens[chave] = (time.monotonic() + ttl, valor)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+
+    async def incrementar(self, chave: str, ttl: float | None = None) -> int:
+        if ttl is None:
+            self._contadores[chave] = self._contadores.get(chave, 0) + 1
+            return self._contadores[chave]
+        agora = time.monotonic()
+        while self._contadores_com_prazo and next(iter(self._contadores_com_prazo.values()))[0] < agora:
+            self._contadores_com_prazo.popitem(last=False)
+        _, valor = self._contadores_com_prazo.pop(chave, (0, 0))
+        self._contadores_com_prazo[chave] = (agora + ttl, valor + 1)
+        return valor + 1
+
+    async def fechar(self):
+        self._itens.clear()
+        self._contadores.clear()
+        self._contadores_com_prazo.clear()
+
+
+class ErroRedis(Exception):
+    """Erro devolvido pelo servidor Redis ou falha de protocolo."""
+
+
+class CacheRedis:
+    """
+    Cliente mínimo do protocolo Redis (RESP2), com os comandos usados pelo cache:
+    GET, SET (com PX), INCR e PEXPIRE. Usa uma única ligação, com os comandos em série.
+
+    Args:
+        url: "redis://[:senha@]host[:porta][/db]", ou "rediss://..." para uma ligação TLS
+             (com a verificação do certificado e do nome do servidor do `ssl` padrão).
+        tempo_limite: Segundos para ligar ou para enviar um comando e ler a resposta.
+    """
+
+    def __init__(self, url: str, tempo_limite: float = 1.0):
+        partes = urlparse(url)
+        self.host = partes.hostname or "localhost"
+        self.porta = partes.port or 6379
+        self.senha = partes.password
+        self.db = int(partes.path.lstrip("/") or 0)
+        self.ssl = ssl.create_default_context() if partes.scheme == "rediss" else None
+        self.tempo_limite = tempo_limite
+        self._leitor: asyncio.StreamReader | None = None
+        self._escritor: asyncio.StreamWriter | None = None
+        self._trinco = asyncio.Lock()
+
+    async def _ligar(self):
+        self._leitor, self._escritor = await asyncio.open_connection(self.host, self.porta, ssl=self.ssl)
+        if self.senha:
+            await self._enviar("AUTH", self.senha)
+        if self.db:
+            await self._enviar("SELECT", self.db)
+
+    async def _enviar(self, *argumentos):
+        pedido = [f"*{len(argumentos)}\r\n".encode()]
+        for argumento in argumentos:
+            dados = argumento if isinstance(argumento, bytes) else str(argumento).encode()
+            pedido.append(b"$%d\r\n%s\r\n" % (len(dados), dados))
+        self._escritor.write(b"".join(pedido))
+        await self._escritor.drain()
+        return await self._ler_resposta()
+
+    async def _ler_resposta(self):
+        linha = await self._leitor.readline()
+        if not linha:
+            raise ConnectionError("Ligação ao Redis fechada")
+        tipo, conteudo = linha[:1], linha[1:-2]
+        if tipo == b"+":
+            return conteudo.decode()
+        if tipo == b"-":
+            raise ErroRedis(conteudo.decode())
+        if tipo == b":":
+            return int(conteudo)
+        if tipo == b"$":
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            dados = await self._leitor.readexactly(tamanho + 2)
+            return dados[:-2].decode()
+        if tipo == b"*":
+            return [await self._ler_resposta() for _ in range(int(conteudo))]
+        raise ErroRedis(f"Resposta inesperada: {linha!r}")
+
+    async def comando(self, *argumentos):
+        """Executa um comando, abrindo (ou reabrindo) a ligação se necessário."""
+        async with self._trinco:
+            try:
+                if self._escritor is None or self._escritor.is_closing():
+                    await asyncio.wait_for(self._ligar(), self.tempo_limite)
+                return await asyncio.wait_for(self._enviar(*argumentos), self.tempo_limite)
+            except BaseException:
+                # Um comando interrompido (erro, tempo limite ou cancelamento) pode deixar
+                # a sua resposta por ler, e o seguinte leria a resposta errada.
+                self._fechar_ligacao()
+                raise
+
+    def _fechar_ligacao(self):
+        if self._escritor is not None:
+            self._escritor.close()
+        self._leitor = self._escritor = None
+
+    async def obter(self, chave: str) -> str | None:
+        return await self.comando("GET", chave)
+
+    async def definir(self, chave: str, valor: str, ttl: float):
+        await self.comando("SET", chave, valor, "PX", int(ttl * 1000))
+
+    async def incrementar(self, chave: str, ttl: float | None = None) -> int:
+        valor = await self.comando("INCR", chave)
+        if ttl is not None:
+            await self.comando("PEXPIRE", chave, int(ttl * 1000))
+        return valor
+
+    async def fechar(self):
+        self._fechar_ligacao()
+
+
+def criar_backend(url: str):
+    """Cria o backend indicado por `CACHE_URL`, ou None se o cache estiver desativado."""
+    if not url:
+        return None
+    if url == "memoria":
+        return CacheEmMemoria(max_itens=int(os.getenv("CACHE_MAX_ITENS", "10000")))
+    if url.startswith(("redis://", "rediss://")):
+        return CacheRedis(url, tempo_limite=float(os.getenv("CACHE_TEMPO_LIMITE_S", "1")))
+    raise ValueError(f"CACHE_URL não suportada: {url!r}")
+
+
+# --- Instância Global da Aplicação ---
+
+TTL = float(os.getenv("CACHE_TTL_S", "60"))
+backend = criar_backend(os.getenv("CACHE_URL", ""))
+
+# Carregamentos em curso por chave (single-flight), só dentro deste processo.
+_em_voo: dict[str, asyncio.Future] = {}
+
+
+# --- Chaves ---
+
+# No modo de sharding, os IDs só são únicos dentro de cada shard (ver shards.py),
+# por isso as chaves levam o shard; sem sharding (`shard` None), não levam.
+
+def _prefixo(shard: int | None) -> str:
+    return "tarefas" if shard is None else f"tarefas:s{shard}"
+
+
+def _chave_geracao(dono_id: int, shard: int | None = None) -> str:
+    return f"{_prefixo(shard)}:geracao:{dono_id}"
+
+
+def _chave_versao(tarefa_id: int, shard: int | None = None) -> str:
+    return f"{_prefixo(shard)}:versao:{tarefa_id}"
+
+
+async def _contador(chave: str) -> str:
+    return await _seguro(backend.obter(chave)) or "0"
+
+
+async def chave_tarefa(tarefa_id: int, shard: int | None = None) -> str:
+    """Chave de uma tarefa, na sua versão atual."""
+    return f"{_prefixo(shard)}:item:{tarefa_id}:{await _contador(_chave_versao(tarefa_id, shard))}"
+
+
+async def chave_lista(
+    dono_id: int, skip: int, limit: int, shard: int | None = None, etiquetas: Iterable[str] = ()
+) -> str:
+    """Chave de uma página da lista (filtrada pelas `etiquetas`, se houver), na geração atual das tarefas do utilizador."""
+    geracao = await _contador(_chave_geracao(dono_id, shard))
+    chave = f"{_prefixo(shard)}:lista:{dono_id}:{geracao}:{skip}:{limit}"
+    if etiquetas:
+        # Codificados, para que um ":" ou uma "," num nome não gere colisões.
+        chave += ":" + ",".join(quote(nome, safe="") for nome in sorted(set(etiquetas)))
+    return chave
+
+
+# --- Leitura e Invalidação ---
+
+async def _seguro(operacao: Awaitable, padrao=None):
+    """Executa uma operação do backend; em caso de erro, regista-o e devolve `padrao`."""
+    try:
+        return await operacao
+    except Exception as erro:
+        registos.logger.warning("Cache indisponível: %s", erro)
+        return padrao
+
+
+async def obter_ou_carregar(chave: str, carregar: Callable[[], Awaitable]):
+    """
+    Devolve o valor em cache para `chave` ou, num miss, chama `carregar()` e guarda o resultado.
+
+    Pedidos simultâneos para a mesma chave esperam pelo mesmo carregamento.
+    Resultados `None` (ex.: tarefa inexistente) não são guardados.
+
+    Args:
+        chave: A chave do cache.
+        carregar: Corrotina sem argumentos que lê o valor do banco de dados.
+                  Deve devolver um valor serializável em JSON.
+    """
+    valor = await _seguro(backend.obter(chave))
+    if valor is not None:
+        return json.loads(valor)
+
+    if chave in _em_voo:
+        return await asyncio.shield(_em_voo[chave])
+
+    futuro = asyncio.get_running_loop().create_future()
+    _em_voo[chave] = futuro
+    try:
+        resultado = await carregar()
+        if resultado is not None:
+            await _seguro(backend.definir(chave, json.dumps(resultado), TTL))
+        futuro.set_result(resultado)
+        return resultado
+    except Exception as erro:
+        futuro.set_exception(erro)
+        futuro.exception()  # Marca a exceção como lida se ninguém estiver à espera
+        raise
+    except BaseException:  # Ex.: o pedido que carregava foi cancelado
+        futuro.cancel()
+        raise
+    finally:
+        del _em_voo[chave]
+
+
+async def invalidar(dono_id: int, *tarefa_ids: int, shard: int | None = None):
+    """
+    Invalida as tarefas indicadas (mudando a sua versão) e todas as páginas da
+    lista do seu dono (mudando a sua geração).
+
+    Deve ser chamada depois do commit: um carregamento em curso que ainda tenha
+    lido os dados antigos grava-os com a versão anterior, que já não é lida.
+    As versões expiram ao fim de dois TTL sem escritas, quando já não há
+    entradas gravadas com elas; assim, não se acumula uma por tarefa escrita.
+    """
+    if backend is None:
+        return
+    for tarefa_id in tarefa_ids:
+        await _seguro(backend.incrementar(_chave_versao(tarefa_id, shard), ttl=2 * TTL))
+    await _seguro(backend.incrementar(_chave_geracao(dono_id, shard)))
+
+
+async def fechar():
+    """Fecha a ligação do backend (chamado no shutdown da aplicação)."""
+    if backend is not None:
+        await backend.fechar()
+
+
+# --- Conversão de Tarefas ---
+
+def tarefa_para_dict(tarefa) -> dict:
+    """Converte uma tarefa (modelo SQLAlchemy) num dicionário serializável em JSON."""
+    dados = {coluna.key: getattr(tarefa, coluna.key) for coluna in tarefa.__table__.columns}
+    for campo in ("data_vencimento", "concluida_em"):
+        if dados.get(campo) is not None:
+            dados[campo] = dados[campo].isoformat()
+    # Com o ID, para que a tarefa reconstruída possa mudar de etiquetas (ver `crud._tarefa_do_cache`).
+    dados["etiquetas"] = [{"id": etiqueta.id, "nome": etiqueta.nome} for etiqueta in tarefa.etiquetas]
+    return dados
+
+
+def dict_para_colunas(dados: dict) -> dict:
+    """Inverso de `tarefa_para_dict`: devolve os valores das colunas prontos para o modelo (sem as etiquetas)."""
+    dados = dict(dados)
+    dados.pop("etiquetas", None)
+    if dados.get("data_vencimento") is not None:
+        dados["data_vencimento"] = date.fromisoformat(dados["data_vencimento"])
+    # Entradas guardadas antes de a coluna existir não têm "concluida_em".
+    if dados.setdefault("concluida_em", None) is not None:
+        dados["concluida_em"] = datetime.fromisoformat(dados["concluida_em"])
+    return dados
@@ -5,14 +5,32 @@ Este ficheiro centraliza toda a lógica de interação com o banco de dados.
 Cada função aqui é responsável por uma operação atómica na base de dados,
 mantendo a camada de API (main.py) limpa e focada na lógica de negócio.
 """
-from sqlalchemy import select
+import os
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import DateTime, case, delete, func, insert, literal, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
+import busca
+import cache
 import models
 import schemas
+import shards
 from auth import pwd_context
 
 
+# Com RESUMO_CONTADORES ativo, as escritas mantêm a tabela `contagem_tarefas`
+# e o resumo lê-a em vez de agregar as tarefas.
+CONTADORES_ATIVOS = os.getenv("RESUMO_CONTADORES", "").lower() in ("1", "true", "sim")
+
+# Tarefas apagadas por transação quando uma conta é purgada em segundo plano
+# (`purgar_usuario`, chamada por `DELETE /usuarios/me` e retomada no arranque).
+REMOCAO_TAMANHO_LOTE = int(os.getenv("REMOCAO_TAMANHO_LOTE", "1000"))
+
+
 # --- Funções CRUD para Utilizadores ---
 
 async def get_usuario_por_email(db: AsyncSession, email: str) -> models.Usuario | None:
@@ -26,6 +44,10 @@ async def get_usuario_por_email(db: AsyncSession, email: str) -> models.Usuario
     Returns:
         O objeto do modelo Usuario ou None se não for encontrado.
     """
+    # No modo de sharding, encaminha a sessão para o shard do email, se ainda
+    # não tiver sido escolhido (ex.: pelo claim "shd" do token).
+    if shards.mapa is not None and shards.shard_da_sessao(db) is None:
+        await shards.selecionar(db, await shards.mapa.indice_de(email))
     result = await db.execute(select(models.Usuario).filter(models.Usuario.email == email))
     return result.scalar_one_or_none()
 
@@ -50,6 +72,100 @@ async def create_usuario(db: AsyncSession, usuario: schemas.UsuarioCreate) -> mo
     return db_usuario
 
 
+# --- Remoção de Contas ---
+
+# Domínio reservado (RFC 2606) usado para "libertar" o email de uma conta em remoção.
+DOMINIO_CONTA_REMOVIDA = "conta-removida.invalid"
+
+
+async def contar_tarefas_do_usuario(db: AsyncSession, dono_id: int) -> int:
+    """Conta as tarefas de um utilizador, incluindo as arquivadas (usa os índices por dono)."""
+    ativas, arquivadas = (
+        select(func.count()).select_from(modelo).filter(modelo.dono_id == dono_id).scalar_subquery()
+        for modelo in (models.Tarefa, models.TarefaArquivada)
+    )
+    result = await db.execute(select(ativas + arquivadas))
+    return result.scalar_one()
+
+
+async def _ids_das_tarefas(
+    db: AsyncSession, dono_id: int, limite: int | None = None, modelo=models.Tarefa
+) -> list[int]:
+    """Lê apenas os IDs das tarefas (ou das tarefas arquivadas) de um utilizador, sem carregar os objetos."""
+    query = select(modelo.id).filter(modelo.dono_id == dono_id).order_by(modelo.id)
+    if limite is not None:
+        query = query.limit(limite)
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+
+async def delete_usuario(db: AsyncSession, db_usuario: models.Usuario) -> None:
+    """
+    Apaga um utilizador e todas as suas tarefas numa só transação.
+
+    Graças ao `passive_deletes=True`, o SQLAlchemy emite apenas o DELETE do
+    utilizador; as tarefas são apagadas pelo 'ON DELETE CASCADE' do banco de dados.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        db_usuario: O utilizador a apagar.
+    """
+    dono_id = db_usuario.id
+    # Os IDs só são necessários para invalidar as tarefas no cache.
+    tarefa_ids = await _ids_das_tarefas(db, dono_id) if cache.backend is not None else []
+    await db.delete(db_usuario)
+    await db.commit()
+    await cache.invalidar(dono_id, *tarefa_ids, shard=shards.shard_da_sessao(db))
+
+
+async def marcar_usuario_para_remocao(db: AsyncSession, db_usuario: models.Usuario) -> None:
+    """
+    Marca uma conta grande para remoção em segundo plano.
+
+    O email passa a um endereço reservado: os tokens emitidos para o email
+    antigo deixam de encontrar o utilizador, e o email fica livre para um novo registo.
+    """
+    db_usuario.email = f"removido+{db_usuario.id}@{DOMINIO_CONTA_REMOVIDA}"
+    await db.commit()
+
+
+async def get_ids_usuarios_em_remocao(db: AsyncSession) -> list[int]:
+    """Devolve os IDs das contas marcadas para remoção (ex.: para retomar após um reinício)."""
+    result = await db.execute(
+        select(models.Usuario.id).filter(models.Usuario.email.like(f"%@{DOMINIO_CONTA_REMOVIDA}"))
+    )
+    return list(result.scalars().all())
+
+
+async def purgar_usuario(fabrica_de_sessoes, usuario_id: int, tamanho_lote: int = 1000) -> None:
+    """
+    Apaga as tarefas (ativas e arquivadas) de um utilizador em lotes e, no fim,
+    o próprio utilizador.
+
+    Cada lote é uma transação curta, para não bloquear a tabela nem gerar uma
+    única transação gigante em contas com muitas tarefas.
+
+    Args:
+        fabrica_de_sessoes: Fábrica de sessões (a sessão da requisição já estará fechada).
+        usuario_id: O ID do utilizador a remover.
+        tamanho_lote: Número máximo de tarefas apagadas por transação.
+    """
+    for modelo in (models.Tarefa, models.TarefaArquivada):
+        while True:
+            async with fabrica_de_sessoes() as db:
+                tarefa_ids = await _ids_das_tarefas(db, usuario_id, limite=tamanho_lote, modelo=modelo)
+                if not tarefa_ids:
+                    break
+                await db.execute(delete(modelo).filter(modelo.id.in_(tarefa_ids)))
+                await db.commit()
+            await cache.invalidar(usuario_id, *tarefa_ids, shard=shards.shard_da_sessao(db))
+
+    async with fabrica_de_sessoes() as db:
+        await db.execute(delete(models.Usuario).filter(models.Usuario.id == usuario_id))
+        await db.commit()
+    await cache.invalidar(usuario_id, shard=shards.shard_da_sessao(db))
+
+
 # --- Funções CRUD para Tarefas ---
 
 async def get_tarefa(db: AsyncSession, tarefa_id: int) -> models.Tarefa | None:
@@ -63,75 +179,261 @@ async def get_tarefa(db: AsyncSession, tarefa_id: int) -> models.Tarefa | None:
     Returns:
         O objeto do modelo Tarefa ou None se não for encontrado.
     """
-    result = await db.execute(select(models.Tarefa).filter(models.Tarefa.id == tarefa_id))
-    return result.scalar_one_or_none()
+    if cache.backend is None:
+        result = await db.execute(select(models.Tarefa).filter(models.Tarefa.id == tarefa_id))
+        return result.scalar_one_or_none()
+
+    async def carregar():
+        result = await db.execute(select(models.Tarefa).filter(models.Tarefa.id == tarefa_id))
+        db_tarefa = result.scalar_one_or_none()
+        return cache.tarefa_para_dict(db_tarefa) if db_tarefa is not None else None
+
+    dados = await cache.obter_ou_carregar(await cache.chave_tarefa(tarefa_id, shards.shard_da_sessao(db)), carregar)
+    if dados is None:
+        return None
+    # Associa a tarefa reconstruída à sessão sem emitir SQL, para que possa
+    # ser atualizada ou apagada como se tivesse sido lida agora.
+    return await db.merge(_tarefa_do_cache(dados), load=False)
+
+
+def _tarefa_do_cache(dados: dict) -> models.Tarefa:
+    """
+    Reconstrói uma tarefa, com as suas etiquetas, a partir de uma entrada do cache.
 
+    Os objetos ficam no estado "detached" (como se tivessem sido lidos e a sessão
+    fechada): as etiquetas contam como carregadas, e substituí-las numa
+    atualização gera apenas as alterações necessárias em `tarefas_etiquetas`.
+    """
+    etiquetas = []
+    for etiqueta in dados.get("etiquetas", []):
+        db_etiqueta = models.Etiqueta(id=etiqueta["id"], nome=etiqueta["nome"], dono_id=dados["dono_id"])
+        make_transient_to_detached(db_etiqueta)
+        etiquetas.append(db_etiqueta)
+    db_tarefa = models.Tarefa(**cache.dict_para_colunas(dados), etiquetas=etiquetas)
+    make_transient_to_detached(db_tarefa)
+    return db_tarefa
 
-async def get_tarefas_por_usuario(db: AsyncSession, dono_id: int, skip: int = 0, limit: int = 100) -> list[models.Tarefa]:
+
+async def get_tarefas_por_usuario(
+    db: AsyncSession, dono_id: int, skip: int = 0, limit: int = 100, etiquetas: list[str] | None = None
+) -> list[models.Tarefa]:
     """
     Retorna uma lista de tarefas de um utilizador específico, com suporte a paginação.
 
+    As etiquetas de todas as tarefas da página são carregadas por uma única
+    consulta adicional (`lazy="selectin"` em `models.Tarefa.etiquetas`).
+
     Args:
         db: A sessão assíncrona do banco de dados.
         dono_id: O ID do utilizador dono das tarefas.
         skip: O número de registos a pular (para paginação).
         limit: O número máximo de registos a retornar.
+        etiquetas: Se indicadas, apenas as tarefas com todas estas etiquetas.
 
     Returns:
         Uma lista de objetos do modelo Tarefa.
     """
-    result = await db.execute(
-        select(models.Tarefa)
-        .filter(models.Tarefa.dono_id == dono_id)
-        .offset(skip)
-        .limit(limit)
-    )
-    return result.scalars().all()
+    async def carregar():
+        query = select(models.Tarefa).filter(models.Tarefa.dono_id == dono_id)
+        if etiquetas:
+            nomes = set(etiquetas)
+            query = query.filter(models.Tarefa.id.in_(
+                select(models.tarefas_etiquetas.c.tarefa_id)
+                .join(models.Etiqueta, models.Etiqueta.id == models.tarefas_etiquetas.c.etiqueta_id)
+                .filter(models.Etiqueta.dono_id == dono_id, models.Etiqueta.nome.in_(nomes))
+                .group_by(models.tarefas_etiquetas.c.tarefa_id)
+                .having(func.count() == len(nomes))
+            ))
+        result = await db.execute(query.offset(skip).limit(limit))
+        return result.scalars().all()
 
+    if cache.backend is None:
+        return await carregar()
 
-async def create_tarefa_para_usuario(db: AsyncSession, tarefa: schemas.TarefaCreate, dono_id: int) -> models.Tarefa:
+    async def carregar_dicts():
+        return [cache.tarefa_para_dict(t) for t in await carregar()]
+
+    chave = await cache.chave_lista(dono_id, skip, limit, shards.shard_da_sessao(db), etiquetas or ())
+    dados = await cache.obter_ou_carregar(chave, carregar_dicts)
+    # Objetos apenas para leitura (serialização), fora da sessão.
+    return [_tarefa_do_cache(d) for d in dados]
+
+
+async def buscar_tarefas(
+    db: AsyncSession, dono_id: int, q: str, skip: int = 0, limit: int = 20
+) -> list[models.Tarefa]:
     """
-    Cria uma nova tarefa no banco de dados, associada a um utilizador.
+    Pesquisa as tarefas de um utilizador pelo título e pela descrição.
 
     Args:
         db: A sessão assíncrona do banco de dados.
-        tarefa: O objeto Pydantic com os dados da nova tarefa.
-        dono_id: O ID do utilizador que será o dono da tarefa.
+        dono_id: O ID do utilizador dono das tarefas.
+        q: O texto pesquisado; todos os termos têm de aparecer (por prefixo).
+        skip: O número de resultados a pular (para paginação).
+        limit: O número máximo de resultados a retornar.
 
     Returns:
-        O objeto do modelo Tarefa recém-criado.
+        Uma lista de objetos do modelo Tarefa, dos mais relevantes para os menos relevantes.
+    """
+    termos = busca.extrair_termos(q)
+    if not termos:
+        return []
+    query = busca.consulta_de_busca(db.get_bind().dialect.name, dono_id, termos)
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.scalars().all()
+
+
+def agora_utc() -> datetime:
+    """Data e hora atuais em UTC, sem fuso (como são guardadas nas colunas DateTime)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _dialeto_com_upsert(db: AsyncSession):
+    """
+    O módulo de dialeto do SQLAlchemy cujo `insert` suporta `on_conflict_do_nothing`
+    e `on_conflict_do_update` (INSERT ... ON CONFLICT), conforme o banco de dados da sessão.
+    """
+    nome = db.get_bind().dialect.name
+    if nome == "sqlite":
+        return sqlite
+    if nome == "postgresql":
+        return postgresql
+    raise NotImplementedError(f"INSERT ... ON CONFLICT não suportado para o banco de dados {nome!r}")
+
+
+async def _obter_etiquetas(db: AsyncSession, pares: set[tuple[int, str]]) -> dict[tuple[int, str], models.Etiqueta]:
+    """
+    Devolve as etiquetas pedidas, por (dono_id, nome), criando as que ainda não existem.
+
+    Uma consulta quando todas já existem; senão, um INSERT ... ON CONFLICT DO
+    NOTHING (duas criações simultâneas do mesmo nome não falham) e outra consulta.
+    O commit fica a cargo do chamador.
     """
-    # Cria a instância do modelo SQLAlchemy a partir dos dados do schema Pydantic
-    db_tarefa = models.Tarefa(
+    if not pares:
+        return {}
+
+    async def ler(pares_a_ler):
+        chave = tuple_(models.Etiqueta.dono_id, models.Etiqueta.nome)
+        result = await db.execute(select(models.Etiqueta).filter(chave.in_(sorted(pares_a_ler))))
+        return {(e.dono_id, e.nome): e for e in result.scalars()}
+
+    etiquetas = await ler(pares)
+    em_falta = pares - etiquetas.keys()
+    if em_falta:
+        dialeto = _dialeto_com_upsert(db)
+        await db.execute(
+            dialeto.insert(models.Etiqueta)
+            .values([{"dono_id": dono_id, "nome": nome} for dono_id, nome in sorted(em_falta)])
+            .on_conflict_do_nothing(index_elements=["dono_id", "nome"])
+        )
+        etiquetas.update(await ler(em_falta))
+    return etiquetas
+
+
+def _nova_tarefa(tarefa: schemas.TarefaCreate, dono_id: int) -> models.Tarefa:
+    """Cria a instância do modelo SQLAlchemy a partir dos dados do schema Pydantic."""
+    return models.Tarefa(
         titulo=tarefa.titulo,
         descricao=tarefa.descricao,
         concluida=tarefa.concluida,
         data_vencimento=tarefa.data_vencimento,
         prioridade=tarefa.prioridade.value,  # Pega o valor do Enum
+        concluida_em=agora_utc() if tarefa.concluida else None,
         dono_id=dono_id
     )
-    # Adiciona à sessão, commita e atualiza para obter o ID gerado
+
+
+async def create_tarefa_para_usuario(db: AsyncSession, tarefa: schemas.TarefaCreate, dono_id: int) -> models.Tarefa:
+    """
+    Cria uma nova tarefa no banco de dados, associada a um utilizador.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        tarefa: O objeto Pydantic com os dados da nova tarefa.
+        dono_id: O ID do utilizador que será o dono da tarefa.
+
+    Returns:
+        O objeto do modelo Tarefa recém-criado.
+    """
+    db_tarefa = _nova_tarefa(tarefa, dono_id)
+    if tarefa.etiquetas:
+        etiquetas = await _obter_etiquetas(db, {(dono_id, nome) for nome in tarefa.etiquetas})
+        db_tarefa.etiquetas = [etiquetas[(dono_id, nome)] for nome in tarefa.etiquetas]
+    # Adiciona à sessão, commita e atualiza para obter o ID gerado (e carregar as etiquetas)
     db.add(db_tarefa)
+    await _ajustar_contagens(db, Counter({_chave_contagem(db_tarefa): 1}))
     await db.commit()
     await db.refresh(db_tarefa)
+    await cache.invalidar(dono_id, shard=shards.shard_da_sessao(db))
     return db_tarefa
 
 
+async def create_tarefas_em_lote(
+    db: AsyncSession, itens: list[tuple[schemas.TarefaCreate, int]]
+) -> list[int]:
+    """
+    Cria várias tarefas (possivelmente de utilizadores diferentes) numa única transação.
+
+    Usado pelo escritor em lote (`escrita_em_lote.py`): um só commit, e portanto
+    um só fsync/flush do WAL, para todo o lote.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        itens: Pares (dados da tarefa, ID do dono), pela ordem de chegada.
+
+    Returns:
+        Os IDs gerados, na mesma ordem de `itens`.
+    """
+    db_tarefas = [_nova_tarefa(tarefa, dono_id) for tarefa, dono_id in itens]
+    # As etiquetas de todo o lote são resolvidas de uma só vez.
+    etiquetas = await _obter_etiquetas(
+        db, {(dono_id, nome) for tarefa, dono_id in itens for nome in tarefa.etiquetas or ()}
+    )
+    for db_tarefa, (tarefa, dono_id) in zip(db_tarefas, itens):
+        if tarefa.etiquetas:
+            db_tarefa.etiquetas = [etiquetas[(dono_id, nome)] for nome in tarefa.etiquetas]
+    db.add_all(db_tarefas)
+    # O flush envia os INSERTs e preenche os IDs; lemos antes do commit,
+    # que expira os atributos dos objetos.
+    await db.flush()
+    ids = [db_tarefa.id for db_tarefa in db_tarefas]
+    await _ajustar_contagens(db, Counter(_chave_contagem(db_tarefa) for db_tarefa in db_tarefas))
+    await db.commit()
+    for dono_id in {dono_id for _, dono_id in itens}:
+        await cache.invalidar(dono_id, shard=shards.shard_da_sessao(db))
+    return ids
+
+
 async def update_tarefa(
     db: AsyncSession, db_tarefa: models.Tarefa, tarefa_atualizada: schemas.TarefaCreate
 ) -> models.Tarefa:
     """Atualiza uma tarefa existente no banco de dados."""
+    # As chaves de contagem vêm da linha, antes e depois da escrita (ver `_chave_contagem_atual`).
+    antiga = await _chave_contagem_atual(db, db_tarefa.id)
+    # Regista o momento da conclusão apenas quando o estado muda.
+    if tarefa_atualizada.concluida != db_tarefa.concluida:
+        db_tarefa.concluida_em = agora_utc() if tarefa_atualizada.concluida else None
     db_tarefa.titulo = tarefa_atualizada.titulo
     db_tarefa.descricao = tarefa_atualizada.descricao
     db_tarefa.concluida = tarefa_atualizada.concluida
     db_tarefa.data_vencimento = tarefa_atualizada.data_vencimento
     db_tarefa.prioridade = tarefa_atualizada.prioridade.value
+    # Sem etiquetas no pedido (None), as atuais mantêm-se.
+    if tarefa_atualizada.etiquetas is not None:
+        etiquetas = await _obter_etiquetas(db, {(db_tarefa.dono_id, nome) for nome in tarefa_atualizada.etiquetas})
+        db_tarefa.etiquetas = [etiquetas[(db_tarefa.dono_id, nome)] for nome in tarefa_atualizada.etiquetas]
+    if antiga is not None:
+        await db.flush()
+        variacoes = Counter({antiga: -1})
+        variacoes.update([await _chave_contagem_atual(db, db_tarefa.id)])
+        await _ajustar_contagens(db, variacoes)
     await db.commit()
     await db.refresh(db_tarefa)
+    await cache.invalidar(db_tarefa.dono_id, db_tarefa.id, shard=shards.shard_da_sessao(db))
     return db_tarefa
 
 
-async def delete_tarefa(db: AsyncSession, db_tarefa: models.Tarefa) -> models.Tarefa:
+async def delete_tarefa(db: AsyncSession, db_tarefa: models.Tarefa) -> schemas.Tarefa:
     """
     Apaga uma tarefa do banco de dados.
 
@@ -140,8 +442,417 @@ async def delete_tarefa(db: AsyncSession, db_tarefa: models.Tarefa) -> models.Ta
         db_tarefa: O objeto SQLAlchemy da tarefa a ser deletada (já validado).
 
     Returns:
-        O objeto da tarefa que foi deletada.
+        Os dados da tarefa apagada, lidos antes da remoção: depois do commit,
+        o objeto já não pode carregar as etiquetas para a resposta.
+    """
+    apagada = schemas.Tarefa.model_validate(db_tarefa)
+    # Os valores contados vêm da linha apagada (RETURNING), e não do objeto, que
+    # pode vir do cache; se outro pedido já a apagou, os contadores não mudam.
+    result = await db.execute(
+        delete(models.Tarefa)
+        .where(models.Tarefa.id == db_tarefa.id)
+        .returning(models.Tarefa.dono_id, models.Tarefa.concluida, models.Tarefa.prioridade)
+    )
+    variacoes = Counter()
+    variacoes.subtract((dono_id, bool(concluida), prioridade) for dono_id, concluida, prioridade in result.all())
+    await _ajustar_contagens(db, variacoes)
+    await db.commit()
+    await cache.invalidar(apagada.dono_id, apagada.id, shard=shards.shard_da_sessao(db))
+    return apagada
+
+
+# --- Resumo de Tarefas ---
+
+def _chave_contagem(db_tarefa: models.Tarefa) -> tuple[int, bool, str]:
+    """A linha de `contagem_tarefas` em que uma tarefa é contada."""
+    return db_tarefa.dono_id, bool(db_tarefa.concluida), db_tarefa.prioridade
+
+
+async def _chave_contagem_atual(db: AsyncSession, tarefa_id: int) -> tuple[int, bool, str] | None:
+    """
+    Lê do banco de dados a chave de contagem de uma tarefa, bloqueando a linha até
+    ao commit (FOR UPDATE; o SQLite já serializa as escritas). None se a tarefa já
+    não existir, ou se os contadores estiverem desativados.
+
+    O objeto da tarefa pode vir do cache, ou ter sido lido antes de uma escrita
+    concorrente (e o ORM só escreve os atributos que mudaram em relação a ele):
+    as variações calculadas a partir dele desviariam os contadores.
+    """
+    if not CONTADORES_ATIVOS:
+        return None
+    result = await db.execute(
+        select(models.Tarefa.dono_id, models.Tarefa.concluida, models.Tarefa.prioridade)
+        .filter(models.Tarefa.id == tarefa_id)
+        .with_for_update()
+    )
+    linha = result.one_or_none()
+    return (linha.dono_id, bool(linha.concluida), linha.prioridade) if linha is not None else None
+
+
+async def _ajustar_contagens(db: AsyncSession, variacoes: Counter) -> None:
+    """
+    Soma as variações às linhas de `contagem_tarefas`, na transação da escrita.
+
+    Usa um único INSERT ... ON CONFLICT DO UPDATE (upsert), que cria as linhas em
+    falta e incrementa as existentes de forma atómica, mesmo com escritas concorrentes.
+    Nada faz se os contadores estiverem desativados.
+
+    Args:
+        db: A sessão assíncrona do banco de dados (o commit fica a cargo do chamador).
+        variacoes: Variação por (dono_id, concluida, prioridade); ex.: +1 numa criação.
+    """
+    if not CONTADORES_ATIVOS:
+        return
+    # As variações nulas (ex.: atualizar só o título) não geram escrita.
+    # A ordem fixa das linhas evita deadlocks entre lotes que tocam vários utilizadores.
+    linhas = [
+        {"dono_id": dono_id, "concluida": concluida, "prioridade": prioridade, "total": total}
+        for (dono_id, concluida, prioridade), total in sorted(variacoes.items())
+        if total
+    ]
+    if not linhas:
+        return
+    dialeto = _dialeto_com_upsert(db)
+    comando = dialeto.insert(models.ContagemTarefas).values(linhas)
+    await db.execute(comando.on_conflict_do_update(
+        index_elements=["dono_id", "concluida", "prioridade"],
+        set_={"total": models.ContagemTarefas.total + comando.excluded.total},
+    ))
+
+
+async def reconstruir_contagens(db: AsyncSession, dono_id: int | None = None) -> None:
+    """
+    Recalcula a tabela `contagem_tarefas` a partir das tarefas.
+
+    Chamado no arranque, com os contadores ativos, para corrigir escritas feitas
+    enquanto estavam desativados. É uma única passagem pelo índice `ix_tarefas_resumo`.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        dono_id: Recalcula apenas as linhas deste utilizador (padrão: todas).
+    """
+    apagar = delete(models.ContagemTarefas)
+    agregar = (
+        select(models.Tarefa.dono_id, models.Tarefa.concluida, models.Tarefa.prioridade, func.count())
+        .group_by(models.Tarefa.dono_id, models.Tarefa.concluida, models.Tarefa.prioridade)
+    )
+    if dono_id is not None:
+        apagar = apagar.filter(models.ContagemTarefas.dono_id == dono_id)
+        agregar = agregar.filter(models.Tarefa.dono_id == dono_id)
+    await db.execute(apagar)
+    await db.execute(insert(models.ContagemTarefas).from_select(
+        ["dono_id", "concluida", "prioridade", "total"], agregar
+    ))
+    await db.commit()
+
+
+async def get_resumo_tarefas(db: AsyncSession, dono_id: int) -> schemas.ResumoTarefas:
+    """
+    Calcula os totais das tarefas de um utilizador: pendentes, concluídas,
+    por prioridade e atrasadas.
+
+    Sem contadores, é um único GROUP BY servido pelo índice de cobertura
+    `ix_tarefas_resumo`. Com contadores, lê no máximo seis linhas de
+    `contagem_tarefas`; as atrasadas dependem da data de hoje e continuam a ser
+    contadas na hora, mas apenas no intervalo do índice das tarefas pendentes já vencidas.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        dono_id: O ID do utilizador dono das tarefas.
+
+    Returns:
+        O schema ResumoTarefas.
+    """
+    hoje = date.today()
+    if CONTADORES_ATIVOS:
+        result = await db.execute(
+            select(models.ContagemTarefas.concluida, models.ContagemTarefas.prioridade, models.ContagemTarefas.total)
+            .filter(models.ContagemTarefas.dono_id == dono_id)
+        )
+        grupos = result.all()
+        result = await db.execute(
+            select(func.count()).select_from(models.Tarefa).filter(
+                models.Tarefa.dono_id == dono_id,
+                models.Tarefa.concluida.is_(False),
+                models.Tarefa.data_vencimento < hoje,
+            )
+        )
+        atrasadas = result.scalar_one()
+    else:
+        atrasada = case(
+            (models.Tarefa.concluida.is_(False) & (models.Tarefa.data_vencimento < hoje), 1), else_=0
+        )
+        result = await db.execute(
+            select(models.Tarefa.concluida, models.Tarefa.prioridade, func.count(), func.sum(atrasada))
+            .filter(models.Tarefa.dono_id == dono_id)
+            .group_by(models.Tarefa.concluida, models.Tarefa.prioridade)
+        )
+        linhas = result.all()
+        grupos = [(concluida, prioridade, total) for concluida, prioridade, total, _ in linhas]
+        atrasadas = sum(n for *_, n in linhas)
+
+    por_prioridade = {prioridade: schemas.ContagemPorEstado() for prioridade in schemas.Prioridade}
+    for concluida, prioridade, total in grupos:
+        contagem = por_prioridade[schemas.Prioridade(prioridade)]
+        if concluida:
+            contagem.concluidas += total
+        else:
+            contagem.pendentes += total
+    pendentes = sum(c.pendentes for c in por_prioridade.values())
+    concluidas = sum(c.concluidas for c in por_prioridade.values())
+    return schemas.ResumoTarefas(
+        total=pendentes + concluidas,
+        pendentes=pendentes,
+        concluidas=concluidas,
+        atrasadas=atrasadas,
+        por_prioridade=por_prioridade,
+    )
+
+
+# --- Arquivo de Tarefas Concluídas ---
+
+# Colunas copiadas entre `tarefas` e `tarefas_arquivo`, pela mesma ordem.
+_COLUNAS_ARQUIVADAS = [
+    "id", "titulo", "descricao", "concluida", "data_vencimento", "prioridade", "concluida_em", "dono_id",
+]
+
+
+async def arquivar_tarefas_concluidas(db: AsyncSession, concluidas_antes_de: datetime, tamanho_lote: int = 1000) -> int:
+    """
+    Move um lote de tarefas concluídas há mais tempo para `tarefas_arquivo`.
+
+    A cópia (INSERT ... SELECT) e a remoção são feitas numa só transação, sem
+    carregar as tarefas no ORM. No PostgreSQL, as linhas do lote ficam bloqueadas
+    (FOR UPDATE SKIP LOCKED): uma edição em curso não se perde, e várias instâncias
+    podem arquivar em paralelo sem escolher as mesmas tarefas.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        concluidas_antes_de: São arquivadas as tarefas concluídas antes deste momento (UTC).
+        tamanho_lote: Número máximo de tarefas movidas nesta transação.
+
+    Returns:
+        O número de tarefas arquivadas (menor do que `tamanho_lote` quando não há mais).
+    """
+    elegivel = (models.Tarefa.concluida.is_(True), models.Tarefa.concluida_em < concluidas_antes_de)
+    result = await db.execute(
+        select(models.Tarefa.id)
+        .filter(*elegivel)
+        .order_by(models.Tarefa.concluida_em)
+        .limit(tamanho_lote)
+        .with_for_update(skip_locked=True)
+    )
+    ids = list(result.scalars())
+    if not ids:
+        return 0
+
+    # Cada comando repete as condições: o SQLite ignora o FOR UPDATE, e uma tarefa
+    # reaberta depois do SELECT fica onde está. A partir do primeiro INSERT, a
+    # transação tem o bloqueio de escrita, pelo que os três comandos veem as mesmas tarefas.
+    no_lote = (models.Tarefa.id.in_(ids), *elegivel)
+    origem = select(
+        *(getattr(models.Tarefa, coluna) for coluna in _COLUNAS_ARQUIVADAS), literal(agora_utc(), DateTime)
+    ).filter(*no_lote)
+    await db.execute(insert(models.TarefaArquivada).from_select([*_COLUNAS_ARQUIVADAS, "arquivada_em"], origem))
+    # As ligações às etiquetas acompanham a tarefa (as de `tarefas` saem em cascata com ela).
+    await db.execute(insert(models.tarefas_arquivo_etiquetas).from_select(
+        ["tarefa_id", "etiqueta_id"],
+        select(models.tarefas_etiquetas).filter(
+            models.tarefas_etiquetas.c.tarefa_id.in_(select(models.Tarefa.id).filter(*no_lote))
+        ),
+    ))
+    # Os contadores e o cache seguem as tarefas realmente movidas.
+    result = await db.execute(
+        delete(models.Tarefa)
+        .filter(*no_lote)
+        .returning(models.Tarefa.id, models.Tarefa.dono_id, models.Tarefa.prioridade)
+    )
+    movidas = result.all()
+    variacoes = Counter()
+    variacoes.subtract((dono_id, True, prioridade) for _, dono_id, prioridade in movidas)
+    await _ajustar_contagens(db, variacoes)
+    await db.commit()
+
+    ids_por_dono: dict[int, list[int]] = {}
+    for tarefa_id, dono_id, _ in movidas:
+        ids_por_dono.setdefault(dono_id, []).append(tarefa_id)
+    for dono_id, tarefa_ids in ids_por_dono.items():
+        await cache.invalidar(dono_id, *tarefa_ids, shard=shards.shard_da_sessao(db))
+    return len(movidas)
+
+
+async def get_tarefas_arquivadas(
+    db: AsyncSession, dono_id: int, skip: int = 0, limit: int = 100
+) -> list[models.TarefaArquivada]:
     """
-    await db.delete(db_tarefa)
+    Retorna as tarefas arquivadas de um utilizador, com suporte a paginação.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        dono_id: O ID do utilizador dono das tarefas.
+        skip: O número de registos a pular (para paginação).
+        limit: O número máximo de registos a retornar.
+
+    Returns:
+        Uma lista de objetos do modelo TarefaArquivada, por ordem de ID.
+    """
+    result = await db.execute(
+        select(models.TarefaArquivada)
+        .filter(models.TarefaArquivada.dono_id == dono_id)
+        .order_by(models.TarefaArquivada.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def get_tarefa_arquivada(db: AsyncSession, tarefa_id: int) -> models.TarefaArquivada | None:
+    """Busca uma tarefa arquivada pelo seu ID (o mesmo que tinha antes de ser arquivada)."""
+    result = await db.execute(select(models.TarefaArquivada).filter(models.TarefaArquivada.id == tarefa_id))
+    return result.scalar_one_or_none()
+
+
+async def restaurar_tarefa(db: AsyncSession, db_arquivada: models.TarefaArquivada) -> models.Tarefa:
+    """
+    Devolve uma tarefa arquivada à tabela `tarefas`, com o mesmo ID. Em bancos de
+    dados SQLite criados antes do 'AUTOINCREMENT' da tabela, o ID pode já ter sido
+    reutilizado; nesse caso a tarefa recebe um ID novo.
+
+    A data de conclusão passa a ser a do restauro, para que a tarefa não volte
+    a ser arquivada na próxima execução do arquivamento.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        db_arquivada: A tarefa arquivada (já validada).
+
+    Returns:
+        O objeto do modelo Tarefa restaurado.
+    """
+    dados = {coluna: getattr(db_arquivada, coluna) for coluna in _COLUNAS_ARQUIVADAS}
+    if await db.get(models.Tarefa, dados["id"]) is not None:
+        del dados["id"]
+    db_tarefa = models.Tarefa(**{**dados, "concluida_em": agora_utc() if dados["concluida"] else None})
+    db.add(db_tarefa)
+    await db.flush()  # Obtém o ID (novo, se o original estiver ocupado) para ligar as etiquetas
+    await db.execute(insert(models.tarefas_etiquetas).from_select(
+        ["tarefa_id", "etiqueta_id"],
+        select(literal(db_tarefa.id), models.tarefas_arquivo_etiquetas.c.etiqueta_id)
+        .filter(models.tarefas_arquivo_etiquetas.c.tarefa_id == db_arquivada.id),
+    ))
+    await db.delete(db_arquivada)
+    await _ajustar_contagens(db, Counter({_chave_contagem(db_tarefa): 1}))
+    await db.commit()
+    await db.refresh(db_tarefa)
+    await cache.invalidar(db_tarefa.dono_id, db_tarefa.id, shard=shards.shard_da_sessao(db))
+    return db_tarefa
+
+
+# --- Vencimentos ---
+
+async def adquirir_concessao(db: AsyncSession, nome: str, titular: str, duracao: timedelta) -> bool:
+    """
+    Adquire ou renova a concessão `nome`, se estiver livre, expirada ou já for do `titular`.
+
+    Cada passo é um único comando condicional (INSERT ... ON CONFLICT DO NOTHING,
+    depois UPDATE ... WHERE), por isso dois workers nunca a obtêm ao mesmo tempo.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        nome: O nome da concessão (ex.: "vencimentos").
+        titular: O identificador único do worker.
+        duracao: O prazo da concessão, a partir de agora.
+
+    Returns:
+        True se o `titular` ficou com a concessão.
+    """
+    agora = agora_utc()
+    dialeto = _dialeto_com_upsert(db)
+    result = await db.execute(
+        dialeto.insert(models.Concessao)
+        .values(nome=nome, titular=titular, expira_em=agora + duracao)
+        .on_conflict_do_nothing(index_elements=["nome"])
+    )
+    if result.rowcount != 1:
+        result = await db.execute(
+            update(models.Concessao)
+            .where(
+                models.Concessao.nome == nome,
+                or_(models.Concessao.titular == titular, models.Concessao.expira_em < agora),
+            )
+            .values(titular=titular, expira_em=agora + duracao)
+        )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def get_marca_vencimentos(db: AsyncSession, tipo: str) -> tuple[date, int] | None:
+    """A última tarefa (data de vencimento, ID) notificada para o `tipo`, ou None se ainda não houver."""
+    marca = await db.get(models.MarcaVencimentos, tipo)
+    return (marca.data_vencimento, marca.tarefa_id) if marca is not None else None
+
+
+async def get_tarefas_a_vencer(
+    db: AsyncSession, apos: tuple[date, int], ate: date, desde: date | None = None, limite: int = 500
+) -> list:
+    """
+    Retorna o próximo lote de tarefas pendentes com vencimento até `ate`,
+    por ordem de (data de vencimento, ID), a seguir à marca `apos`.
+
+    A consulta percorre apenas um intervalo do índice `ix_tarefas_vencimento`,
+    a partir da marca: o custo depende do lote, não do número de tarefas.
+
+    Args:
+        db: A sessão assíncrona do banco de dados.
+        apos: A última tarefa já processada (data de vencimento, ID).
+        ate: Data de vencimento máxima (inclusive).
+        desde: Data de vencimento mínima (inclusive), opcional.
+        limite: O tamanho máximo do lote.
+
+    Returns:
+        Linhas com `id`, `dono_id`, `titulo` e `data_vencimento`.
+    """
+    query = (
+        select(models.Tarefa.id, models.Tarefa.dono_id, models.Tarefa.titulo, models.Tarefa.data_vencimento)
+        .filter(
+            models.Tarefa.concluida.is_(False),
+            models.Tarefa.data_vencimento <= ate,
+            tuple_(models.Tarefa.data_vencimento, models.Tarefa.id) > tuple_(*apos),
+        )
+        .order_by(models.Tarefa.data_vencimento, models.Tarefa.id)
+        .limit(limite)
+    )
+    if desde is not None:
+        query = query.filter(models.Tarefa.data_vencimento >= desde)
+    result = await db.execute(query)
+    return result.all()
+
+
+async def avancar_marca_vencimentos(
+    db: AsyncSession, tipo: str, marca: tuple[date, int], concessao: str, titular: str, duracao: timedelta
+) -> bool:
+    """
+    Guarda a nova marca do `tipo` e renova a concessão, na mesma transação.
+
+    A marca só avança se o `titular` ainda tiver a concessão: um worker que a
+    perdeu (ex.: ficou parado mais do que o prazo) não sobrepõe o progresso do novo titular.
+
+    Returns:
+        False se a concessão já não pertence ao `titular` (nada é guardado).
+    """
+    agora = agora_utc()
+    result = await db.execute(
+        update(models.Concessao)
+        .where(
+            models.Concessao.nome == concessao,
+            models.Concessao.titular == titular,
+            models.Concessao.expira_em >= agora,
+        )
+        .values(expira_em=agora + duracao)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        return False
+    data_vencimento, tarefa_id = marca
+    await db.merge(models.MarcaVencimentos(tipo=tipo, data_vencimento=data_vencimento, tarefa_id=tarefa_id))
     await db.commit()
-    return db_tarefa
\ No newline at end of file
+    return True
\ No newline at end of file
@@ -6,37 +6,72 @@ configurar o motor (engine) do SQLAlchemy e a criação de sessões.
 Também define o ciclo de vida (lifespan) da aplicação FastAPI para
 criar as tabelas na inicialização.
 """
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import event, inspect, text, update
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.schema import CreateTable
+
+import registos
 
 # Carrega as variáveis de ambiente de um ficheiro .env, se existir.
 load_dotenv()
 
 # --- Configuração da URL do Banco de Dados ---
 
+def normalizar_url(url: str) -> str:
+    """
+    Lógica de compatibilidade para o SQLAlchemy 2.0 com asyncpg.
+    Garante que a string de conexão para PostgreSQL use o driver `asyncpg`,
+    que é necessário para operações assíncronas.
+    """
+    if url and url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url and url.startswith("postgres://"):  # comum em serviços como Heroku/Railway
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    return url
+
+
 # Obtém a URL do banco de dados a partir das variáveis de ambiente.
 # Se `DATABASE_URL` não estiver definida, usa um banco de dados SQLite local
 # como fallback, ideal para desenvolvimento e testes.
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./tarefas.db")
-
-# Lógica de compatibilidade para o SQLAlchemy 2.0 com asyncpg.
-# Garante que a string de conexão para PostgreSQL use o driver `asyncpg`,
-# que é necessário para operações assíncronas.
-if DATABASE_URL and DATABASE_URL.startswith("postgresql://"):
-    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
-elif DATABASE_URL and DATABASE_URL.startswith("postgres://"): # comum em serviços como Heroku/Railway
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
+# (Com `DATABASE_URLS`, os utilizadores são repartidos por vários bancos de dados: ver shards.py.)
+DATABASE_URL = normalizar_url(os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./tarefas.db"))
 
 
 # --- Inicialização do SQLAlchemy ---
 
+def ativar_chaves_estrangeiras_sqlite(engine_async):
+    """
+    O SQLite só aplica as chaves estrangeiras (e o 'ON DELETE CASCADE') quando
+    o PRAGMA foreign_keys está ativo, e isso tem de ser feito em cada ligação.
+    """
+    if engine_async.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine_async.sync_engine, "connect")
+    def _ativar(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def criar_engine(url: str) -> AsyncEngine:
+    """Cria um engine assíncrono com o registo de SQL lento e, no SQLite, as chaves estrangeiras ativas."""
+    novo_engine = create_async_engine(url)
+    # Regista os comandos SQL lentos (ver registos.py), com o ID da requisição.
+    registos.instalar_registo_sql(novo_engine)
+    ativar_chaves_estrangeiras_sqlite(novo_engine)
+    return novo_engine
+
+
 # O 'engine' é o ponto central de comunicação com o banco de dados.
-engine = create_async_engine(DATABASE_URL)
+engine = criar_engine(DATABASE_URL)
 
 # 'SessionLocal' é uma fábrica de sessões. Cada instância dela será uma
 # sessão de banco de dados individual. Usamos async_sessionmaker para sessões assíncronas.
@@ -49,13 +84,142 @@ Base = declarative_base()
 
 # --- Gestão do Ciclo de Vida da Aplicação (Lifespan) ---
 
-async def create_tables():
-    """Cria todas as tabelas no banco de dados se elas ainda não existirem."""
+def _adicionar_colunas_em_falta(conn):
+    """
+    Acrescenta à tabela `tarefas` as colunas criadas depois dela (operação idempotente).
+    As tarefas já concluídas recebem a data de hoje como data de conclusão, para
+    que o arquivamento as trate a partir de agora.
+    """
+    import crud
+    import models
+    colunas = {coluna["name"] for coluna in inspect(conn).get_columns("tarefas")}
+    if "concluida_em" not in colunas:
+        conn.exec_driver_sql("ALTER TABLE tarefas ADD COLUMN concluida_em TIMESTAMP")
+        conn.execute(
+            update(models.Tarefa).where(models.Tarefa.concluida.is_(True)).values(concluida_em=crud.agora_utc())
+        )
+
+
+def _sem_cascata(conn, tabela: str) -> bool:
+    """Indica se a chave estrangeira de `tabela` para `usuarios` ainda não tem 'ON DELETE CASCADE'."""
+    return any(
+        fk["referred_table"] == "usuarios" and (fk["options"].get("ondelete") or "").upper() != "CASCADE"
+        for fk in inspect(conn).get_foreign_keys(tabela)
+    )
+
+
+def _reconstruir_tabela_sqlite(conn, tabela):
+    """
+    Recria uma tabela do SQLite com a definição atual do modelo, mantendo as linhas e os IDs.
+
+    O SQLite não altera chaves estrangeiras nem o AUTOINCREMENT de uma tabela existente.
+    Segue o procedimento da documentação do SQLite (nova tabela, cópia, DROP e
+    RENAME) e exige as chaves estrangeiras desligadas, para que o DROP não apague
+    em cascata as linhas que referem a tabela. Os índices são recriados por `create_tables`.
+    """
+    nova = f"{tabela.name}_nova"
+    ddl = str(CreateTable(tabela).compile(dialect=conn.dialect))
+    colunas = ", ".join(
+        coluna["name"] for coluna in inspect(conn).get_columns(tabela.name) if coluna["name"] in tabela.columns
+    )
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {nova}")  # Restos de uma migração interrompida
+    conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {tabela.name} ", f"CREATE TABLE {nova} ", 1))
+    conn.exec_driver_sql(f"INSERT INTO {nova} ({colunas}) SELECT {colunas} FROM {tabela.name}")
+    conn.exec_driver_sql(f"DROP TABLE {tabela.name}")
+    conn.exec_driver_sql(f"ALTER TABLE {nova} RENAME TO {tabela.name}")
+
+
+def _separar_ids_arquivados(conn):
+    """
+    Sem AUTOINCREMENT, o SQLite reutilizava os IDs das últimas tarefas apagadas ou
+    arquivadas: arquivar a tarefa nova colidiria com a antiga em `tarefas_arquivo`.
+    Dá novos IDs às tarefas arquivadas cujo ID está em uso e faz a sequência de
+    `tarefas` continuar acima de todos os IDs arquivados.
+    """
+    maximo = conn.execute(
+        text("SELECT max(id) FROM (SELECT id FROM tarefas UNION ALL SELECT id FROM tarefas_arquivo)")
+    ).scalar()
+    if maximo is None:
+        return
+    # As ligações às etiquetas primeiro: depois, os IDs antigos já não estariam em `tarefas_arquivo`.
+    for tabela, coluna in (("tarefas_arquivo_etiquetas", "tarefa_id"), ("tarefas_arquivo", "id")):
+        conn.execute(
+            text(f"UPDATE {tabela} SET {coluna} = {coluna} + :maximo WHERE {coluna} IN (SELECT id FROM tarefas)"),
+            {"maximo": maximo},
+        )
+    ultimo = conn.execute(text("SELECT max(id) FROM tarefas_arquivo")).scalar()
+    if ultimo is not None:
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'tarefas' AND seq < :ultimo"), {"ultimo": ultimo})
+        conn.execute(text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'tarefas', :ultimo "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'tarefas')"
+        ), {"ultimo": ultimo})
+
+
+def _migrar_chaves_estrangeiras(conn):
+    """
+    Atualiza as tabelas `usuarios` e `tarefas` criadas antes do 'ON DELETE CASCADE'
+    em `tarefas.dono_id` e, no SQLite, do AUTOINCREMENT (operação idempotente;
+    no PostgreSQL, as sequências nunca reutilizam IDs).
+
+    Sem esta migração, `crud.delete_usuario` (que deixa as tarefas ao banco de
+    dados, ver `models.Usuario.tarefas`) falharia por violar a chave estrangeira.
+    """
+    import models
+    if conn.dialect.name == "sqlite":
+        for modelo in (models.Usuario, models.Tarefa):
+            tabela = modelo.__table__
+            sql = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :nome"), {"nome": tabela.name}
+            ).scalar_one()
+            if "AUTOINCREMENT" not in sql.upper() or _sem_cascata(conn, tabela.name):
+                _reconstruir_tabela_sqlite(conn, tabela)
+                if modelo is models.Tarefa:
+                    _separar_ids_arquivados(conn)
+    elif _sem_cascata(conn, "tarefas"):
+        for fk in inspect(conn).get_foreign_keys("tarefas"):
+            if fk["referred_table"] == "usuarios":
+                conn.exec_driver_sql(
+                    f"ALTER TABLE tarefas DROP CONSTRAINT {fk['name']}, ADD CONSTRAINT {fk['name']} "
+                    "FOREIGN KEY (dono_id) REFERENCES usuarios (id) ON DELETE CASCADE"
+                )
+
+
+async def create_tables(alvo: AsyncEngine | None = None):
+    """
+    Cria todas as tabelas no banco de dados se elas ainda não existirem.
+
+    Args:
+        alvo: O engine do banco de dados (padrão: `engine`); no modo de
+              sharding, é chamado para o engine de cada shard.
+    """
     # Importação local para evitar dependências circulares
+    import busca
     import models
-    async with engine.begin() as conn:
-        # O run_sync executa a criação das tabelas de forma síncrona dentro do contexto assíncrono.
-        await conn.run_sync(Base.metadata.create_all)
+    async with (alvo or engine).connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        if sqlite:
+            # Para `_reconstruir_tabela_sqlite`. O PRAGMA não tem efeito dentro de uma transação.
+            await conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            await conn.commit()
+        try:
+            async with conn.begin():
+                # O run_sync executa a criação das tabelas de forma síncrona dentro do contexto assíncrono.
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(_adicionar_colunas_em_falta)
+                await conn.run_sync(_migrar_chaves_estrangeiras)
+                # O create_all não cria índices novos em tabelas que já existiam
+                # (nem os das tabelas reconstruídas pela migração).
+                for modelo in (models.Usuario, models.Tarefa):
+                    for indice in modelo.__table__.indexes:
+                        await conn.run_sync(indice.create, checkfirst=True)
+                # Cria o índice de pesquisa em bancos de dados criados antes de ele existir
+                # (e, no SQLite, os triggers, que desaparecem com uma tabela reconstruída).
+                await conn.run_sync(busca.criar_indice)
+        finally:
+            if sqlite:
+                await conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+                await conn.commit()
 
 
 @asynccontextmanager
@@ -64,8 +228,56 @@ async def lifespan(app: FastAPI):
     Context manager para o ciclo de vida da aplicação FastAPI.
     Código aqui é executado antes de a aplicação começar a receber requisições.
     """
-    print("Startup: A verificar e a criar tabelas, se necessário...")
-    await create_tables()
+    # Importação local para evitar dependências circulares
+    import arquivo
+    import cache
+    import crud
+    import escrita_em_lote
+    import shards
+    import vencimentos
+
+    registos.configurar()
+    registos.logger.info("Startup: A verificar e a criar tabelas, se necessário...")
+    for engine_do_shard in shards.todos_os_engines(engine):
+        await create_tables(engine_do_shard)
+    # No modo de sharding, as tarefas de manutenção abaixo correm em cada shard.
+    fabricas = shards.todas_as_fabricas(SessionLocal)
+    # Arranca o escritor em lote, se o modo estiver ativo (ESCRITA_EM_LOTE).
+    escritor = escrita_em_lote.configurar_a_partir_do_ambiente(SessionLocal)
+    if escritor is not None:
+        await escritor.iniciar()
+    # Retoma as remoções de contas interrompidas por um reinício.
+    remocoes = []
+    for fabrica in fabricas:
+        async with fabrica() as db:
+            pendentes = await crud.get_ids_usuarios_em_remocao(db)
+        remocoes += [asyncio.create_task(crud.purgar_usuario(fabrica, usuario_id, crud.REMOCAO_TAMANHO_LOTE)) for usuario_id in pendentes]
+    # Recalcula os contadores do resumo, que podem ter ficado desatualizados
+    # se houve escritas enquanto estavam desativados (RESUMO_CONTADORES).
+    if crud.CONTADORES_ATIVOS:
+        for fabrica in fabricas:
+            async with fabrica() as db:
+                await crud.reconstruir_contagens(db)
+    # Arranca o arquivamento das tarefas concluídas, se estiver ativo (ARQUIVO_ATIVO).
+    arquivador = arquivo.configurar_a_partir_do_ambiente(SessionLocal)
+    if arquivador is not None:
+        await arquivador.iniciar()
+    # Arranca o varrimento das tarefas atrasadas e a vencer, se estiver ativo (VENCIMENTOS_ATIVO).
+    agendador = vencimentos.configurar_a_partir_do_ambiente(SessionLocal)
+    if agendador is not None:
+        await agendador.iniciar()
     yield
-    # Código após o 'yield' seria executado no shutdown da aplicação.
-    print("Shutdown: Aplicação finalizada.")
\ No newline at end of file
+    # Código após o 'yield' é executado no shutdown da aplicação.
+    for remocao in remocoes:
+        remocao.cancel()  # Serão retomadas no próximo arranque
+    if agendador is not None:
+        await agendador.parar()
+    if arquivador is not None:
+        await arquivador.parar()
+    if escritor is not None:
+        await escritor.parar()
+    await cache.fechar()
+    if shards.mapa is not None:
+        await shards.mapa.fechar()
+    registos.logger.info("Shutdown: Aplicação finalizada.")
+    registos.parar()
\ No newline at end of file
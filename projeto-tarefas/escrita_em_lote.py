@@ -0,0 +1,164 @@
+"""
+Módulo de Escrita em Lote (Group Commit)
+
+Quando muitas tarefas são criadas ao mesmo tempo, fazer um commit por tarefa
+custa um fsync por tarefa no SQLite e um flush do WAL por tarefa no PostgreSQL.
+Este ficheiro implementa um modo opcional em que os pedidos de criação que
+chegam dentro de uma pequena janela de tempo são entregues a um escritor em
+segundo plano, que os insere todos numa única transação. Cada chamador
+recebe o ID da sua própria tarefa.
+
+O modo é ativado por variáveis de ambiente (ver `configurar_a_partir_do_ambiente`)
+e iniciado no `lifespan` da aplicação.
+"""
+import asyncio
+import os
+
+import crud
+import schemas
+import shards
+
+
+class EscritorEmLote:
+    """
+    Escritor em segundo plano que agrupa criações de tarefas em transações.
+
+    Args:
+        fabrica_de_sessoes: Fábrica de sessões assíncronas (ex.: `database.SessionLocal`).
+        janela: Tempo máximo, em segundos, que o primeiro pedido de um lote
+                espera por outros pedidos antes do commit.
+        tamanho_maximo: Número máximo de tarefas por transação.
+    """
+
+    def __init__(self, fabrica_de_sessoes, janela: float = 0.005, tamanho_maximo: int = 100):
+        self.fabrica_de_sessoes = fabrica_de_sessoes
+        self.janela = janela
+        self.tamanho_maximo = tamanho_maximo
+        self._fila: asyncio.Queue = asyncio.Queue()
+        self._tarefa_de_fundo: asyncio.Task | None = None
+
+    async def iniciar(self):
+        """Arranca o ciclo do escritor em segundo plano."""
+        if self._tarefa_de_fundo is None:
+            self._tarefa_de_fundo = asyncio.create_task(self._executar())
+
+    async def parar(self):
+        """Grava os pedidos pendentes e termina o escritor."""
+        global escritor
+        if self._tarefa_de_fundo is not None:
+            await self._fila.put(None)  # Sentinela: termina depois de esvaziar a fila
+            await self._tarefa_de_fundo
+            self._tarefa_de_fundo = None
+        # Um escritor parado deixa de receber pedidos (ex.: reinício com o modo desativado).
+        if escritor is self:
+            escritor = None
+
+    async def criar_tarefa(self, tarefa: schemas.TarefaCreate, dono_id: int, shard: int | None = None) -> int:
+        """
+        Coloca a criação de uma tarefa na fila e espera pelo commit do seu lote.
+
+        Args:
+            tarefa: Os dados da tarefa.
+            dono_id: O ID do utilizador dono da tarefa.
+            shard: No modo de sharding, o shard do utilizador (ver shards.py).
+
+        Returns:
+            O ID da tarefa criada.
+
+        Raises:
+            A exceção levantada pelo banco de dados, se o lote falhar.
+        """
+        futuro = asyncio.get_running_loop().create_future()
+        await self._fila.put((tarefa, dono_id, shard, futuro))
+        return await futuro
+
+    async def _executar(self):
+        """Ciclo principal: recolhe um lote e grava-o, até receber a sentinela."""
+        loop = asyncio.get_running_loop()
+        while True:
+            primeiro = await self._fila.get()
+            if primeiro is None:
+                return
+            lote = [primeiro]
+            terminar = False
+            prazo = loop.time() + self.janela
+            while len(lote) < self.tamanho_maximo:
+                restante = prazo - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._fila.get(), restante)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    terminar = True
+                    break
+                lote.append(item)
+            await self._gravar(lote)
+            if terminar:
+                return
+
+    async def _gravar(self, lote: list):
+        """
+        Insere o lote e resolve o futuro de cada chamador.
+        No modo de sharding, é uma transação por shard presente no lote.
+        """
+        por_shard: dict[int | None, list] = {}
+        for item in lote:
+            por_shard.setdefault(item[2], []).append(item)
+        for shard, itens in por_shard.items():
+            await self._gravar_no_shard(shard, itens)
+
+    async def _gravar_no_shard(self, shard: int | None, lote: list):
+        """
+        Insere as tarefas de um shard numa transação.
+
+        Se o lote falhar (ex.: uma chave estrangeira violada por um dos pedidos),
+        cada pedido é repetido na sua própria transação, para que só o pedido
+        inválido receba o erro.
+        """
+        try:
+            async with shards.fabrica_do_shard(shard, self.fabrica_de_sessoes)() as db:
+                ids = await crud.create_tarefas_em_lote(
+                    db, [(tarefa, dono_id) for tarefa, dono_id, _, _ in lote]
+                )
+        except Exception as erro:
+            if len(lote) > 1:
+                for item in lote:
+                    await self._gravar_no_shard(shard, [item])
+                return
+            for _, _, _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(erro)
+            return
+        for (_, _, _, futuro), tarefa_id in zip(lote, ids):
+            # O chamador pode ter desistido (ex.: cliente desligou-se); a tarefa fica gravada.
+            if not futuro.done():
+                futuro.set_result(tarefa_id)
+
+
+# --- Instância Global da Aplicação ---
+
+# None quando o modo de escrita em lote está desativado (o padrão).
+escritor: EscritorEmLote | None = None
+
+
+def configurar_a_partir_do_ambiente(fabrica_de_sessoes) -> EscritorEmLote | None:
+    """
+    Cria o escritor global se `ESCRITA_EM_LOTE` estiver ativa.
+
+    Variáveis de ambiente:
+        ESCRITA_EM_LOTE: "1"/"true" para ativar (padrão: desativado).
+        ESCRITA_LOTE_JANELA_MS: janela de agrupamento em milissegundos (padrão: 5).
+        ESCRITA_LOTE_TAMANHO_MAX: tarefas por transação (padrão: 100).
+    """
+    global escritor
+    if os.getenv("ESCRITA_EM_LOTE", "").lower() not in ("1", "true", "sim"):
+        escritor = None
+        return None
+    escritor = EscritorEmLote(
+        fabrica_de_sessoes,
+        janela=float(os.getenv("ESCRITA_LOTE_JANELA_MS", "5")) / 1000,
+        tamanho_maximo=int(os.getenv("ESCRITA_LOTE_TAMANHO_MAX", "100")),
+    )
+    return escritor
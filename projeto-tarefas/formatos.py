@@ -0,0 +1,147 @@
+"""
+Módulo de Formatos de Resposta (Negociação de Conteúdo)
+
+Este ficheiro permite que os endpoints de leitura de tarefas respondam em
+formatos mais compactos do que o JSON tradicional, escolhidos pelo cliente
+através do cabeçalho `Accept`:
+
+- `application/json` (padrão): uma lista de objetos, exatamente como `schemas.Tarefa`.
+- `application/msgpack`: os mesmos objetos, codificados em MessagePack (binário);
+  no detalhe de uma tarefa, um único mapa, tal como o objeto do JSON.
+- `application/vnd.tarefas.colunar+json`: JSON "colunar", com um array por campo
+  e a prioridade codificada como um inteiro pequeno. Evita repetir as chaves
+  (`"titulo"`, `"descricao"`, ...) em cada tarefa.
+"""
+from typing import Iterable
+
+import msgpack
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+import models
+import schemas
+
+
+# --- Tipos de Media Suportados ---
+
+MEDIA_JSON = "application/json"
+MEDIA_MSGPACK = "application/msgpack"
+MEDIA_COLUNAR = "application/vnd.tarefas.colunar+json"
+
+# Alguns clientes ainda usam o nome não registado "x-msgpack".
+_SINONIMOS = {"application/x-msgpack": MEDIA_MSGPACK}
+
+# Codificação da prioridade no formato colunar. A ordem segue a urgência.
+PRIORIDADE_PARA_CODIGO = {
+    schemas.Prioridade.verde.value: 0,
+    schemas.Prioridade.amarela.value: 1,
+    schemas.Prioridade.vermelha.value: 2,
+}
+
+# Ordem das colunas no formato colunar (a mesma dos campos de `schemas.Tarefa`).
+CAMPOS = list(schemas.Tarefa.model_fields)
+
+
+# --- Negociação ---
+
+def escolher_formato(accept: str | None) -> str:
+    """
+    Escolhe o formato da resposta a partir do cabeçalho `Accept`.
+
+    Respeita os pesos `q=` enviados pelo cliente. Em caso de empate, ou se
+    nenhum tipo suportado for pedido, usa JSON, para que clientes antigos
+    (incluindo o frontend) continuem a funcionar sem alterações.
+
+    Args:
+        accept: O valor do cabeçalho `Accept` da requisição (pode ser None).
+
+    Returns:
+        Um dos tipos de media suportados (MEDIA_JSON, MEDIA_MSGPACK ou MEDIA_COLUNAR).
+    """
+    if not accept:
+        return MEDIA_JSON
+
+    melhor, melhor_q = MEDIA_JSON, 0.0
+    for parte in accept.split(","):
+        tipo, *parametros = [p.strip() for p in parte.split(";")]
+        tipo = _SINONIMOS.get(tipo.lower(), tipo.lower())
+        q = 1.0
+        for parametro in parametros:
+            nome, _, valor = parametro.partition("=")
+            if nome.strip() == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        if tipo in (MEDIA_MSGPACK, MEDIA_COLUNAR) and q > melhor_q:
+            melhor, melhor_q = tipo, q
+        elif tipo in (MEDIA_JSON, "application/*", "*/*") and q >= melhor_q and q > 0:
+            melhor, melhor_q = MEDIA_JSON, q
+    return melhor
+
+
+# --- Codificadores ---
+
+def _para_dict(tarefa: models.Tarefa) -> dict:
+    """
+    Converte uma tarefa num dicionário serializável (datas em ISO 8601).
+
+    Lê os atributos diretamente do objeto SQLAlchemy, sem passar pela validação
+    do Pydantic: os dados vêm do banco de dados e já respeitam o `schemas.Tarefa`.
+    """
+    dados = {campo: getattr(tarefa, campo) for campo in CAMPOS}
+    if dados["data_vencimento"] is not None:
+        dados["data_vencimento"] = dados["data_vencimento"].isoformat()
+    dados["etiquetas"] = [etiqueta.nome for etiqueta in dados["etiquetas"]]
+    return dados
+
+
+def codificar_msgpack(tarefas: Iterable[models.Tarefa]) -> bytes:
+    """Codifica uma lista de tarefas em MessagePack (uma lista de mapas)."""
+    return msgpack.packb([_para_dict(t) for t in tarefas])
+
+
+def codificar_colunar(tarefas: Iterable[models.Tarefa]) -> dict:
+    """
+    Transforma uma lista de tarefas no formato colunar.
+
+    Returns:
+        Um dicionário com um array por campo, todos com o mesmo comprimento.
+        A prioridade é codificada segundo `PRIORIDADE_PARA_CODIGO`.
+    """
+    tarefas = list(tarefas)
+    colunas = {campo: [getattr(t, campo) for t in tarefas] for campo in CAMPOS}
+    colunas["data_vencimento"] = [d.isoformat() if d else None for d in colunas["data_vencimento"]]
+    colunas["prioridade"] = [PRIORIDADE_PARA_CODIGO[p] for p in colunas["prioridade"]]
+    colunas["etiquetas"] = [[etiqueta.nome for etiqueta in etiquetas] for etiquetas in colunas["etiquetas"]]
+    return colunas
+
+
+# --- Respostas ---
+
+def responder(request: Request, tarefas: list[models.Tarefa]) -> Response | None:
+    """
+    Constrói a resposta no formato pedido pelo cliente.
+
+    Returns:
+        Uma `Response` já codificada para MessagePack ou JSON colunar, ou None
+        quando o cliente quer JSON. Nesse caso o endpoint deve devolver os
+        objetos normalmente, para que o FastAPI aplique o `response_model`.
+    """
+    formato = escolher_formato(request.headers.get("accept"))
+    cabecalhos = {"Vary": "Accept"}
+    if formato == MEDIA_MSGPACK:
+        return Response(codificar_msgpack(tarefas), media_type=MEDIA_MSGPACK, headers=cabecalhos)
+    if formato == MEDIA_COLUNAR:
+        return JSONResponse(codificar_colunar(tarefas), media_type=MEDIA_COLUNAR, headers=cabecalhos)
+    return None
+
+
+def responder_tarefa(request: Request, tarefa: models.Tarefa) -> Response | None:
+    """
+    Como `responder`, para o detalhe de uma tarefa: em MessagePack, um único mapa
+    (a mesma forma do JSON); no formato colunar, colunas com um só elemento.
+    """
+    if escolher_formato(request.headers.get("accept")) == MEDIA_MSGPACK:
+        return Response(msgpack.packb(_para_dict(tarefa)), media_type=MEDIA_MSGPACK, headers={"Vary": "Accept"})
+    return responder(request, [tarefa])
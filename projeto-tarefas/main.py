@@ -11,22 +11,35 @@ from datetime import datetime
 from typing import List
 
 # 2. Imports de Terceiros (Libs)
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import BackgroundTasks, FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # 3. Imports Locais da Aplicação
+import admissao
 import crud
+import escrita_em_lote
+import formatos
 import models
+import perfilamento
+import registos
 import schemas
+import shards
 from auth import (
     criar_token_de_acesso,
     get_usuario_atual,
     verificar_senha,
     get_db,
 )
-from database import lifespan
+from database import SessionLocal, lifespan
+
+
+# Contas com até este número de tarefas são apagadas na própria requisição;
+# acima disso, as tarefas são apagadas em lotes, em segundo plano.
+# (O tamanho dos lotes é `crud.REMOCAO_TAMANHO_LOTE`.)
+REMOCAO_LIMIAR_SINCRONO = int(os.getenv("REMOCAO_LIMIAR_SINCRONO", "5000"))
 
 
 # --- Configuração da Aplicação FastAPI ---
@@ -38,6 +51,21 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Middlewares: o último registado é o mais externo. Os da aplicação são registados
+# antes do CORS para que as suas respostas (ex.: 503) também levem os cabeçalhos CORS.
+
+# Perfilamento a pedido (cabeçalho X-Perfil assinado ou PERFIL_UTILIZADORES).
+# Fica por dentro do controlo de admissão: só perfila requisições aceites.
+app.add_middleware(perfilamento.MiddlewareDePerfilamento)
+
+# Controlo de admissão: rejeita o excesso de tráfego com 503 quando o pool do
+# banco de dados satura.
+app.add_middleware(admissao.MiddlewareDeAdmissao)
+
+# Registo de acesso em JSON e atribuição do X-Request-ID. Fica por fora do
+# controlo de admissão para que as respostas 503 também sejam registadas.
+app.add_middleware(registos.MiddlewareDeRegistoDeAcesso)
+
 # Configuração de CORS para permitir que o frontend (hospedado em outro domínio)
 # possa comunicar com esta API de forma segura.
 origins = [
@@ -98,6 +126,23 @@ async def health_check():
     }
 
 
+@app.get("/ready", tags=["Geral"])
+async def readiness_check():
+    """
+    Indica se a instância está pronta para receber tráfego.
+    Ao contrário do `/health`, responde 503 quando o controlo de admissão já
+    está a rejeitar requisições, para que o orquestrador encaminhe o tráfego
+    para outras instâncias.
+    """
+    if admissao.estado.sobrecarregado():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "overloaded", **admissao.estado.resumo()},
+            headers={"Retry-After": str(admissao.estado.retry_after)},
+        )
+    return {"status": "ready", **admissao.estado.resumo()}
+
+
 # --- Endpoints de Autenticação e Utilizadores ---
 
 @app.post("/usuarios/", response_model=schemas.Usuario, status_code=status.HTTP_201_CREATED, tags=["Utilizadores"])
@@ -124,10 +169,41 @@ async def login_para_obter_token(
             detail="Email ou senha incorretos",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = criar_token_de_acesso(data={"sub": usuario.email})
+    dados_do_token = {"sub": usuario.email, "uid": usuario.id}
+    if shards.mapa is not None:
+        dados_do_token["shd"] = shards.shard_da_sessao(db)
+    access_token = criar_token_de_acesso(data=dados_do_token)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.delete("/usuarios/me", status_code=status.HTTP_204_NO_CONTENT, tags=["Utilizadores"])
+async def apagar_conta(
+    background_tasks: BackgroundTasks,
+    usuario_atual: models.Usuario = Depends(get_usuario_atual),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Apaga a conta do utilizador autenticado e todas as suas tarefas.
+
+    Contas pequenas são apagadas de imediato (204). Contas grandes deixam de
+    poder autenticar-se de imediato e as tarefas são apagadas em lotes, em
+    segundo plano (202).
+    """
+    usuario_id = usuario_atual.id
+    total = await crud.contar_tarefas_do_usuario(db, usuario_id)
+    if total <= REMOCAO_LIMIAR_SINCRONO:
+        await crud.delete_usuario(db, usuario_atual)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    await crud.marcar_usuario_para_remocao(db, usuario_atual)
+    fabrica = shards.fabrica_do_shard(shards.shard_da_sessao(db), SessionLocal)
+    background_tasks.add_task(crud.purgar_usuario, fabrica, usuario_id, crud.REMOCAO_TAMANHO_LOTE)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"detail": "Conta desativada; as tarefas estão a ser apagadas."},
+    )
+
+
 # --- Endpoints de Tarefas (CRUD) ---
 
 @app.post("/tarefas/", response_model=schemas.Tarefa, status_code=status.HTTP_201_CREATED, tags=["Tarefas"])
@@ -136,7 +212,19 @@ async def criar_tarefa(
     usuario_atual: models.Usuario = Depends(get_usuario_atual),
     db: AsyncSession = Depends(get_db),
 ):
-    """Cria uma nova tarefa associada ao utilizador autenticado."""
+    """
+    Cria uma nova tarefa associada ao utilizador autenticado.
+    Com o modo de escrita em lote ativo, a inserção partilha o commit com
+    outras criações concorrentes.
+    """
+    if escrita_em_lote.escritor is not None:
+        tarefa_id = await escrita_em_lote.escritor.criar_tarefa(
+            tarefa, dono_id=usuario_atual.id, shard=shards.shard_da_sessao(db)
+        )
+        return schemas.Tarefa(
+            id=tarefa_id, dono_id=usuario_atual.id,
+            **tarefa.model_dump(exclude={"etiquetas"}), etiquetas=sorted(tarefa.etiquetas or []),
+        )
     return await crud.create_tarefa_para_usuario(
         db=db, tarefa=tarefa, dono_id=usuario_atual.id
     )
@@ -144,24 +232,103 @@ async def criar_tarefa(
 
 @app.get("/tarefas/", response_model=List[schemas.Tarefa], tags=["Tarefas"])
 async def ler_tarefas_do_usuario(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    etiqueta: List[str] = Query([], description="Filtra pelas tarefas com todas estas etiquetas (pode repetir-se)."),
     usuario_atual: models.Usuario = Depends(get_usuario_atual),
     db: AsyncSession = Depends(get_db),
 ):
-    """Lista todas as tarefas pertencentes ao utilizador autenticado, com suporte a paginação."""
+    """
+    Lista todas as tarefas pertencentes ao utilizador autenticado, com suporte a paginação.
+    Com `?etiqueta=casa&etiqueta=urgente`, lista apenas as que têm todas essas etiquetas.
+    Suporta os formatos MessagePack e JSON colunar através do cabeçalho `Accept`.
+    """
     tarefas = await crud.get_tarefas_por_usuario(
-        db, dono_id=usuario_atual.id, skip=skip, limit=limit
+        db, dono_id=usuario_atual.id, skip=skip, limit=limit, etiquetas=[e.strip() for e in etiqueta]
     )
-    return tarefas
+    response.headers["Vary"] = "Accept"
+    return formatos.responder(request, tarefas) or tarefas
+
+
+@app.get("/tarefas/busca", response_model=List[schemas.Tarefa], tags=["Tarefas"])
+async def buscar_tarefas_do_usuario(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="Termos a pesquisar (por prefixo)."),
+    skip: int = 0,
+    limit: int = Query(20, le=100),
+    usuario_atual: models.Usuario = Depends(get_usuario_atual),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Pesquisa as tarefas do utilizador autenticado pelo título e pela descrição,
+    ordenadas por relevância. Declarado antes de `/tarefas/{tarefa_id}` para que
+    "busca" não seja interpretado como um ID.
+    """
+    tarefas = await crud.buscar_tarefas(db, dono_id=usuario_atual.id, q=q, skip=skip, limit=limit)
+    response.headers["Vary"] = "Accept"
+    return formatos.responder(request, tarefas) or tarefas
+
+
+@app.get("/tarefas/resumo", response_model=schemas.ResumoTarefas, tags=["Tarefas"])
+async def resumo_das_tarefas(
+    usuario_atual: models.Usuario = Depends(get_usuario_atual),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Devolve os totais das tarefas do utilizador autenticado (pendentes, concluídas,
+    por prioridade e atrasadas), calculados no banco de dados.
+    """
+    return await crud.get_resumo_tarefas(db, dono_id=usuario_atual.id)
+
+
+@app.get("/tarefas/arquivo", response_model=List[schemas.TarefaArquivada], tags=["Arquivo"])
+async def ler_tarefas_arquivadas(
+    skip: int = 0,
+    limit: int = 100,
+    usuario_atual: models.Usuario = Depends(get_usuario_atual),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Lista as tarefas concluídas que foram arquivadas, com suporte a paginação.
+    Estas tarefas já não aparecem em `GET /tarefas/`, na pesquisa nem no resumo.
+    """
+    return await crud.get_tarefas_arquivadas(db, dono_id=usuario_atual.id, skip=skip, limit=limit)
+
+
+@app.post("/tarefas/arquivo/{tarefa_id}/restaurar", response_model=schemas.Tarefa, tags=["Arquivo"])
+async def restaurar_tarefa_arquivada(
+    tarefa_id: int,
+    usuario_atual: models.Usuario = Depends(get_usuario_atual),
+    db: AsyncSession = Depends(get_db),
+):
+    """Devolve uma tarefa arquivada às tarefas ativas, com o mesmo ID."""
+    db_arquivada = await crud.get_tarefa_arquivada(db, tarefa_id=tarefa_id)
+    if db_arquivada is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarefa arquivada não encontrada")
+    if db_arquivada.dono_id != usuario_atual.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Não tem permissão para aceder a esta tarefa",
+        )
+    return await crud.restaurar_tarefa(db, db_arquivada)
 
 
 @app.get("/tarefas/{tarefa_id}", response_model=schemas.Tarefa, tags=["Tarefas"])
 async def ler_tarefa_especifica(
+    request: Request,
+    response: Response,
     db_tarefa: models.Tarefa = Depends(get_tarefa_do_usuario_atual),
 ):
-    """Obtém os detalhes de uma tarefa específica."""
-    return db_tarefa
+    """
+    Obtém os detalhes de uma tarefa específica.
+    Em MessagePack, a resposta é um único mapa, como no JSON; no formato colunar,
+    tem colunas com um só elemento.
+    """
+    response.headers["Vary"] = "Accept"
+    return formatos.responder_tarefa(request, db_tarefa) or db_tarefa
 
 
 @app.put("/tarefas/{tarefa_id}", response_model=schemas.Tarefa, tags=["Tarefas"])
@@ -5,7 +5,7 @@ Este ficheiro define a estrutura das tabelas do banco de dados utilizando
 o ORM do SQLAlchemy. Cada classe aqui representa uma tabela e os seus
 atributos correspondem às colunas dessa tabela.
 """
-from sqlalchemy import Boolean, Column, Date, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, String, Table, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -18,6 +18,9 @@ class Usuario(Base):
     Armazena as informações de login de um utilizador.
     """
     __tablename__ = "usuarios"
+    # No SQLite, impede a reutilização do ID de uma conta apagada (o PostgreSQL
+    # nunca reutiliza valores da sequência). Os tokens dependem disso (claim "uid").
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
@@ -27,12 +30,60 @@ class Usuario(Base):
     # Define a relação "um-para-muitos" com a tabela de tarefas.
     # O 'back_populates' cria a ligação bidirecional com o relacionamento 'dono' na classe Tarefa.
     # O 'cascade' garante que, se um utilizador for apagado, todas as suas tarefas também o sejam.
-    tarefas = relationship("Tarefa", back_populates="dono", cascade="all, delete-orphan")
+    # Com 'passive_deletes', o SQLAlchemy não carrega as tarefas para as apagar uma a uma:
+    # deixa esse trabalho ao 'ON DELETE CASCADE' da chave estrangeira em Tarefa.dono_id.
+    tarefas = relationship(
+        "Tarefa", back_populates="dono", cascade="all, delete-orphan", passive_deletes=True
+    )
 
     def __repr__(self):
         return f"<Usuario(id={self.id}, email='{self.email}')>"
 
 
+# --- Tabelas de Associação das Etiquetas ---
+
+# Liga as tarefas às etiquetas (muitos-para-muitos). Apagar uma tarefa ou uma
+# etiqueta apaga as suas ligações no próprio banco de dados ('ON DELETE CASCADE').
+# A chave primária serve o carregamento das etiquetas de uma página de tarefas;
+# o índice inverso serve o filtro das tarefas por etiqueta.
+tarefas_etiquetas = Table(
+    "tarefas_etiquetas",
+    Base.metadata,
+    Column("tarefa_id", Integer, ForeignKey("tarefas.id", ondelete="CASCADE"), primary_key=True),
+    Column("etiqueta_id", Integer, ForeignKey("etiquetas.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_tarefas_etiquetas_etiqueta_id", "etiqueta_id", "tarefa_id"),
+)
+
+# O mesmo para as tarefas arquivadas: as ligações acompanham a tarefa no
+# arquivamento e no restauro (ver `crud.arquivar_tarefas_concluidas`).
+tarefas_arquivo_etiquetas = Table(
+    "tarefas_arquivo_etiquetas",
+    Base.metadata,
+    Column("tarefa_id", Integer, ForeignKey("tarefas_arquivo.id", ondelete="CASCADE"), primary_key=True),
+    Column("etiqueta_id", Integer, ForeignKey("etiquetas.id", ondelete="CASCADE"), primary_key=True),
+)
+
+
+class Etiqueta(Base):
+    """
+    Representa a tabela 'etiquetas' no banco de dados.
+
+    Uma etiqueta de um utilizador (ex.: "casa", "trabalho"), que pode ser
+    associada a várias das suas tarefas. Cada utilizador tem os seus nomes.
+    """
+    __tablename__ = "etiquetas"
+    __table_args__ = (
+        UniqueConstraint("dono_id", "nome", name="uq_etiquetas_dono_id_nome"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    nome = Column(String, nullable=False)
+    dono_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), nullable=False)
+
+    def __repr__(self):
+        return f"<Etiqueta(id={self.id}, nome='{self.nome}')>"
+
+
 class Tarefa(Base):
     """
     Representa a tabela 'tarefas' no banco de dados.
@@ -40,6 +91,17 @@ class Tarefa(Base):
     Armazena os detalhes de uma tarefa, que está sempre associada a um utilizador.
     """
     __tablename__ = "tarefas"
+    __table_args__ = (
+        # Índice de cobertura do resumo (`crud.get_resumo_tarefas`): o GROUP BY e a
+        # contagem das tarefas atrasadas leem apenas o índice, nunca a tabela.
+        Index("ix_tarefas_resumo", "dono_id", "concluida", "data_vencimento", "prioridade"),
+        # Serve o varrimento dos vencimentos (`vencimentos.py`): as tarefas pendentes
+        # por ordem de data de vencimento, retomadas a partir da última processada.
+        Index("ix_tarefas_vencimento", "concluida", "data_vencimento", "id"),
+        # No SQLite, impede a reutilização do ID de uma tarefa arquivada ou apagada:
+        # o restauro de uma tarefa arquivada devolve-lhe o ID original.
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     titulo = Column(String, index=True, nullable=False)
@@ -47,14 +109,140 @@ class Tarefa(Base):
     concluida = Column(Boolean, default=False, nullable=False)
     data_vencimento = Column(Date, nullable=True)
     prioridade = Column(String, default="verde", nullable=False)
+    # Momento (UTC) em que a tarefa foi marcada como concluída; None se estiver pendente.
+    # Indexado para o arquivamento, que procura as tarefas concluídas há mais tempo.
+    concluida_em = Column(DateTime, nullable=True, index=True)
 
     # --- Chaves Estrangeiras e Relacionamentos ---
     # Define a coluna que armazena o ID do utilizador dono da tarefa.
-    dono_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    # O 'ondelete="CASCADE"' faz o próprio banco de dados apagar as tarefas do utilizador,
+    # e o índice serve tanto as listagens por dono como essa remoção em cascata.
+    dono_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), nullable=False, index=True)
 
     # Cria a referência de volta para o objeto Usuario correspondente.
     # O 'back_populates' liga este relacionamento ao 'tarefas' na classe Usuario.
     dono = relationship("Usuario", back_populates="tarefas")
 
+    # As etiquetas da tarefa, por ordem de nome. Com 'lazy="selectin"', cada
+    # consulta de tarefas carrega as etiquetas de todas elas num único SELECT ... IN
+    # adicional, em vez de uma consulta por tarefa durante a serialização.
+    # Com 'passive_deletes', apagar a tarefa deixa as ligações ao 'ON DELETE CASCADE'.
+    etiquetas = relationship(
+        "Etiqueta", secondary=tarefas_etiquetas, order_by=Etiqueta.nome, lazy="selectin", passive_deletes=True
+    )
+
+    def __repr__(self):
+        return f"<Tarefa(id={self.id}, titulo='{self.titulo}')>"
+
+
+class ContagemTarefas(Base):
+    """
+    Representa a tabela 'contagem_tarefas' no banco de dados.
+
+    Guarda, por utilizador, estado (concluída ou não) e prioridade, o número de
+    tarefas. Só é usada com RESUMO_CONTADORES ativo: é mantida pelas escritas em
+    `crud.py` e torna o resumo independente do número de tarefas do utilizador.
+    """
+    __tablename__ = "contagem_tarefas"
+
+    dono_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    concluida = Column(Boolean, primary_key=True)
+    prioridade = Column(String, primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return (
+            f"<ContagemTarefas(dono_id={self.dono_id}, concluida={self.concluida}, "
+            f"prioridade='{self.prioridade}', total={self.total})>"
+        )
+
+
+class TarefaArquivada(Base):
+    """
+    Representa a tabela 'tarefas_arquivo' no banco de dados.
+
+    Guarda as tarefas concluídas há mais tempo, movidas para fora da tabela
+    'tarefas' pelo arquivamento (`arquivo.py`), para que as listagens do dia a
+    dia só percorram as tarefas ativas. Cada tarefa mantém o seu ID original,
+    que é reutilizado se for restaurada.
+    """
+    __tablename__ = "tarefas_arquivo"
+    __table_args__ = (
+        # Serve a listagem do arquivo de cada utilizador, por ordem de ID.
+        Index("ix_tarefas_arquivo_dono_id", "dono_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    titulo = Column(String, nullable=False)
+    descricao = Column(String, nullable=True)
+    concluida = Column(Boolean, default=True, nullable=False)
+    data_vencimento = Column(Date, nullable=True)
+    prioridade = Column(String, default="verde", nullable=False)
+    concluida_em = Column(DateTime, nullable=True)
+    arquivada_em = Column(DateTime, nullable=False)
+    dono_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), nullable=False)
+
+    etiquetas = relationship(
+        "Etiqueta", secondary=tarefas_arquivo_etiquetas, order_by=Etiqueta.nome, lazy="selectin",
+        passive_deletes=True,
+    )
+
+    def __repr__(self):
+        return f"<TarefaArquivada(id={self.id}, titulo='{self.titulo}')>"
+
+
+class DiretorioShard(Base):
+    """
+    Representa a tabela 'diretorio_shards' no banco de dados.
+
+    Só é usada no modo de sharding (ver `shards.py`), e apenas no shard 0:
+    regista o shard dos utilizadores movidos pela ferramenta de rebalanceamento,
+    que deixam de estar no shard indicado pelo hash do seu email.
+    """
+    __tablename__ = "diretorio_shards"
+
+    email = Column(String, primary_key=True)
+    shard = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<DiretorioShard(email='{self.email}', shard={self.shard})>"
+
+
+class Concessao(Base):
+    """
+    Representa a tabela 'concessoes' no banco de dados.
+
+    Uma concessão (lease) com prazo garante que, com vários workers, só um
+    executa cada tarefa periódica de cada vez (ex.: o varrimento dos
+    vencimentos). O titular renova-a enquanto trabalha; se o worker parar,
+    outro pode assumi-la quando ela expirar.
+    """
+    __tablename__ = "concessoes"
+
+    nome = Column(String, primary_key=True)
+    titular = Column(String, nullable=False)
+    expira_em = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<Concessao(nome='{self.nome}', titular='{self.titular}', expira_em={self.expira_em})>"
+
+
+class MarcaVencimentos(Base):
+    """
+    Representa a tabela 'marcas_vencimento' no banco de dados.
+
+    Guarda, por tipo de evento, a última tarefa já notificada pelo varrimento
+    dos vencimentos (a sua data de vencimento e o seu ID). Cada varrimento
+    continua a partir daqui, em vez de voltar a percorrer todas as tarefas.
+    """
+    __tablename__ = "marcas_vencimento"
+
+    tipo = Column(String, primary_key=True)
+    data_vencimento = Column(Date, nullable=False)
+    tarefa_id = Column(Integer, nullable=False)
+
     def __repr__(self):
-        return f"<Tarefa(id={self.id}, titulo='{self.titulo}')>"
\ No newline at end of file
+        return (
+            f"<MarcaVencimentos(tipo='{self.tipo}', data_vencimento={self.data_vencimento}, "
+            f"tarefa_id={self.tarefa_id})>"
+        )
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+Módulo de Perfilamento a Pedido (Profiling)
+
+Quando um utilizador reporta uma chamada lenta, este middleware permite
+capturar um perfil (cProfile) dessa única requisição, sem o custo de
+perfilar todo o tráfego. O perfilamento é ativado por:
+
+- um cabeçalho `X-Perfil` com um token assinado pelo administrador
+  (gerado com `criar_token_de_perfil`, usando a mesma SECRET_KEY dos JWT); ou
+- a variável de ambiente `PERFIL_UTILIZADORES`, uma lista de emails separados
+  por vírgulas cujas requisições são sempre perfiladas.
+
+Cada perfil é guardado em disco (`PERFIL_DIR`, padrão `logs/perfis`) como um
+ficheiro `.prof` (legível com `pstats` ou snakeviz) e um resumo `.json` com a
+divisão do tempo entre a dependência `get_usuario_atual`, o SQL e a
+serialização da resposta. Só são mantidos os `PERFIL_MAX_FICHEIROS` mais recentes.
+
+Sem o cabeçalho e sem allowlist, o middleware limita-se a verificar os
+cabeçalhos e a chamar a aplicação: não instala listeners nem ativa o profiler.
+"""
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+
+from jose import JWTError, jwt
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from auth import ALGORITHM, SECRET_KEY
+
+
+# --- Configuração ---
+
+PASTA_PERFIS = os.getenv("PERFIL_DIR", "logs/perfis")
+MAX_FICHEIROS = int(os.getenv("PERFIL_MAX_FICHEIROS", "50"))
+UTILIZADORES_PERFILADOS = {
+    email.strip() for email in os.getenv("PERFIL_UTILIZADORES", "").split(",") if email.strip()
+}
+
+# Funções cujo tempo cumulativo é destacado no resumo.
+SECOES = {
+    "dependencia_usuario_ms": "get_usuario_atual",
+    "serializacao_ms": "serialize_response",
+}
+
+
+# --- Token de Perfilamento ---
+
+def criar_token_de_perfil(minutos: int = 10) -> str:
+    """
+    Cria um token de curta duração que ativa o perfilamento de uma requisição.
+    Deve ser gerado por um administrador, com acesso à SECRET_KEY.
+    """
+    expira_em = datetime.now(timezone.utc) + timedelta(minutes=minutos)
+    return jwt.encode({"perfil": True, "exp": expira_em}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def _token_de_perfil_valido(token: str) -> bool:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("perfil") is True
+
+
+def _utilizador_na_allowlist(autorizacao: str) -> bool:
+    esquema, _, token = autorizacao.partition(" ")
+    if esquema.lower() != "bearer":
+        return False
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("sub") in UTILIZADORES_PERFILADOS
+
+
+# --- Medição do SQL ---
+
+# O medidor da requisição perfilada, visível apenas no seu contexto: os
+# listeners são globais, mas o SQL de requisições concorrentes não é contado.
+_medidor_atual: ContextVar["_MedidorSQL | None"] = ContextVar("medidor_sql", default=None)
+
+
+class _MedidorSQL:
+    """Soma o tempo dos comandos SQL da requisição perfilada."""
+
+    def __init__(self):
+        self.total = 0.0
+        self.comandos = 0
+        self._token = None
+
+    def antes(self, conn, cursor, statement, parameters, context, executemany):
+        if _medidor_atual.get() is self:
+            conn.info.setdefault("perfil_inicio", []).append(time.perf_counter())
+
+    def depois(self, conn, cursor, statement, parameters, context, executemany):
+        # Sem início registado: o comando começou antes de os listeners serem instalados.
+        inicios = conn.info.get("perfil_inicio")
+        if _medidor_atual.get() is not self or not inicios:
+            return
+        self.total += time.perf_counter() - inicios.pop()
+        self.comandos += 1
+
+    def erro(self, contexto):
+        # Um comando que falha não chega ao `depois`: descarta o seu início.
+        conn = contexto.connection
+        if _medidor_atual.get() is self and conn is not None and conn.info.get("perfil_inicio"):
+            conn.info["perfil_inicio"].pop()
+
+    def __enter__(self):
+        self._token = _medidor_atual.set(self)
+        event.listen(Engine, "before_cursor_execute", self.antes)
+        event.listen(Engine, "after_cursor_execute", self.depois)
+        event.listen(Engine, "handle_error", self.erro)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self.antes)
+        event.remove(Engine, "after_cursor_execute", self.depois)
+        event.remove(Engine, "handle_error", self.erro)
+        _medidor_atual.reset(self._token)
+
+
+# --- Middleware ASGI ---
+
+class MiddlewareDePerfilamento:
+    """
+    Middleware que perfila as requisições marcadas e guarda o resultado em disco.
+
+    O cProfile mede a thread inteira: enquanto um perfil está ativo, código de
+    outras requisições concorrentes no mesmo event loop também aparece no trace.
+    Por isso só é capturado um perfil de cada vez; pedidos simultâneos seguem
+    sem perfilamento.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._ativo = False
+
+    def _deve_perfilar(self, scope) -> bool:
+        autorizacao = None
+        for nome, valor in scope["headers"]:
+            if nome == b"x-perfil":
+                return _token_de_perfil_valido(valor.decode("latin-1"))
+            if nome == b"authorization":
+                autorizacao = valor
+        if UTILIZADORES_PERFILADOS and autorizacao is not None:
+            return _utilizador_na_allowlist(autorizacao.decode("latin-1"))
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._ativo or not self._deve_perfilar(scope):
+            await self.app(scope, receive, send)
+            return
+
+        perfil_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+        async def send_com_id(mensagem):
+            if mensagem["type"] == "http.response.start":
+                mensagem["headers"] = [*mensagem.get("headers", []), (b"x-perfil-id", perfil_id.encode())]
+            await send(mensagem)
+
+        self._ativo = True
+        profiler = cProfile.Profile()
+        inicio = time.perf_counter()
+        try:
+            with _MedidorSQL() as sql:
+                profiler.enable()
+                try:
+                    await self.app(scope, receive, send_com_id)
+                finally:
+                    profiler.disable()
+        finally:
+            self._ativo = False
+        total = time.perf_counter() - inicio
+
+        resumo = {
+            "id": perfil_id,
+            "metodo": scope["method"],
+            "caminho": scope["path"],
+            "total_ms": round(total * 1000, 3),
+            "sql_ms": round(sql.total * 1000, 3),
+            "sql_comandos": sql.comandos,
+        }
+        await asyncio.to_thread(_guardar_perfil, profiler, resumo)
+
+
+# --- Armazenamento ---
+
+def _guardar_perfil(profiler: cProfile.Profile, resumo: dict):
+    """
+    Escreve o `.prof` e o resumo `.json` e aplica o limite de retenção.
+
+    Nota: para corrotinas, o tempo cumulativo do cProfile exclui o tempo em que
+    a corrotina esteve suspensa num `await` (ex.: à espera do banco de dados);
+    esse tempo está contabilizado em `sql_ms`.
+    """
+    os.makedirs(PASTA_PERFIS, exist_ok=True)
+    estatisticas = pstats.Stats(profiler)
+
+    for chave, nome_funcao in SECOES.items():
+        resumo[chave] = round(1000 * sum(
+            cumulativo
+            for (_, _, funcao), (_, _, _, cumulativo, _) in estatisticas.stats.items()
+            if funcao == nome_funcao
+        ), 3)
+
+    texto = io.StringIO()
+    pstats.Stats(profiler, stream=texto).sort_stats("cumulative").print_stats(25)
+    resumo["top_funcoes"] = texto.getvalue()
+
+    base = os.path.join(PASTA_PERFIS, resumo["id"])
+    estatisticas.dump_stats(base + ".prof")
+    with open(base + ".json", "w", encoding="utf-8") as ficheiro:
+        json.dump(resumo, ficheiro, ensure_ascii=False, indent=2)
+
+    # Retenção: os nomes começam pelo timestamp, logo a ordem alfabética é cronológica.
+    perfis = sorted(nome[:-5] for nome in os.listdir(PASTA_PERFIS) if nome.endswith(".json"))
+    for antigo in perfis[:-MAX_FICHEIROS] if MAX_FICHEIROS > 0 else perfis:
+        for extensao in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(PASTA_PERFIS, antigo + extensao))
+            except FileNotFoundError:
+                pass
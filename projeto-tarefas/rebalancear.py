@@ -0,0 +1,253 @@
+"""
+Ferramenta de Rebalanceamento de Shards
+
+Move um utilizador, com as suas tarefas ativas e arquivadas, de um shard para
+outro (ver `shards.py`). Útil para equilibrar a carga ou esvaziar um shard.
+
+Passos, cada um retomável se a ferramenta for interrompida e executada de novo:
+
+1. Na origem, o email da conta passa a `<email>#migrando`: os tokens e o login
+   deixam de a encontrar, e nada é escrito nela durante a cópia.
+2. No destino, a conta, as etiquetas e as tarefas são copiadas em lotes (com IDs
+   novos, porque os IDs só são únicos dentro de cada shard). Restos de uma cópia
+   interrompida são apagados primeiro.
+3. O diretório (`diretorio_shards`, no shard 0) passa a indicar o destino.
+4. Na origem, a conta é marcada para remoção e purgada em lotes, como em
+   `DELETE /usuarios/me`; se o processo parar, a aplicação retoma a purga no arranque.
+
+O utilizador tem de voltar a fazer login (o token antigo aponta para a conta da origem).
+
+Uso (a partir da pasta `projeto-tarefas`, com DATABASE_URLS definida):
+
+    python -m rebalancear <email> <shard_destino> [--lote 1000]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import delete, insert, or_, select
+
+import cache
+import crud
+import models
+import shards
+
+# Sufixo do email de uma conta que está a ser movida (não é um email válido para o login).
+SUFIXO_EM_MIGRACAO = "#migrando"
+
+# Colunas copiadas de cada tarefa (o ID é gerado no destino e o dono é substituído).
+_COLUNAS_TAREFA = ["titulo", "descricao", "concluida", "data_vencimento", "prioridade", "concluida_em"]
+
+
+async def _copiar_etiquetas(fabrica_origem, fabrica_destino, dono_origem: int, dono_destino: int) -> dict[int, int]:
+    """Copia as etiquetas do utilizador e devolve a correspondência entre os IDs da origem e os do destino."""
+    async with fabrica_origem() as db:
+        result = await db.execute(
+            select(models.Etiqueta.id, models.Etiqueta.nome)
+            .filter(models.Etiqueta.dono_id == dono_origem)
+            .order_by(models.Etiqueta.id)
+        )
+        etiquetas = result.all()
+    if not etiquetas:
+        return {}
+    async with fabrica_destino() as db:
+        result = await db.execute(
+            insert(models.Etiqueta).returning(models.Etiqueta.id, sort_by_parameter_order=True),
+            [{"nome": nome, "dono_id": dono_destino} for _, nome in etiquetas],
+        )
+        novos_ids = result.scalars().all()
+        await db.commit()
+    return {antigo_id: novo_id for (antigo_id, _), novo_id in zip(etiquetas, novos_ids)}
+
+
+def _ligacoes(lote, novos_ids: list[int], etiquetas: dict[int, int]) -> list[dict]:
+    """As ligações às etiquetas de um lote de tarefas, já com os IDs do destino."""
+    return [
+        {"tarefa_id": novo_id, "etiqueta_id": etiquetas[etiqueta.id]}
+        for t, novo_id in zip(lote, novos_ids)
+        for etiqueta in t.etiquetas
+    ]
+
+
+async def _copiar_tarefas(
+    fabrica_origem, fabrica_destino, dono_origem: int, dono_destino: int, etiquetas: dict[int, int], tamanho_lote: int
+):
+    """
+    Copia as tarefas ativas e as suas etiquetas, em lotes (paginação por ID,
+    uma transação por lote no destino).
+    """
+    ultimo_id = 0
+    while True:
+        async with fabrica_origem() as db:
+            result = await db.execute(
+                select(models.Tarefa)
+                .filter(models.Tarefa.dono_id == dono_origem, models.Tarefa.id > ultimo_id)
+                .order_by(models.Tarefa.id)
+                .limit(tamanho_lote)
+            )
+            lote = result.scalars().all()
+        if not lote:
+            return
+        async with fabrica_destino() as db:
+            result = await db.execute(
+                insert(models.Tarefa).returning(models.Tarefa.id, sort_by_parameter_order=True),
+                [
+                    {**{coluna: getattr(t, coluna) for coluna in _COLUNAS_TAREFA}, "dono_id": dono_destino}
+                    for t in lote
+                ],
+            )
+            ligacoes = _ligacoes(lote, result.scalars().all(), etiquetas)
+            if ligacoes:
+                await db.execute(insert(models.tarefas_etiquetas), ligacoes)
+            await db.commit()
+        ultimo_id = lote[-1].id
+
+
+async def _copiar_arquivo(
+    fabrica_origem, fabrica_destino, dono_origem: int, dono_destino: int, etiquetas: dict[int, int], tamanho_lote: int
+):
+    """
+    Copia as tarefas arquivadas e as suas etiquetas, em lotes.
+
+    Os IDs novos são reservados inserindo as tarefas em `tarefas` e movendo-as
+    logo para o arquivo, na mesma transação: assim, um restauro no destino
+    nunca colide com o ID de outra tarefa.
+    """
+    ultimo_id = 0
+    while True:
+        async with fabrica_origem() as db:
+            result = await db.execute(
+                select(models.TarefaArquivada)
+                .filter(models.TarefaArquivada.dono_id == dono_origem, models.TarefaArquivada.id > ultimo_id)
+                .order_by(models.TarefaArquivada.id)
+                .limit(tamanho_lote)
+            )
+            lote = result.scalars().all()
+        if not lote:
+            return
+        async with fabrica_destino() as db:
+            result = await db.execute(
+                insert(models.Tarefa).returning(models.Tarefa.id, sort_by_parameter_order=True),
+                [
+                    {**{coluna: getattr(t, coluna) for coluna in _COLUNAS_TAREFA}, "dono_id": dono_destino}
+                    for t in lote
+                ],
+            )
+            novos_ids = result.scalars().all()
+            await db.execute(insert(models.TarefaArquivada), [
+                {
+                    **{coluna: getattr(t, coluna) for coluna in _COLUNAS_TAREFA},
+                    "id": novo_id, "dono_id": dono_destino, "arquivada_em": t.arquivada_em,
+                }
+                for t, novo_id in zip(lote, novos_ids)
+            ])
+            ligacoes = _ligacoes(lote, novos_ids, etiquetas)
+            if ligacoes:
+                await db.execute(insert(models.tarefas_arquivo_etiquetas), ligacoes)
+            await db.execute(delete(models.Tarefa).filter(models.Tarefa.id.in_(novos_ids)))
+            await db.commit()
+        ultimo_id = lote[-1].id
+
+
+async def mover_usuario(email: str, destino: int, tamanho_lote: int = 1000) -> int | None:
+    """
+    Move um utilizador e as suas tarefas para o shard `destino`.
+
+    Args:
+        email: O email do utilizador.
+        destino: O índice do shard de destino.
+        tamanho_lote: Número máximo de tarefas copiadas ou apagadas por transação.
+
+    Returns:
+        O novo ID do utilizador no destino, ou None se já estava nesse shard.
+
+    Raises:
+        RuntimeError: Se o modo de sharding não estiver ativo.
+        ValueError: Se o shard de destino ou o utilizador não existirem.
+    """
+    mapa = shards.mapa
+    if mapa is None:
+        raise RuntimeError("O modo de sharding não está ativo (DATABASE_URLS)")
+    if not 0 <= destino < len(mapa):
+        raise ValueError(f"Shard de destino inválido: {destino} (existem {len(mapa)})")
+    origem = await mapa.indice_de(email)
+    if origem == destino:
+        # Pode ser uma nova tentativa, interrompida depois de atualizar o diretório.
+        await _remover_contas_em_migracao(email, tamanho_lote)
+        return None
+    fabrica_origem, fabrica_destino = mapa.fabricas[origem], mapa.fabricas[destino]
+    email_em_migracao = email + SUFIXO_EM_MIGRACAO
+
+    # 1. Bloqueia a conta na origem (ou encontra-a já bloqueada, numa nova tentativa).
+    async with fabrica_origem() as db:
+        result = await db.execute(
+            select(models.Usuario).filter(or_(models.Usuario.email == email, models.Usuario.email == email_em_migracao))
+        )
+        usuario = result.scalar_one_or_none()
+        if usuario is None:
+            raise ValueError(f"Utilizador não encontrado no shard {origem}: {email}")
+        dono_origem, senha_hash = usuario.id, usuario.senha_hash
+        usuario.email = email_em_migracao
+        await db.commit()
+
+    # 2. Copia a conta e as tarefas para o destino.
+    async with fabrica_destino() as db:
+        await db.execute(delete(models.Usuario).filter(models.Usuario.email == email))  # Restos de outra tentativa
+        novo = models.Usuario(email=email, senha_hash=senha_hash)
+        db.add(novo)
+        await db.flush()
+        dono_destino = novo.id  # Lido antes do commit, que expira os atributos
+        await db.commit()
+    etiquetas = await _copiar_etiquetas(fabrica_origem, fabrica_destino, dono_origem, dono_destino)
+    await _copiar_tarefas(fabrica_origem, fabrica_destino, dono_origem, dono_destino, etiquetas, tamanho_lote)
+    await _copiar_arquivo(fabrica_origem, fabrica_destino, dono_origem, dono_destino, etiquetas, tamanho_lote)
+    if crud.CONTADORES_ATIVOS:
+        async with fabrica_destino() as db:
+            await crud.reconstruir_contagens(db, dono_id=dono_destino)
+    await cache.invalidar(dono_destino, shard=destino)
+
+    # 3. Atualiza o diretório: a partir daqui, o registo e o login usam o destino.
+    async with mapa.fabricas[0]() as db:
+        await db.execute(delete(models.DiretorioShard).filter(models.DiretorioShard.email == email.lower()))
+        if destino != mapa.indice_por_hash(email):
+            db.add(models.DiretorioShard(email=email.lower(), shard=destino))
+        await db.commit()
+
+    # 4. Remove a conta da origem.
+    await _remover_contas_em_migracao(email, tamanho_lote)
+    return dono_destino
+
+
+async def _remover_contas_em_migracao(email: str, tamanho_lote: int):
+    """Marca para remoção e purga, em todos os shards, a conta bloqueada no passo 1."""
+    for fabrica in shards.mapa.fabricas:
+        async with fabrica() as db:
+            result = await db.execute(select(models.Usuario).filter(models.Usuario.email == email + SUFIXO_EM_MIGRACAO))
+            usuario = result.scalar_one_or_none()
+            if usuario is None:
+                continue
+            usuario_id = usuario.id
+            await crud.marcar_usuario_para_remocao(db, usuario)
+        await crud.purgar_usuario(fabrica, usuario_id, tamanho_lote)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Move um utilizador para outro shard.")
+    parser.add_argument("email", help="O email do utilizador a mover.")
+    parser.add_argument("destino", type=int, help="O índice do shard de destino (a partir de 0).")
+    parser.add_argument("--lote", type=int, default=1000, help="Tarefas por transação (padrão: 1000).")
+    argumentos = parser.parse_args()
+
+    try:
+        novo_id = await mover_usuario(argumentos.email, argumentos.destino, argumentos.lote)
+    finally:
+        await cache.fechar()
+        if shards.mapa is not None:
+            await shards.mapa.fechar()
+    if novo_id is None:
+        print(f"{argumentos.email} já está no shard {argumentos.destino}.")
+    else:
+        print(f"{argumentos.email} movido para o shard {argumentos.destino} (novo ID: {novo_id}).")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""
+Módulo de Registos (Logging Estruturado)
+
+Este ficheiro configura os registos da aplicação em formato JSON, uma linha
+por evento, sem bloquear o event loop:
+
+- Os loggers da aplicação (`tarefas.*`) escrevem numa fila em memória
+  (`QueueHandler`); uma thread em segundo plano (`QueueListener`) é quem
+  formata e escreve para o stdout e para o ficheiro `LOG_FILE`.
+- Cada requisição recebe um ID (`X-Request-ID`, aceite do cliente ou gerado),
+  que é incluído em todos os registos feitos durante essa requisição,
+  incluindo os eventos de SQL.
+- Os comandos SQL mais lentos do que `LOG_SQL_LENTO_MS` são registados com os
+  parâmetros ocultados e, opcionalmente (`LOG_SQL_EXPLAIN`), com o plano de execução.
+
+Variáveis de ambiente: LOG_LEVEL (padrão INFO), LOG_FILE (padrão logs/app.log),
+LOG_SQL_LENTO_MS (padrão 200) e LOG_SQL_EXPLAIN (padrão desativado).
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+
+
+# --- Configuração ---
+
+NIVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+FICHEIRO = os.getenv("LOG_FILE", "logs/app.log")
+SQL_LENTO = float(os.getenv("LOG_SQL_LENTO_MS", "200")) / 1000
+SQL_EXPLAIN = os.getenv("LOG_SQL_EXPLAIN", "").lower() in ("1", "true", "sim")
+
+# ID da requisição em curso; propaga-se para as tarefas e greenlets do SQLAlchemy.
+id_requisicao: ContextVar[str | None] = ContextVar("id_requisicao", default=None)
+
+logger = logging.getLogger("tarefas")
+logger_acesso = logging.getLogger("tarefas.acesso")
+logger_sql = logging.getLogger("tarefas.sql")
+
+_ouvinte: logging.handlers.QueueListener | None = None
+
+
+# --- Formatação ---
+
+class FormatadorJSON(logging.Formatter):
+    """
+    Formata cada registo como um objeto JSON numa única linha.
+    Campos adicionais são passados com `extra={"dados": {...}}`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        registo = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "id_requisicao", None):
+            registo["id_requisicao"] = record.id_requisicao
+        registo.update(getattr(record, "dados", {}))
+        if record.exc_info:
+            registo["excecao"] = self.formatException(record.exc_info)
+        return json.dumps(registo, ensure_ascii=False, default=str)
+
+
+class _FiltroIdRequisicao(logging.Filter):
+    """Copia o ID da requisição para o registo, ainda na thread que o emitiu."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "id_requisicao", None) is None:
+            record.id_requisicao = id_requisicao.get()
+        return True
+
+
+# Os loggers deste módulo anotam o ID logo na emissão (também sem `configurar()`,
+# por exemplo nos testes); o filtro do QueueHandler cobre os restantes `tarefas.*`.
+for _logger in (logger, logger_acesso, logger_sql):
+    _logger.addFilter(_FiltroIdRequisicao())
+
+
+# --- Ciclo de Vida ---
+
+def configurar():
+    """
+    Liga os loggers `tarefas.*` à fila e arranca a thread de escrita.
+    Chamado no arranque da aplicação (`database.lifespan`).
+    """
+    global _ouvinte
+    if _ouvinte is not None:
+        return
+
+    formatador = FormatadorJSON()
+    destinos: list[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if FICHEIRO:
+        os.makedirs(os.path.dirname(FICHEIRO) or ".", exist_ok=True)
+        destinos.append(
+            logging.handlers.RotatingFileHandler(FICHEIRO, maxBytes=10_000_000, backupCount=5, encoding="utf-8")
+        )
+    for destino in destinos:
+        destino.setFormatter(formatador)
+
+    fila: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(fila)
+    handler.addFilter(_FiltroIdRequisicao())
+    logger.addHandler(handler)
+    logger.setLevel(NIVEL)
+    logger.propagate = False
+
+    _ouvinte = logging.handlers.QueueListener(fila, *destinos, respect_handler_level=True)
+    _ouvinte.start()
+
+
+def parar():
+    """Escreve os registos pendentes e termina a thread de escrita."""
+    global _ouvinte
+    if _ouvinte is None:
+        return
+    _ouvinte.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    for destino in _ouvinte.handlers:
+        destino.close()
+    _ouvinte = None
+
+
+# --- Registo de Acesso ---
+
+class MiddlewareDeRegistoDeAcesso:
+    """
+    Middleware ASGI que atribui um ID a cada requisição e regista, no fim,
+    o método, o caminho, o código de resposta e a duração.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"x-request-id"), None)
+        rid = rid[:64] if rid else uuid.uuid4().hex
+        token = id_requisicao.set(rid)
+        estado = {"codigo": 500}
+
+        async def send_com_id(mensagem):
+            if mensagem["type"] == "http.response.start":
+                estado["codigo"] = mensagem["status"]
+                mensagem["headers"] = [*mensagem.get("headers", []), (b"x-request-id", rid.encode())]
+            await send(mensagem)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_com_id)
+        finally:
+            logger_acesso.info(
+                "%s %s %s", scope["method"], scope["path"], estado["codigo"],
+                extra={"dados": {
+                    "metodo": scope["method"],
+                    "caminho": scope["path"],
+                    "codigo": estado["codigo"],
+                    "duracao_ms": round((time.perf_counter() - inicio) * 1000, 2),
+                }},
+            )
+            id_requisicao.reset(token)
+
+
+# --- Registo de SQL Lento ---
+
+def _ocultar(parametros):
+    """Substitui os valores dos parâmetros por '?', mantendo a estrutura."""
+    if isinstance(parametros, dict):
+        return {chave: "?" for chave in parametros}
+    if isinstance(parametros, (list, tuple)):
+        if parametros and isinstance(parametros[0], (list, tuple, dict)):
+            return f"<{len(parametros)} conjuntos de parâmetros>"  # executemany
+        return ["?"] * len(parametros)
+    return parametros
+
+
+def _plano(conn, statement: str, parametros) -> list | None:
+    """
+    Obtém o plano de execução de um SELECT, no dialeto do banco de dados.
+
+    O EXPLAIN corre na ligação (e na transação) da requisição. No PostgreSQL,
+    um comando que falha aborta a transação inteira, por isso o EXPLAIN é feito
+    dentro de um SAVEPOINT, desfeito em caso de erro. No SQLite, um erro não
+    afeta a transação.
+    """
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    sqlite = conn.dialect.name == "sqlite"
+    prefixo = "EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        if not sqlite:
+            cursor.execute("SAVEPOINT registo_plano")
+        try:
+            cursor.execute(prefixo + statement, parametros)
+            plano = [list(linha) for linha in cursor.fetchall()]
+        except Exception:
+            if not sqlite:
+                cursor.execute("ROLLBACK TO SAVEPOINT registo_plano")
+            raise
+        if not sqlite:
+            cursor.execute("RELEASE SAVEPOINT registo_plano")
+        return plano
+    except Exception as erro:  # O plano é apenas informativo; nunca deve falhar a requisição.
+        return [f"indisponível: {erro}"]
+    finally:
+        cursor.close()
+
+
+def _antes_do_comando(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("registo_inicio", []).append(time.perf_counter())
+
+
+def _depois_do_comando(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("registo_inicio")
+    if not inicios:  # Listener instalado com o comando já em curso
+        return
+    duracao = time.perf_counter() - inicios.pop()
+    if duracao < SQL_LENTO:
+        return
+    dados = {
+        "sql": statement,
+        "parametros": _ocultar(parameters),
+        "duracao_ms": round(duracao * 1000, 2),
+    }
+    if SQL_EXPLAIN and not executemany:
+        dados["plano"] = _plano(conn, statement, parameters)
+    logger_sql.warning("SQL lento (%.0f ms)", duracao * 1000, extra={"dados": dados})
+
+
+def _erro_no_comando(contexto):
+    """Um comando que falha não chega ao `after_cursor_execute`: descarta o seu início."""
+    conn = contexto.connection
+    if conn is not None and conn.info.get("registo_inicio"):
+        conn.info["registo_inicio"].pop()
+
+
+def instalar_registo_sql(engine):
+    """Regista os listeners de SQL lento num engine (síncrono ou assíncrono)."""
+    alvo = getattr(engine, "sync_engine", engine)
+    event.listen(alvo, "before_cursor_execute", _antes_do_comando)
+    event.listen(alvo, "after_cursor_execute", _depois_do_comando)
+    event.listen(alvo, "handle_error", _erro_no_comando)
+
+
+def remover_registo_sql(engine):
+    """Remove os listeners instalados por `instalar_registo_sql`."""
+    alvo = getattr(engine, "sync_engine", engine)
+    event.remove(alvo, "before_cursor_execute", _antes_do_comando)
+    event.remove(alvo, "after_cursor_execute", _depois_do_comando)
+    event.remove(alvo, "handle_error", _erro_no_comando)
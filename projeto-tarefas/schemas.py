@@ -7,11 +7,11 @@ formatar os dados das respostas enviadas (output).
 
 Isto garante que a comunicação entre o cliente e o servidor seja previsível e segura.
 """
-from datetime import date
+from datetime import date, datetime
 from enum import Enum
-from typing import Optional
+from typing import Annotated, Optional
 
-from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, StringConstraints, field_validator
 
 
 # --- Enums ---
@@ -58,6 +58,10 @@ class Usuario(UsuarioBase):
 
 # --- Schemas para Tarefas ---
 
+# O nome de uma etiqueta, sem espaços nas pontas.
+NomeEtiqueta = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=30)]
+
+
 class TarefaBase(BaseModel):
     """Schema base com os campos comuns de uma tarefa."""
     titulo: str = Field(..., max_length=100, description="O título da tarefa.")
@@ -69,10 +73,19 @@ class TarefaBase(BaseModel):
 
 class TarefaCreate(TarefaBase):
     """
-    Schema usado para criar uma nova tarefa. Herda todos os campos da base.
-    O `pass` indica que não há campos adicionais necessários para a criação.
+    Schema usado para criar ou atualizar uma tarefa. Herda todos os campos da base
+    e recebe as etiquetas pelo nome (as que ainda não existem são criadas).
     """
-    pass
+    etiquetas: Optional[list[NomeEtiqueta]] = Field(
+        None,
+        max_length=10,
+        description="Os nomes das etiquetas. Na atualização, omitir mantém as atuais e [] remove-as.",
+    )
+
+    @field_validator("etiquetas")
+    @classmethod
+    def _sem_repetidas(cls, etiquetas: Optional[list[str]]) -> Optional[list[str]]:
+        return list(dict.fromkeys(etiquetas)) if etiquetas is not None else None
 
 
 class Tarefa(TarefaBase):
@@ -82,6 +95,7 @@ class Tarefa(TarefaBase):
     """
     id: int
     dono_id: int
+    etiquetas: list[str] = []
 
     model_config = ConfigDict(
         from_attributes=True,
@@ -94,6 +108,76 @@ class Tarefa(TarefaBase):
                 "concluida": False,
                 "data_vencimento": "2025-10-15",
                 "prioridade": "vermelha",
+                "etiquetas": ["relatórios", "trabalho"],
+            }
+        }
+    )
+
+    @field_validator("etiquetas", mode="before")
+    @classmethod
+    def _nomes_das_etiquetas(cls, etiquetas) -> list[str]:
+        """Aceita os objetos `models.Etiqueta` (lidos do banco de dados) e devolve os seus nomes."""
+        return [getattr(etiqueta, "nome", etiqueta) for etiqueta in etiquetas]
+
+
+class TarefaArquivada(Tarefa):
+    """
+    Schema usado para retornar uma tarefa do arquivo.
+    Inclui quando foi concluída e quando foi arquivada.
+    """
+    concluida_em: Optional[datetime] = None
+    arquivada_em: datetime
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        json_schema_extra={
+            "example": {
+                "id": 42,
+                "dono_id": 1,
+                "titulo": "Entregar a declaração de IRS",
+                "descricao": None,
+                "concluida": True,
+                "data_vencimento": "2025-06-30",
+                "prioridade": "amarela",
+                "etiquetas": ["finanças"],
+                "concluida_em": "2025-06-20T18:04:11",
+                "arquivada_em": "2025-07-21T03:00:02",
+            }
+        }
+    )
+
+
+# --- Schemas para o Resumo de Tarefas ---
+
+class ContagemPorEstado(BaseModel):
+    """Número de tarefas pendentes e concluídas."""
+    pendentes: int = 0
+    concluidas: int = 0
+
+
+class ResumoTarefas(BaseModel):
+    """
+    Schema usado para retornar os totais das tarefas de um utilizador,
+    sem que o cliente tenha de descarregar as tarefas.
+    """
+    total: int
+    pendentes: int
+    concluidas: int
+    atrasadas: int = Field(..., description="Tarefas pendentes com a data de vencimento já ultrapassada.")
+    por_prioridade: dict[Prioridade, ContagemPorEstado]
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "total": 12,
+                "pendentes": 7,
+                "concluidas": 5,
+                "atrasadas": 2,
+                "por_prioridade": {
+                    "vermelha": {"pendentes": 3, "concluidas": 1},
+                    "amarela": {"pendentes": 2, "concluidas": 1},
+                    "verde": {"pendentes": 2, "concluidas": 3},
+                },
             }
         }
     )
\ No newline at end of file
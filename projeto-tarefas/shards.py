@@ -0,0 +1,132 @@
+"""
+Módulo de Sharding (Vários Bancos de Dados)
+
+Por omissão, a aplicação usa um único banco de dados (`DATABASE_URL`). Com
+`DATABASE_URLS` (uma lista de URLs separadas por vírgulas), os utilizadores
+são repartidos por vários bancos de dados ("shards"), cada um com as tabelas
+completas e as tarefas dos seus utilizadores:
+
+- O shard de um utilizador é determinado pelo email: um hash estável
+  (CRC32) módulo o número de shards. Um utilizador movido pela ferramenta de
+  rebalanceamento (`rebalancear.py`) fica registado na tabela
+  `diretorio_shards` do shard 0, que tem prioridade sobre o hash.
+- O diretório só é consultado no registo e no login: o token leva o shard
+  (claim "shd"), e as requisições autenticadas vão diretamente para ele.
+- As sessões de `get_db` são encaminhadas (`SessaoRoteada`) para o shard
+  escolhido com `selecionar`; as restantes tarefas em segundo plano usam as
+  fábricas de cada shard (`fabricas`), cujas sessões já o indicam em `info["shard"]`.
+
+Os IDs de utilizadores e de tarefas só são únicos dentro de cada shard.
+Por isso as chaves do cache incluem o shard, e um utilizador movido recebe
+IDs novos (os tokens antigos deixam de ser válidos).
+"""
+import os
+import time
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+import admissao
+import database
+import models
+
+
+class SessaoRoteada(Session):
+    """
+    Sessão que envia cada comando para o engine do shard em `info["shard"]`.
+    Sem shard escolhido, não há banco de dados por omissão: o comando falha.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        shard = self.info.get("shard")
+        if shard is None:
+            raise RuntimeError("Sessão sem shard: chame shards.selecionar() antes de consultar o banco de dados")
+        return mapa.engines[shard].sync_engine
+
+
+class Shards:
+    """
+    Os engines e as fábricas de sessões de cada shard.
+
+    Args:
+        urls: As URLs dos bancos de dados, pela ordem dos shards.
+              A ordem não pode mudar sem mover os utilizadores.
+    """
+
+    def __init__(self, urls: list[str]):
+        self.engines: list[AsyncEngine] = [database.criar_engine(url) for url in urls]
+        self.fabricas = [
+            async_sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"shard": indice})
+            for indice, engine in enumerate(self.engines)
+        ]
+        # Sessões sem shard fixo, para as requisições (o shard é escolhido depois).
+        self.fabrica_roteada = async_sessionmaker(
+            autocommit=False, autoflush=False, sync_session_class=SessaoRoteada
+        )
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def indice_por_hash(self, email: str) -> int:
+        """O shard de um email segundo o hash, sem consultar o diretório."""
+        return zlib.crc32(email.lower().encode()) % len(self)
+
+    async def indice_de(self, email: str) -> int:
+        """O shard de um email: o do diretório, se o utilizador tiver sido movido, ou o do hash."""
+        async with self.fabricas[0]() as db:
+            result = await db.execute(
+                select(models.DiretorioShard.shard).filter(models.DiretorioShard.email == email.lower())
+            )
+            shard = result.scalar_one_or_none()
+        return shard if shard is not None else self.indice_por_hash(email)
+
+    async def fechar(self):
+        for engine in self.engines:
+            await engine.dispose()
+
+
+# --- Instância Global da Aplicação ---
+
+def _urls_do_ambiente() -> list[str]:
+    return [database.normalizar_url(url.strip()) for url in os.getenv("DATABASE_URLS", "").split(",") if url.strip()]
+
+
+_URLS = _urls_do_ambiente()
+
+# None no modo de um só banco de dados (o padrão).
+mapa: Shards | None = Shards(_URLS) if _URLS else None
+
+
+async def selecionar(db: AsyncSession, shard: int) -> None:
+    """
+    Encaminha a sessão de uma requisição para um shard.
+
+    Obtém logo a ligação do pool, para medir a espera tal como `auth.get_db`
+    faz no modo de um só banco de dados (ver `admissao.py`).
+    """
+    db.info["shard"] = shard
+    inicio = time.perf_counter()
+    await db.connection()
+    admissao.estado.registar_espera_pool(time.perf_counter() - inicio)
+
+
+def shard_da_sessao(db: AsyncSession) -> int | None:
+    """O shard de uma sessão, ou None no modo de um só banco de dados."""
+    return db.info.get("shard")
+
+
+def todos_os_engines(padrao: AsyncEngine) -> list[AsyncEngine]:
+    """Os engines de todos os shards ou, sem sharding, apenas `padrao`."""
+    return mapa.engines if mapa is not None else [padrao]
+
+
+def todas_as_fabricas(padrao) -> list:
+    """As fábricas de sessões de todos os shards ou, sem sharding, apenas `padrao`."""
+    return mapa.fabricas if mapa is not None else [padrao]
+
+
+def fabrica_do_shard(shard: int | None, padrao):
+    """A fábrica de sessões de um shard ou, sem sharding (`shard` None), `padrao`."""
+    return mapa.fabricas[shard] if shard is not None else padrao
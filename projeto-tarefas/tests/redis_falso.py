@@ -0,0 +1,85 @@
+"""
+Servidor Redis de Substituição para Testes
+
+Implementa, sobre asyncio, o subconjunto do protocolo Redis (RESP2) usado por
+`cache.CacheRedis`: GET, SET (com PX), DEL, INCR, PEXPIRE, AUTH, SELECT e PING.
+Permite testar o backend Redis sem um servidor real instalado.
+"""
+import asyncio
+import time
+
+
+class RedisFalso:
+    """Servidor RESP em memória, a escutar numa porta local livre."""
+
+    def __init__(self):
+        self.dados: dict[bytes, tuple[float, bytes]] = {}
+        self.comandos: list[str] = []
+        # Segundos de espera antes de cada resposta (para simular um servidor lento).
+        self.atraso = 0.0
+        self._servidor: asyncio.AbstractServer | None = None
+
+    @property
+    def url(self) -> str:
+        porta = self._servidor.sockets[0].getsockname()[1]
+        return f"redis://127.0.0.1:{porta}/0"
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender, "127.0.0.1", 0)
+
+    async def parar(self):
+        self._servidor.close()
+        await self._servidor.wait_closed()
+
+    async def _atender(self, leitor: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            while True:
+                linha = await leitor.readline()
+                if not linha:
+                    break
+                argumentos = []
+                for _ in range(int(linha[1:-2])):
+                    tamanho = int((await leitor.readline())[1:-2])
+                    argumentos.append((await leitor.readexactly(tamanho + 2))[:-2])
+                if self.atraso:
+                    await asyncio.sleep(self.atraso)
+                escritor.write(self._executar(argumentos))
+                await escritor.drain()
+        finally:
+            escritor.close()
+
+    def _valor(self, chave: bytes) -> bytes | None:
+        expira_em, valor = self.dados.get(chave, (0, None))
+        if valor is not None and expira_em and expira_em < time.monotonic():
+            del self.dados[chave]
+            return None
+        return valor
+
+    def _executar(self, argumentos: list[bytes]) -> bytes:
+        comando = argumentos[0].decode().upper()
+        self.comandos.append(comando)
+        if comando in ("AUTH", "SELECT", "PING"):
+            return b"+OK\r\n"
+        if comando == "GET":
+            valor = self._valor(argumentos[1])
+            return b"$-1\r\n" if valor is None else b"$%d\r\n%s\r\n" % (len(valor), valor)
+        if comando == "SET":
+            expira_em = 0
+            if len(argumentos) >= 5 and argumentos[3].upper() == b"PX":
+                expira_em = time.monotonic() + int(argumentos[4]) / 1000
+            self.dados[argumentos[1]] = (expira_em, argumentos[2])
+            return b"+OK\r\n"
+        if comando == "DEL":
+            apagadas = sum(self.dados.pop(chave, None) is not None for chave in argumentos[1:])
+            return b":%d\r\n" % apagadas
+        if comando == "INCR":
+            novo = int(self._valor(argumentos[1]) or 0) + 1
+            self.dados[argumentos[1]] = (0, str(novo).encode())
+            return b":%d\r\n" % novo
+        if comando == "PEXPIRE":
+            valor = self._valor(argumentos[1])
+            if valor is None:
+                return b":0\r\n"
+            self.dados[argumentos[1]] = (time.monotonic() + int(argumentos[2]) / 1000, valor)
+            return b":1\r\n"
+        return b"-ERR comando desconhecido\r\n"
@@ -8,6 +8,8 @@ num ambiente isolado, previsível e rápido.
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 
+from database import ativar_chaves_estrangeiras_sqlite
+
 # --- Configuração da URL do Banco de Dados de Teste ---
 
 # Define a URL para um banco de dados SQLite a ser executado em memória.
@@ -27,6 +29,10 @@ engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+# Tal como na aplicação, ativa as chaves estrangeiras do SQLite, para que o
+# 'ON DELETE CASCADE' das tarefas também funcione nos testes.
+ativar_chaves_estrangeiras_sqlite(engine)
+
 # Cria uma fábrica de sessões de teste.
 # Esta será usada para criar sessões de banco de dados para os testes,
 # permitindo que cada teste tenha a sua própria transação isolada.
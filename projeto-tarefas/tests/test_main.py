@@ -5,13 +5,37 @@ Estes testes verificam o comportamento da aplicação FastAPI como um todo,
 simulando requisições HTTP e validando as respostas contra um banco de
 dados de teste isolado e em memória.
 """
+import asyncio
+import contextvars
+import json
+import logging
+from datetime import date, timedelta
+
+import msgpack
 import pytest
 from httpx import AsyncClient, ASGITransport
-from sqlalchemy.ext.asyncio import AsyncSession
+from jose import jwt
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from typing import AsyncGenerator, NamedTuple
 
+import admissao
+import arquivo
+import cache
+import crud
+import database
+import escrita_em_lote
+import main
+import models
+import perfilamento
+import rebalancear
+import registos
+import schemas
+import shards
+import vencimentos
 from main import app, get_db
 from models import Base
+from tests.redis_falso import RedisFalso
 from tests.test_database import TestingSessionLocal, engine
 
 # --- Configuração Inicial dos Testes (Fixtures e Overrides) ---
@@ -217,4 +241,1380 @@ class TestTarefas:
         # Assert
         assert response_get.status_code == 404
         assert response_put.status_code == 404
-        assert response_delete.status_code == 404
\ No newline at end of file
+        assert response_delete.status_code == 404
+
+class TestFormatos:
+    """Testes para a negociação de conteúdo (MessagePack e JSON colunar)."""
+
+    @pytest.mark.asyncio
+    async def test_listar_em_msgpack(self, authenticated_client: AuthenticatedClient):
+        """Verifica se a lista é devolvida em MessagePack com os mesmos dados do JSON."""
+        # Arrange
+        ac = authenticated_client
+        await ac.client.post("/tarefas/", json={"titulo": "Binária", "data_vencimento": "2025-10-15"}, headers=ac.headers)
+        response_json = await ac.client.get("/tarefas/", headers=ac.headers)
+
+        # Act
+        response = await ac.client.get("/tarefas/", headers={**ac.headers, "Accept": "application/msgpack"})
+
+        # Assert
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/msgpack"
+        assert msgpack.unpackb(response.content) == response_json.json()
+
+    @pytest.mark.asyncio
+    async def test_listar_em_json_colunar(self, authenticated_client: AuthenticatedClient):
+        """Verifica o formato colunar: um array por campo e prioridade como inteiro."""
+        # Arrange
+        ac = authenticated_client
+        await ac.client.post("/tarefas/", json={"titulo": "A", "prioridade": "vermelha"}, headers=ac.headers)
+        await ac.client.post("/tarefas/", json={"titulo": "B"}, headers=ac.headers)
+
+        # Act
+        response = await ac.client.get(
+            "/tarefas/", headers={**ac.headers, "Accept": "application/vnd.tarefas.colunar+json"}
+        )
+        data = response.json()
+
+        # Assert
+        assert response.status_code == 200
+        assert data["titulo"] == ["A", "B"]
+        assert data["prioridade"] == [2, 0]
+        assert data["dono_id"] == [ac.user_id, ac.user_id]
+
+    @pytest.mark.asyncio
+    async def test_detalhe_respeita_accept_e_json_por_omissao(self, authenticated_client: AuthenticatedClient):
+        """Verifica o endpoint de detalhe nos dois formatos e que JSON continua a ser o padrão."""
+        # Arrange
+        ac = authenticated_client
+        tarefa_id = (await ac.client.post("/tarefas/", json={"titulo": "Detalhe"}, headers=ac.headers)).json()["id"]
+
+        # Act
+        response_json = await ac.client.get(f"/tarefas/{tarefa_id}", headers=ac.headers)
+        response_msgpack = await ac.client.get(
+            f"/tarefas/{tarefa_id}", headers={**ac.headers, "Accept": "application/msgpack;q=0.9, application/json;q=0.5"}
+        )
+
+        # Assert
+        assert response_json.headers["content-type"] == "application/json"
+        assert response_json.headers["vary"] == "Accept"
+        assert msgpack.unpackb(response_msgpack.content) == response_json.json()
+
+
+class TestEscritaEmLote:
+    """Testes para o modo de escrita em lote (group commit) na criação de tarefas."""
+
+    @pytest.fixture
+    async def escritor(self, monkeypatch):
+        """Ativa o escritor em lote, ligado ao banco de dados de teste."""
+        escritor = escrita_em_lote.EscritorEmLote(TestingSessionLocal, janela=0.05, tamanho_maximo=50)
+        await escritor.iniciar()
+        monkeypatch.setattr(escrita_em_lote, "escritor", escritor)
+        yield escritor
+        await escritor.parar()
+
+    @pytest.mark.asyncio
+    async def test_criacoes_concorrentes_partilham_um_commit(
+        self, authenticated_client: AuthenticatedClient, escritor
+    ):
+        """Verifica se pedidos concorrentes são gravados numa só transação, cada um com o seu ID."""
+        # Arrange
+        ac = authenticated_client
+        commits = []
+        contar_commit = commits.append
+        event.listen(engine.sync_engine, "commit", contar_commit)
+
+        # Act
+        try:
+            respostas = await asyncio.gather(*(
+                ac.client.post("/tarefas/", json={"titulo": f"Tarefa {i}"}, headers=ac.headers)
+                for i in range(10)
+            ))
+        finally:
+            event.remove(engine.sync_engine, "commit", contar_commit)
+        response_lista = await ac.client.get("/tarefas/", headers=ac.headers)
+
+        # Assert
+        assert all(r.status_code == 201 for r in respostas)
+        ids = {r.json()["id"]: r.json()["titulo"] for r in respostas}
+        assert len(ids) == 10
+        assert len(commits) == 1
+        assert {t["id"]: t["titulo"] for t in response_lista.json()} == ids
+
+    @pytest.mark.asyncio
+    async def test_pedido_invalido_nao_faz_falhar_o_lote(self, authenticated_client: AuthenticatedClient, escritor):
+        """Garante que, se um pedido do lote falhar, só esse pedido recebe o erro."""
+        # Arrange
+        ac = authenticated_client
+        pedidos = [(schemas.TarefaCreate(titulo=f"Tarefa {i}"), ac.user_id) for i in range(3)]
+        pedidos.insert(1, (schemas.TarefaCreate(titulo="Dono inexistente"), ac.user_id + 999))
+
+        # Act
+        resultados = await asyncio.gather(
+            *(escritor.criar_tarefa(tarefa, dono_id) for tarefa, dono_id in pedidos), return_exceptions=True
+        )
+        response_lista = await ac.client.get("/tarefas/", headers=ac.headers)
+
+        # Assert
+        assert isinstance(resultados[1], Exception)
+        assert all(isinstance(r, int) for i, r in enumerate(resultados) if i != 1)
+        assert sorted(t["titulo"] for t in response_lista.json()) == ["Tarefa 0", "Tarefa 1", "Tarefa 2"]
+
+    @pytest.mark.asyncio
+    async def test_parar_desliga_o_escritor_global(self):
+        """Verifica se, depois de parado, o escritor global deixa de ser usado pelas requisições."""
+        # Arrange
+        escritor = escrita_em_lote.EscritorEmLote(TestingSessionLocal)
+        escrita_em_lote.escritor = escritor
+        await escritor.iniciar()
+
+        # Act
+        await escritor.parar()
+
+        # Assert
+        assert escrita_em_lote.escritor is None
+
+
+class TestAdmissao:
+    """Testes para o controlo de admissão (load shedding) e o endpoint /ready."""
+
+    @pytest.mark.asyncio
+    async def test_leituras_rejeitadas_e_escritas_aceites_acima_do_limite(
+        self, authenticated_client: AuthenticatedClient, monkeypatch
+    ):
+        """Verifica se, acima do limite de leituras, só o tráfego de baixa prioridade é rejeitado."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(admissao.estado, "limite_leituras", 0)
+
+        # Act
+        response_leitura = await ac.client.get("/tarefas/", headers=ac.headers)
+        response_escrita = await ac.client.post("/tarefas/", json={"titulo": "Urgente"}, headers=ac.headers)
+        response_health = await ac.client.get("/health")
+
+        # Assert
+        assert response_leitura.status_code == 503
+        assert response_leitura.headers["retry-after"] == str(admissao.estado.retry_after)
+        assert response_escrita.status_code == 201
+        assert response_health.status_code == 200
+
+    @pytest.mark.asyncio
+    async def test_ready_reflete_espera_pelo_pool(self, client: AsyncClient, monkeypatch):
+        """Verifica se o /ready passa a 503 quando a espera pelo pool excede o limite."""
+        # Arrange
+        estado = admissao.EstadoDeCarga()
+        monkeypatch.setattr(admissao, "estado", estado)
+        response_pronto = await client.get("/ready")
+
+        # Act
+        estado.registar_espera_pool(10 * estado.limite_espera_pool)
+        response_sobrecarregado = await client.get("/ready")
+
+        # Assert
+        assert response_pronto.status_code == 200
+        assert response_pronto.json()["status"] == "ready"
+        assert response_sobrecarregado.status_code == 503
+        assert "retry-after" in response_sobrecarregado.headers
+
+
+class TestPerfilamento:
+    """Testes para o perfilamento a pedido de uma requisição."""
+
+    @pytest.mark.asyncio
+    async def test_cabecalho_assinado_gera_perfil_em_disco(
+        self, authenticated_client: AuthenticatedClient, monkeypatch, tmp_path
+    ):
+        """Verifica se um token de perfil válido produz o .prof e o resumo com a divisão do tempo."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(perfilamento, "PASTA_PERFIS", str(tmp_path))
+        await ac.client.post("/tarefas/", json={"titulo": "Lenta"}, headers=ac.headers)
+        headers = {**ac.headers, "X-Perfil": perfilamento.criar_token_de_perfil()}
+
+        # Act
+        response = await ac.client.get("/tarefas/", headers=headers)
+
+        # Assert
+        assert response.status_code == 200
+        perfil_id = response.headers["x-perfil-id"]
+        assert (tmp_path / f"{perfil_id}.prof").exists()
+        resumo = json.loads((tmp_path / f"{perfil_id}.json").read_text(encoding="utf-8"))
+        assert resumo["caminho"] == "/tarefas/"
+        assert resumo["sql_comandos"] >= 2  # utilizador + lista de tarefas
+        assert {"dependencia_usuario_ms", "serializacao_ms", "sql_ms", "total_ms"} <= resumo.keys()
+
+    @pytest.mark.asyncio
+    async def test_token_de_acesso_nao_ativa_perfil(
+        self, authenticated_client: AuthenticatedClient, monkeypatch, tmp_path
+    ):
+        """Garante que um token de utilizador comum não serve para ativar o perfilamento."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(perfilamento, "PASTA_PERFIS", str(tmp_path))
+
+        # Act
+        response = await ac.client.get("/tarefas/", headers={**ac.headers, "X-Perfil": ac.token})
+
+        # Assert
+        assert response.status_code == 200
+        assert "x-perfil-id" not in response.headers
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_medidor_ignora_sql_de_outras_requisicoes(self):
+        """Garante que o SQL de outro contexto não é contado e que um comando já em curso não causa erro."""
+        # Arrange
+        async def consultar():
+            async with TestingSessionLocal() as db:
+                await db.execute(select(func.count()).select_from(models.Tarefa))
+
+        # Act
+        with perfilamento._MedidorSQL() as sql:
+            # Simula um comando iniciado antes da instalação dos listeners.
+            sql.depois(type("Ligacao", (), {"info": {}})(), None, "SELECT 1", (), None, False)
+            await asyncio.create_task(consultar(), context=contextvars.Context())
+            comandos_de_outra_requisicao = sql.comandos
+            await consultar()
+
+        # Assert
+        assert comandos_de_outra_requisicao == 0
+        assert sql.comandos == 1
+
+    @pytest.mark.asyncio
+    async def test_medidor_descarta_inicio_de_comando_com_erro(self):
+        """Garante que um comando que falha não deixa o seu início na ligação, a emparelhar com o seguinte."""
+        # Act
+        with perfilamento._MedidorSQL() as sql:
+            async with engine.connect() as conn:
+                with pytest.raises(Exception):
+                    await conn.exec_driver_sql("SELECT * FROM tabela_inexistente")
+                await conn.exec_driver_sql("SELECT 1")
+                inicios = list(conn.sync_connection.info.get("perfil_inicio", []))
+
+        # Assert
+        assert inicios == []
+        assert sql.comandos == 1
+
+
+class TestRegistos:
+    """Testes para o registo de acesso estruturado e o registo de SQL lento."""
+
+    @pytest.mark.asyncio
+    async def test_id_da_requisicao_no_acesso_e_no_sql(
+        self, authenticated_client: AuthenticatedClient, monkeypatch, caplog
+    ):
+        """Verifica se o X-Request-ID chega ao registo de acesso e ao de SQL lento, sem os parâmetros."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(registos, "SQL_LENTO", 0)  # Todos os comandos contam como lentos
+        monkeypatch.setattr(registos, "SQL_EXPLAIN", True)
+        registos.instalar_registo_sql(engine)
+        caplog.set_level(logging.INFO, logger="tarefas")
+
+        # Act
+        try:
+            response = await ac.client.get("/tarefas/", headers={**ac.headers, "X-Request-ID": "req-123"})
+        finally:
+            registos.remover_registo_sql(engine)
+
+        # Assert
+        assert response.headers["x-request-id"] == "req-123"
+        acessos = [r for r in caplog.records if r.name == "tarefas.acesso"]
+        assert acessos[-1].dados["codigo"] == 200
+        sql = [r for r in caplog.records if r.name == "tarefas.sql"]
+        assert sql and all(r.id_requisicao == "req-123" for r in sql)
+        assert all(ac.email not in json.dumps(r.dados, default=str) for r in sql)
+        assert any(r.dados.get("plano") for r in sql)
+
+    @pytest.mark.asyncio
+    async def test_comando_com_erro_nao_desalinha_os_tempos(self):
+        """Verifica se um comando que falha não deixa o seu início na ligação."""
+        # Arrange
+        registos.instalar_registo_sql(engine)
+
+        # Act
+        try:
+            async with engine.connect() as conn:
+                with pytest.raises(Exception):
+                    await conn.exec_driver_sql("SELECT * FROM tabela_inexistente")
+                inicios = list(conn.sync_connection.info.get("registo_inicio", []))
+        finally:
+            registos.remover_registo_sql(engine)
+
+        # Assert
+        assert inicios == []
+
+    def test_formatador_json(self):
+        """Verifica se cada registo é uma linha JSON com os campos adicionais."""
+        # Arrange
+        record = logging.LogRecord("tarefas", logging.INFO, __file__, 1, "olá %s", ("mundo",), None)
+        record.dados = {"duracao_ms": 1.5}
+        record.id_requisicao = "abc"
+
+        # Act
+        linha = json.loads(registos.FormatadorJSON().format(record))
+
+        # Assert
+        assert linha["msg"] == "olá mundo"
+        assert linha["duracao_ms"] == 1.5
+        assert linha["id_requisicao"] == "abc"
+
+
+class TestCache:
+    """Testes para o cache de leitura das tarefas e a sua invalidação."""
+
+    @pytest.fixture
+    def cache_em_memoria(self, monkeypatch):
+        """Ativa um cache em memória novo para o teste."""
+        backend = cache.CacheEmMemoria(max_itens=100)
+        monkeypatch.setattr(cache, "backend", backend)
+        return backend
+
+    @pytest.fixture
+    async def redis_falso(self, monkeypatch):
+        """Arranca o servidor Redis de substituição e liga-lhe o cache."""
+        servidor = RedisFalso()
+        await servidor.iniciar()
+        backend = cache.CacheRedis(servidor.url)
+        monkeypatch.setattr(cache, "backend", backend)
+        yield servidor
+        await backend.fechar()
+        await servidor.parar()
+
+    @staticmethod
+    def _contar_sql():
+        """Devolve a lista de comandos SQL executados enquanto o listener estiver ativo."""
+        comandos = []
+
+        def registar(conn, cursor, statement, parameters, context, executemany):
+            comandos.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", registar)
+        return comandos, lambda: event.remove(engine.sync_engine, "before_cursor_execute", registar)
+
+    @pytest.mark.asyncio
+    async def test_detalhe_servido_do_cache_e_invalidado_na_escrita(
+        self, authenticated_client: AuthenticatedClient, cache_em_memoria
+    ):
+        """Verifica se a segunda leitura não consulta a tabela de tarefas e se o PUT invalida a entrada."""
+        # Arrange
+        ac = authenticated_client
+        tarefa_id = (await ac.client.post("/tarefas/", json={"titulo": "Original"}, headers=ac.headers)).json()["id"]
+        await ac.client.get(f"/tarefas/{tarefa_id}", headers=ac.headers)  # Preenche o cache
+
+        # Act
+        comandos, parar = self._contar_sql()
+        try:
+            response_cache = await ac.client.get(f"/tarefas/{tarefa_id}", headers=ac.headers)
+        finally:
+            parar()
+        await ac.client.put(f"/tarefas/{tarefa_id}", json={"titulo": "Alterada"}, headers=ac.headers)
+        response_depois = await ac.client.get(f"/tarefas/{tarefa_id}", headers=ac.headers)
+
+        # Assert
+        assert response_cache.json()["titulo"] == "Original"
+        assert not any("FROM tarefas" in c for c in comandos)
+        assert response_depois.json()["titulo"] == "Alterada"
+
+    @pytest.mark.asyncio
+    async def test_lista_invalidada_no_redis(self, authenticated_client: AuthenticatedClient, redis_falso):
+        """Verifica o backend Redis: a lista é guardada e invalidada quando o dono cria ou apaga tarefas."""
+        # Arrange
+        ac = authenticated_client
+        primeira = (await ac.client.post("/tarefas/", json={"titulo": "Um"}, headers=ac.headers)).json()
+        await ac.client.get("/tarefas/", headers=ac.headers)
+
+        # Act
+        await ac.client.post("/tarefas/", json={"titulo": "Dois"}, headers=ac.headers)
+        response_apos_criar = await ac.client.get("/tarefas/", headers=ac.headers)
+        await ac.client.delete(f"/tarefas/{primeira['id']}", headers=ac.headers)
+        response_apos_apagar = await ac.client.get("/tarefas/", headers=ac.headers)
+
+        # Assert
+        assert [t["titulo"] for t in response_apos_criar.json()] == ["Um", "Dois"]
+        assert [t["titulo"] for t in response_apos_apagar.json()] == ["Dois"]
+        assert {"GET", "SET", "INCR"} <= set(redis_falso.comandos)
+
+    @pytest.mark.asyncio
+    async def test_redis_lento_nao_troca_respostas(self, redis_falso):
+        """Verifica se, após um comando interrompido, o seguinte não lê a resposta que ficou por ler."""
+        # Arrange
+        await cache.backend.definir("a", "valor de a", ttl=60)
+        await cache.backend.definir("b", "valor de b", ttl=60)
+        cache.backend.tempo_limite = 0.05
+        redis_falso.atraso = 0.2
+
+        # Act
+        with pytest.raises(asyncio.TimeoutError):
+            await cache.backend.obter("a")
+        redis_falso.atraso = 0
+        valor_b = await cache.backend.obter("b")
+
+        # Assert
+        assert valor_b == "valor de b"
+
+    @pytest.mark.asyncio
+    async def test_rediss_usa_tls(self, redis_falso):
+        """Verifica se um URL "rediss://" liga por TLS e nunca envia a senha em texto simples."""
+        # Arrange
+        backend = cache.CacheRedis(redis_falso.url.replace("redis://", "rediss://:segredo@"), tempo_limite=0.5)
+
+        # Act
+        with pytest.raises(Exception):
+            await backend.obter("a")  # O servidor de substituição não fala TLS
+        await backend.fechar()
+
+        # Assert
+        assert backend.ssl is not None
+        assert "AUTH" not in redis_falso.comandos
+
+    @pytest.mark.asyncio
+    async def test_carregamento_antigo_nao_sobrevive_a_escrita(self, cache_em_memoria):
+        """Verifica se uma leitura feita antes de uma escrita não fica em cache depois dela."""
+        # Arrange
+        chave = await cache.chave_tarefa(1)
+
+        async def carregar_durante_escrita():
+            await cache.invalidar(7, 1)  # A escrita termina enquanto a leitura antiga está em curso
+            return {"titulo": "Antigo"}
+
+        # Act
+        await cache.obter_ou_carregar(chave, carregar_durante_escrita)
+
+        # Assert
+        assert await cache_em_memoria.obter(await cache.chave_tarefa(1)) is None
+
+    @pytest.mark.asyncio
+    async def test_escrita_so_invalida_a_propria_tarefa(
+        self, authenticated_client: AuthenticatedClient, cache_em_memoria, monkeypatch
+    ):
+        """Verifica se alterar uma tarefa mantém em cache o detalhe das outras do mesmo dono, e se as versões expiram."""
+        # Arrange
+        ac = authenticated_client
+        alterada = (await ac.client.post("/tarefas/", json={"titulo": "Alterada"}, headers=ac.headers)).json()["id"]
+        outra = (await ac.client.post("/tarefas/", json={"titulo": "Outra"}, headers=ac.headers)).json()["id"]
+        await ac.client.get(f"/tarefas/{outra}", headers=ac.headers)  # Fica em cache
+
+        # Act
+        await ac.client.put(f"/tarefas/{alterada}", json={"titulo": "Nova"}, headers=ac.headers)
+        comandos, parar = self._contar_sql()
+        try:
+            response_outra = await ac.client.get(f"/tarefas/{outra}", headers=ac.headers)
+        finally:
+            parar()
+        monkeypatch.setattr(cache, "TTL", -1)  # As versões seguintes nascem já expiradas
+        await cache.invalidar(ac.user_id, alterada)
+        await cache.invalidar(ac.user_id, outra)  # Descarta a versão expirada da `alterada`
+
+        # Assert
+        assert response_outra.json()["titulo"] == "Outra"
+        assert not any("FROM tarefas" in c for c in comandos)
+        assert list(cache_em_memoria._contadores_com_prazo) == [cache._chave_versao(outra)]
+
+    @pytest.mark.asyncio
+    async def test_misses_simultaneos_fazem_uma_so_consulta(self, cache_em_memoria):
+        """Verifica o single-flight: pedidos simultâneos para a mesma chave partilham o carregamento."""
+        # Arrange
+        chamadas = []
+
+        async def carregar():
+            chamadas.append(1)
+            await asyncio.sleep(0.01)
+            return {"id": 1}
+
+        # Act
+        resultados = await asyncio.gather(*(cache.obter_ou_carregar("chave", carregar) for _ in range(5)))
+
+        # Assert
+        assert resultados == [{"id": 1}] * 5
+        assert len(chamadas) == 1
+
+    @pytest.mark.asyncio
+    async def test_lru_respeita_tamanho_e_ttl(self):
+        """Verifica a expulsão do item menos usado e a expiração por TTL."""
+        # Arrange
+        lru = cache.CacheEmMemoria(max_itens=2)
+        await lru.definir("a", "1", ttl=60)
+        await lru.definir("b", "2", ttl=60)
+        await lru.obter("a")  # "b" passa a ser o menos usado recentemente
+
+        # Act
+        await lru.definir("c", "3", ttl=60)
+        a, b = await lru.obter("a"), await lru.obter("b")
+        await lru.definir("expira", "4", ttl=-1)
+
+        # Assert
+        assert a == "1"
+        assert b is None
+        assert await lru.obter("expira") is None
+
+
+class TestRemocaoDeConta:
+    """Testes para a remoção de contas de utilizador e das suas tarefas."""
+
+    @staticmethod
+    async def _contar(tabela) -> int:
+        async with TestingSessionLocal() as db:
+            return (await db.execute(select(func.count()).select_from(tabela))).scalar_one()
+
+    @pytest.mark.asyncio
+    async def test_remocao_imediata_sem_carregar_tarefas(self, authenticated_client: AuthenticatedClient):
+        """Verifica se a conta e as tarefas são apagadas sem SELECT das tarefas e se o token deixa de valer."""
+        # Arrange
+        ac = authenticated_client
+        for i in range(3):
+            await ac.client.post("/tarefas/", json={"titulo": f"Tarefa {i}"}, headers=ac.headers)
+        comandos = []
+
+        def registar(conn, cursor, statement, parameters, context, executemany):
+            comandos.append(statement)
+
+        # Act
+        event.listen(engine.sync_engine, "before_cursor_execute", registar)
+        try:
+            response = await ac.client.delete("/usuarios/me", headers=ac.headers)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", registar)
+        response_token_antigo = await ac.client.get("/tarefas/", headers=ac.headers)
+
+        # Assert
+        assert response.status_code == 204
+        assert not any("tarefas.titulo" in c for c in comandos)
+        assert await self._contar(models.Tarefa) == 0
+        assert await self._contar(models.Usuario) == 0
+        assert response_token_antigo.status_code == 401
+
+    @pytest.mark.asyncio
+    async def test_token_antigo_nao_acede_a_conta_registada_de_novo(self, authenticated_client: AuthenticatedClient):
+        """Garante que, se o email for registado de novo, o token da conta apagada não lhe dá acesso."""
+        # Arrange
+        ac = authenticated_client
+        await ac.client.delete("/usuarios/me", headers=ac.headers)
+
+        # Act
+        await ac.client.post("/usuarios/", json={"email": ac.email, "senha": "outra_senha_123"})
+        response = await ac.client.get("/tarefas/", headers=ac.headers)
+
+        # Assert
+        assert response.status_code == 401
+
+    @pytest.mark.asyncio
+    async def test_conta_grande_apagada_em_lotes(self, authenticated_client: AuthenticatedClient, monkeypatch):
+        """Verifica se contas acima do limiar são desativadas de imediato e purgadas em segundo plano."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(main, "REMOCAO_LIMIAR_SINCRONO", 2)
+        monkeypatch.setattr(crud, "REMOCAO_TAMANHO_LOTE", 2)
+        monkeypatch.setattr(main, "SessionLocal", TestingSessionLocal)
+        for i in range(5):
+            await ac.client.post("/tarefas/", json={"titulo": f"Tarefa {i}"}, headers=ac.headers)
+
+        # Act
+        response = await ac.client.delete("/usuarios/me", headers=ac.headers)
+        response_token = await ac.client.get("/tarefas/", headers=ac.headers)
+        response_novo_registo = await ac.client.post("/usuarios/", json={"email": ac.email, "senha": "senha_nova_123"})
+
+        # Assert
+        assert response.status_code == 202
+        assert response_token.status_code == 401
+        assert response_novo_registo.status_code == 201
+        assert await self._contar(models.Tarefa) == 0
+        assert await self._contar(models.Usuario) == 1  # Apenas o novo registo
+
+    @pytest.mark.asyncio
+    async def test_migracao_da_cascata_em_banco_de_dados_antigo(self, tmp_path):
+        """Verifica se o arranque migra as tabelas antigas (sem cascata nem AUTOINCREMENT) sem perder linhas."""
+        # Arrange: o esquema original, anterior ao 'ON DELETE CASCADE'
+        engine_antigo = database.criar_engine(f"sqlite+aiosqlite:///{tmp_path / 'antigo.db'}")
+        async with engine_antigo.begin() as conn:
+            await conn.exec_driver_sql(
+                "CREATE TABLE usuarios (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL, senha_hash VARCHAR NOT NULL)"
+            )
+            await conn.exec_driver_sql(
+                "CREATE TABLE tarefas (id INTEGER PRIMARY KEY, titulo VARCHAR NOT NULL, descricao VARCHAR, "
+                "concluida BOOLEAN NOT NULL, data_vencimento DATE, prioridade VARCHAR NOT NULL, "
+                "dono_id INTEGER NOT NULL REFERENCES usuarios (id))"
+            )
+            await conn.exec_driver_sql("INSERT INTO usuarios VALUES (1, 'antigo@teste.com', 'x')")
+            await conn.exec_driver_sql("INSERT INTO tarefas VALUES (7, 'Relatório', NULL, 1, NULL, 'verde', 1)")
+
+        # Act
+        try:
+            await database.create_tables(engine_antigo)
+            await database.create_tables(engine_antigo)  # Idempotente
+            fabrica = async_sessionmaker(bind=engine_antigo, expire_on_commit=False)
+            async with fabrica() as db:
+                tarefa = await db.get(models.Tarefa, 7)
+                encontradas = await crud.buscar_tarefas(db, 1, "relatorio")
+                await crud.delete_usuario(db, await db.get(models.Usuario, 1))
+                restantes = (await db.execute(select(func.count()).select_from(models.Tarefa))).scalar_one()
+        finally:
+            await engine_antigo.dispose()
+
+        # Assert
+        assert tarefa.titulo == "Relatório" and tarefa.concluida_em is not None
+        assert [t.id for t in encontradas] == [7]
+        assert restantes == 0
+
+
+class TestBusca:
+    """Testes para a pesquisa de texto nas tarefas (FTS5 no SQLite)."""
+
+    @pytest.mark.asyncio
+    async def test_busca_por_prefixo_com_ranking_e_isolamento(self, authenticated_client: AuthenticatedClient):
+        """Verifica a correspondência por prefixo, a ordenação por relevância e o isolamento entre utilizadores."""
+        # Arrange
+        ac = authenticated_client
+        await ac.client.post("/tarefas/", json={"titulo": "Comprar pão", "descricao": "Para o relatório"}, headers=ac.headers)
+        await ac.client.post("/tarefas/", json={"titulo": "Relatório trimestral"}, headers=ac.headers)
+        await ac.client.post("/tarefas/", json={"titulo": "Ginásio"}, headers=ac.headers)
+        await ac.client.post("/usuarios/", json={"email": "outro@exemplo.com", "senha": "senha_outro_1"})
+        login = await ac.client.post("/login", data={"username": "outro@exemplo.com", "password": "senha_outro_1"})
+        headers_outro = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        await ac.client.post("/tarefas/", json={"titulo": "Relatório do outro"}, headers=headers_outro)
+
+        # Act
+        response = await ac.client.get("/tarefas/busca", params={"q": "relat"}, headers=ac.headers)
+        response_sem_acento = await ac.client.get("/tarefas/busca", params={"q": "relatorio trimes"}, headers=ac.headers)
+
+        # Assert
+        assert response.status_code == 200
+        assert [t["titulo"] for t in response.json()] == ["Relatório trimestral", "Comprar pão"]
+        assert [t["titulo"] for t in response_sem_acento.json()] == ["Relatório trimestral"]
+
+    @pytest.mark.asyncio
+    async def test_indice_sincronizado_nas_escritas_e_paginacao(self, authenticated_client: AuthenticatedClient):
+        """Verifica se atualizações e remoções se refletem na pesquisa e se a paginação funciona."""
+        # Arrange
+        ac = authenticated_client
+        ids = [
+            (await ac.client.post("/tarefas/", json={"titulo": f"Reunião {i}"}, headers=ac.headers)).json()["id"]
+            for i in range(4)
+        ]
+
+        # Act
+        await ac.client.put(f"/tarefas/{ids[0]}", json={"titulo": "Almoço"}, headers=ac.headers)
+        await ac.client.delete(f"/tarefas/{ids[1]}", headers=ac.headers)
+        response_reuniao = await ac.client.get("/tarefas/busca", params={"q": "reuni"}, headers=ac.headers)
+        response_almoco = await ac.client.get("/tarefas/busca", params={"q": "almoço"}, headers=ac.headers)
+        response_pagina = await ac.client.get(
+            "/tarefas/busca", params={"q": "reuni", "skip": 1, "limit": 1}, headers=ac.headers
+        )
+        response_pontuacao = await ac.client.get("/tarefas/busca", params={"q": '"*'}, headers=ac.headers)
+
+        # Assert
+        assert [t["id"] for t in response_reuniao.json()] == [ids[2], ids[3]]
+        assert [t["id"] for t in response_almoco.json()] == [ids[0]]
+        assert [t["id"] for t in response_pagina.json()] == [ids[3]]
+        assert response_pontuacao.json() == []
+
+
+class TestResumo:
+    """Testes para o resumo agregado das tarefas (GET /tarefas/resumo)."""
+
+    @staticmethod
+    async def _criar_tarefas_variadas(ac: AuthenticatedClient):
+        tarefas = [
+            {"titulo": "Atrasada", "prioridade": "vermelha", "data_vencimento": "2000-01-01"},
+            {"titulo": "Concluída", "prioridade": "amarela", "concluida": True, "data_vencimento": "2000-01-01"},
+            {"titulo": "Futura", "prioridade": "verde", "data_vencimento": "2999-12-31"},
+            {"titulo": "Sem data"},
+        ]
+        return [(await ac.client.post("/tarefas/", json=t, headers=ac.headers)).json() for t in tarefas]
+
+    @pytest.mark.asyncio
+    async def test_resumo_numa_unica_consulta(self, authenticated_client: AuthenticatedClient):
+        """Verifica os totais por estado, prioridade e atraso, calculados num só GROUP BY."""
+        # Arrange
+        ac = authenticated_client
+        await self._criar_tarefas_variadas(ac)
+        await ac.client.post("/usuarios/", json={"email": "outro@exemplo.com", "senha": "senha_outro_1"})
+        login = await ac.client.post("/login", data={"username": "outro@exemplo.com", "password": "senha_outro_1"})
+        headers_outro = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        await ac.client.post("/tarefas/", json={"titulo": "Do outro", "data_vencimento": "2000-01-01"}, headers=headers_outro)
+        comandos = []
+
+        def registar(conn, cursor, statement, parameters, context, executemany):
+            comandos.append(statement)
+
+        # Act
+        event.listen(engine.sync_engine, "before_cursor_execute", registar)
+        try:
+            response = await ac.client.get("/tarefas/resumo", headers=ac.headers)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", registar)
+
+        # Assert
+        assert response.status_code == 200
+        assert response.json() == {
+            "total": 4,
+            "pendentes": 3,
+            "concluidas": 1,
+            "atrasadas": 1,
+            "por_prioridade": {
+                "vermelha": {"pendentes": 1, "concluidas": 0},
+                "amarela": {"pendentes": 0, "concluidas": 1},
+                "verde": {"pendentes": 2, "concluidas": 0},
+            },
+        }
+        assert len([c for c in comandos if "FROM tarefas" in c]) == 1
+
+    @pytest.mark.asyncio
+    async def test_consulta_usa_indice_de_cobertura(self):
+        """Garante que o SQLite responde ao resumo apenas a partir do índice `ix_tarefas_resumo`."""
+        # Arrange
+        comandos = []
+
+        def registar(conn, cursor, statement, parameters, context, executemany):
+            comandos.append((statement, parameters))
+
+        # Act
+        event.listen(engine.sync_engine, "before_cursor_execute", registar)
+        try:
+            async with TestingSessionLocal() as db:
+                await crud.get_resumo_tarefas(db, dono_id=1)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", registar)
+        statement, parameters = comandos[0]
+        async with engine.connect() as conn:
+            plano = (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)).all()
+
+        # Assert
+        assert any("COVERING INDEX ix_tarefas_resumo" in linha[-1] for linha in plano)
+
+    @pytest.mark.asyncio
+    async def test_contadores_acompanham_todas_as_escritas(
+        self, authenticated_client: AuthenticatedClient, monkeypatch
+    ):
+        """Verifica se os contadores coincidem com o GROUP BY após criações, lotes, atualizações e remoções."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(crud, "CONTADORES_ATIVOS", True)
+        criadas = await self._criar_tarefas_variadas(ac)
+        async with TestingSessionLocal() as db:
+            await crud.create_tarefas_em_lote(db, [
+                (schemas.TarefaCreate(titulo=f"Lote {i}", prioridade="vermelha"), ac.user_id) for i in range(3)
+            ])
+
+        # Act
+        await ac.client.put(
+            f"/tarefas/{criadas[0]['id']}", json={"titulo": "Feita", "prioridade": "amarela", "concluida": True},
+            headers=ac.headers,
+        )
+        await ac.client.put(f"/tarefas/{criadas[2]['id']}", json={"titulo": "Só o título"}, headers=ac.headers)
+        await ac.client.delete(f"/tarefas/{criadas[3]['id']}", headers=ac.headers)
+        response_contadores = await ac.client.get("/tarefas/resumo", headers=ac.headers)
+        consulta_contagens = select(
+            models.ContagemTarefas.dono_id, models.ContagemTarefas.concluida,
+            models.ContagemTarefas.prioridade, models.ContagemTarefas.total,
+        )
+        async with TestingSessionLocal() as db:
+            linhas_mantidas = set((await db.execute(consulta_contagens)).all())
+            await crud.reconstruir_contagens(db)
+            linhas_reconstruidas = set((await db.execute(consulta_contagens)).all())
+        monkeypatch.setattr(crud, "CONTADORES_ATIVOS", False)
+        response_group_by = await ac.client.get("/tarefas/resumo", headers=ac.headers)
+
+        # Assert
+        assert response_contadores.json() == response_group_by.json()
+        assert response_contadores.json()["total"] == 6
+        assert response_contadores.json()["por_prioridade"]["vermelha"] == {"pendentes": 3, "concluidas": 0}
+        assert {linha for linha in linhas_mantidas if linha[3]} == linhas_reconstruidas
+
+    @pytest.mark.asyncio
+    async def test_contadores_com_objetos_desatualizados(
+        self, authenticated_client: AuthenticatedClient, monkeypatch
+    ):
+        """Verifica se duas atualizações e duas remoções da mesma tarefa, a partir de leituras antigas, não desviam os contadores."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(crud, "CONTADORES_ATIVOS", True)
+        tarefa_id = (await ac.client.post("/tarefas/", json={"titulo": "Partilhada"}, headers=ac.headers)).json()["id"]
+        consulta_contagens = select(
+            models.ContagemTarefas.concluida, models.ContagemTarefas.prioridade, models.ContagemTarefas.total,
+        ).filter(models.ContagemTarefas.total != 0)
+
+        # Act
+        async with TestingSessionLocal() as db_a, TestingSessionLocal() as db_b:
+            tarefa_a = await crud.get_tarefa(db_a, tarefa_id)
+            tarefa_b = await crud.get_tarefa(db_b, tarefa_id)
+            await crud.update_tarefa(
+                db_a, tarefa_a, schemas.TarefaCreate(titulo="A", prioridade="vermelha", concluida=True)
+            )
+            await crud.update_tarefa(db_b, tarefa_b, schemas.TarefaCreate(titulo="B", prioridade="amarela"))
+            async with TestingSessionLocal() as db:
+                apos_atualizar = set((await db.execute(consulta_contagens)).all())
+                linha = (await db.execute(
+                    select(models.Tarefa.concluida, models.Tarefa.prioridade).filter(models.Tarefa.id == tarefa_id)
+                )).one()
+            await crud.delete_tarefa(db_a, tarefa_a)
+            await crud.delete_tarefa(db_b, tarefa_b)
+        async with TestingSessionLocal() as db:
+            apos_apagar = set((await db.execute(consulta_contagens)).all())
+
+        # Assert
+        assert apos_atualizar == {(linha.concluida, linha.prioridade, 1)}
+        assert apos_apagar == set()
+
+
+class TestArquivo:
+    """Testes para o arquivamento das tarefas concluídas e o seu restauro."""
+
+    @staticmethod
+    async def _envelhecer(*tarefa_ids: int, dias: int = 60):
+        """Recua a data de conclusão das tarefas indicadas."""
+        async with TestingSessionLocal() as db:
+            await db.execute(
+                update(models.Tarefa).where(models.Tarefa.id.in_(tarefa_ids))
+                .values(concluida_em=crud.agora_utc() - timedelta(days=dias))
+            )
+            await db.commit()
+
+    @pytest.mark.asyncio
+    async def test_arquivador_move_concluidas_antigas_em_lotes(
+        self, authenticated_client: AuthenticatedClient, monkeypatch
+    ):
+        """Verifica se só as concluídas antigas saem das leituras do conjunto ativo, em lotes, com cache e contadores."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(cache, "backend", cache.CacheEmMemoria(max_itens=100))
+        monkeypatch.setattr(crud, "CONTADORES_ATIVOS", True)
+        antigas = [
+            (await ac.client.post("/tarefas/", json={"titulo": f"Relatório {i}", "concluida": True}, headers=ac.headers)).json()["id"]
+            for i in range(3)
+        ]
+        recente = (await ac.client.post("/tarefas/", json={"titulo": "Relatório novo", "concluida": True}, headers=ac.headers)).json()["id"]
+        pendente = (await ac.client.post("/tarefas/", json={"titulo": "Relatório pendente"}, headers=ac.headers)).json()["id"]
+        await self._envelhecer(*antigas)
+        await ac.client.get(f"/tarefas/{antigas[0]}", headers=ac.headers)  # Fica em cache
+        arquivador = arquivo.Arquivador(TestingSessionLocal, idade=timedelta(days=30), tamanho_lote=2)
+        commits = []
+        contar_commit = commits.append
+
+        # Act
+        event.listen(engine.sync_engine, "commit", contar_commit)
+        try:
+            total = await arquivador.arquivar()
+        finally:
+            event.remove(engine.sync_engine, "commit", contar_commit)
+        response_lista = await ac.client.get("/tarefas/", headers=ac.headers)
+        response_arquivo = await ac.client.get("/tarefas/arquivo", headers=ac.headers)
+        response_item = await ac.client.get(f"/tarefas/{antigas[0]}", headers=ac.headers)
+        response_busca = await ac.client.get("/tarefas/busca", params={"q": "relat"}, headers=ac.headers)
+        response_resumo = await ac.client.get("/tarefas/resumo", headers=ac.headers)
+
+        # Assert
+        assert total == 3
+        assert len(commits) == 2
+        assert [t["id"] for t in response_lista.json()] == [recente, pendente]
+        assert [t["id"] for t in response_arquivo.json()] == antigas
+        assert all(t["concluida"] and t["arquivada_em"] for t in response_arquivo.json())
+        assert response_item.status_code == 404
+        assert {t["id"] for t in response_busca.json()} == {recente, pendente}
+        assert response_resumo.json()["total"] == 2
+        assert response_resumo.json()["concluidas"] == 1
+
+    @pytest.mark.asyncio
+    async def test_tarefa_reaberta_durante_o_lote_fica_ativa(
+        self, authenticated_client: AuthenticatedClient, monkeypatch
+    ):
+        """Verifica se uma tarefa reaberta entre a escolha do lote e a cópia não é arquivada nem descontada."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(crud, "CONTADORES_ATIVOS", True)
+        ids = [
+            (await ac.client.post("/tarefas/", json={"titulo": f"Tarefa {i}", "concluida": True}, headers=ac.headers)).json()["id"]
+            for i in range(2)
+        ]
+        await self._envelhecer(*ids)
+
+        def reabrir(conn, cursor, statement, parameters, context, executemany):
+            # Logo a seguir ao SELECT do lote (no SQLite, sem bloqueio das linhas).
+            if statement.lstrip().startswith("SELECT") and "ORDER BY tarefas.concluida_em" in statement:
+                cursor_extra = conn.connection.cursor()
+                cursor_extra.execute("UPDATE tarefas SET concluida = 0, concluida_em = NULL WHERE id = ?", (ids[0],))
+                cursor_extra.close()
+
+        # Act
+        event.listen(engine.sync_engine, "after_cursor_execute", reabrir)
+        try:
+            async with TestingSessionLocal() as db:
+                movidas = await crud.arquivar_tarefas_concluidas(db, crud.agora_utc() - timedelta(days=30))
+        finally:
+            event.remove(engine.sync_engine, "after_cursor_execute", reabrir)
+        response_lista = await ac.client.get("/tarefas/", headers=ac.headers)
+        response_arquivo = await ac.client.get("/tarefas/arquivo", headers=ac.headers)
+        response_resumo = await ac.client.get("/tarefas/resumo", headers=ac.headers)
+
+        # Assert
+        assert movidas == 1
+        assert [t["id"] for t in response_lista.json()] == [ids[0]]
+        assert [t["id"] for t in response_arquivo.json()] == [ids[1]]
+        assert response_resumo.json()["total"] == 1
+
+    @pytest.mark.asyncio
+    async def test_ids_reutilizados_no_sqlite_antigo_nao_colidem_no_arquivo(self, tmp_path):
+        """Verifica se a migração separa os IDs reutilizados (tabela sem AUTOINCREMENT) dos já arquivados."""
+        # Arrange: tarefa 5 arquivada, e o ID 5 reutilizado por uma tarefa nova, também concluída
+        engine_antigo = database.criar_engine(f"sqlite+aiosqlite:///{tmp_path / 'antigo.db'}")
+        async with engine_antigo.begin() as conn:
+            await conn.exec_driver_sql(
+                "CREATE TABLE usuarios (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL, senha_hash VARCHAR NOT NULL)"
+            )
+            await conn.exec_driver_sql(
+                "CREATE TABLE tarefas (id INTEGER PRIMARY KEY, titulo VARCHAR NOT NULL, descricao VARCHAR, "
+                "concluida BOOLEAN NOT NULL, data_vencimento DATE, prioridade VARCHAR NOT NULL, "
+                "concluida_em TIMESTAMP, dono_id INTEGER NOT NULL REFERENCES usuarios (id))"
+            )
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.exec_driver_sql("INSERT INTO usuarios VALUES (1, 'antigo@teste.com', 'x')")
+            await conn.exec_driver_sql(
+                "INSERT INTO tarefas VALUES (5, 'Nova', NULL, 1, NULL, 'verde', '2000-01-01 00:00:00', 1)"
+            )
+            await conn.exec_driver_sql(
+                "INSERT INTO tarefas_arquivo (id, titulo, concluida, prioridade, arquivada_em, dono_id) "
+                "VALUES (5, 'Antiga', 1, 'verde', '2000-01-01 00:00:00', 1)"
+            )
+
+        # Act
+        try:
+            await database.create_tables(engine_antigo)
+            fabrica = async_sessionmaker(bind=engine_antigo, expire_on_commit=False)
+            async with fabrica() as db:
+                movidas = await crud.arquivar_tarefas_concluidas(db, crud.agora_utc())
+                arquivadas = (await db.execute(
+                    select(models.TarefaArquivada.id, models.TarefaArquivada.titulo).order_by(models.TarefaArquivada.id)
+                )).all()
+                nova = await crud.create_tarefa_para_usuario(db, schemas.TarefaCreate(titulo="Depois"), 1)
+        finally:
+            await engine_antigo.dispose()
+
+        # Assert
+        assert movidas == 1
+        assert [tuple(linha) for linha in arquivadas] == [(5, "Nova"), (10, "Antiga")]
+        assert nova.id > 10
+
+    @pytest.mark.asyncio
+    async def test_restaurar_tarefa_arquivada(self, authenticated_client: AuthenticatedClient):
+        """Verifica se o restauro mantém o ID, só é permitido ao dono e não é desfeito pelo arquivador."""
+        # Arrange
+        ac = authenticated_client
+        tarefa = (await ac.client.post("/tarefas/", json={"titulo": "Antiga", "concluida": True}, headers=ac.headers)).json()
+        await self._envelhecer(tarefa["id"])
+        arquivador = arquivo.Arquivador(TestingSessionLocal, idade=timedelta(days=30))
+        await arquivador.arquivar()
+        await ac.client.post("/usuarios/", json={"email": "outro@exemplo.com", "senha": "senha_outro_1"})
+        login = await ac.client.post("/login", data={"username": "outro@exemplo.com", "password": "senha_outro_1"})
+        headers_outro = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        # Act
+        response_outro = await ac.client.post(f"/tarefas/arquivo/{tarefa['id']}/restaurar", headers=headers_outro)
+        response = await ac.client.post(f"/tarefas/arquivo/{tarefa['id']}/restaurar", headers=ac.headers)
+        response_repetido = await ac.client.post(f"/tarefas/arquivo/{tarefa['id']}/restaurar", headers=ac.headers)
+        arquivadas_de_novo = await arquivador.arquivar()
+        response_item = await ac.client.get(f"/tarefas/{tarefa['id']}", headers=ac.headers)
+
+        # Assert
+        assert response_outro.status_code == 403
+        assert response.status_code == 200
+        assert response.json() == tarefa
+        assert response_repetido.status_code == 404
+        assert arquivadas_de_novo == 0
+        assert response_item.json() == tarefa
+
+    @pytest.mark.asyncio
+    async def test_restauro_com_id_ocupado_recebe_id_novo(self, authenticated_client: AuthenticatedClient):
+        """Garante que o restauro não falha se o ID original já estiver ocupado (bancos de dados antigos)."""
+        # Arrange
+        ac = authenticated_client
+        tarefa = (await ac.client.post("/tarefas/", json={"titulo": "Antiga", "concluida": True}, headers=ac.headers)).json()
+        await self._envelhecer(tarefa["id"])
+        await arquivo.Arquivador(TestingSessionLocal, idade=timedelta(days=30)).arquivar()
+        async with TestingSessionLocal() as db:
+            db.add(models.Tarefa(id=tarefa["id"], titulo="Ocupa o ID", dono_id=ac.user_id))
+            await db.commit()
+
+        # Act
+        response = await ac.client.post(f"/tarefas/arquivo/{tarefa['id']}/restaurar", headers=ac.headers)
+
+        # Assert
+        assert response.status_code == 200
+        assert response.json()["id"] != tarefa["id"]
+        assert response.json()["titulo"] == "Antiga"
+
+
+class TestSharding:
+    """Testes para o modo de vários bancos de dados (sharding), com um ficheiro SQLite por shard."""
+
+    @pytest.fixture
+    async def mapa(self, tmp_path, monkeypatch):
+        """Ativa três shards em ficheiros SQLite temporários, com a dependência `get_db` real."""
+        mapa = shards.Shards([f"sqlite+aiosqlite:///{tmp_path / f'shard{i}.db'}" for i in range(3)])
+        for engine_do_shard in mapa.engines:
+            await database.create_tables(engine_do_shard)
+        monkeypatch.setattr(shards, "mapa", mapa)
+        monkeypatch.delitem(app.dependency_overrides, get_db)
+        yield mapa
+        await mapa.fechar()
+
+    @staticmethod
+    def _emails_em_shards_diferentes(mapa, quantidade: int = 2) -> list[str]:
+        por_shard = {}
+        for i in range(100):
+            por_shard.setdefault(mapa.indice_por_hash(f"utilizador{i}@exemplo.com"), f"utilizador{i}@exemplo.com")
+        return list(por_shard.values())[:quantidade]
+
+    @staticmethod
+    async def _registar_e_entrar(client: AsyncClient, email: str) -> dict:
+        await client.post("/usuarios/", json={"email": email, "senha": "senha_segura_123"})
+        login = await client.post("/login", data={"username": email, "password": "senha_segura_123"})
+        return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    @staticmethod
+    async def _contar(fabrica, modelo) -> int:
+        async with fabrica() as db:
+            return (await db.execute(select(func.count()).select_from(modelo))).scalar_one()
+
+    @pytest.mark.asyncio
+    async def test_utilizadores_isolados_no_shard_do_email(self, client: AsyncClient, mapa, monkeypatch):
+        """Verifica o encaminhamento pelo email e pelo token, e que IDs iguais em shards diferentes não se misturam no cache."""
+        # Arrange
+        monkeypatch.setattr(cache, "backend", cache.CacheEmMemoria(max_itens=100))
+        email_a, email_b = self._emails_em_shards_diferentes(mapa)
+        shard_a, shard_b = mapa.indice_por_hash(email_a), mapa.indice_por_hash(email_b)
+        headers_a = await self._registar_e_entrar(client, email_a)
+        headers_b = await self._registar_e_entrar(client, email_b)
+
+        # Act
+        tarefa_a = (await client.post("/tarefas/", json={"titulo": "Tarefa A"}, headers=headers_a)).json()
+        tarefa_b = (await client.post("/tarefas/", json={"titulo": "Tarefa B"}, headers=headers_b)).json()
+        response_a = await client.get(f"/tarefas/{tarefa_a['id']}", headers=headers_a)
+        response_b = await client.get(f"/tarefas/{tarefa_b['id']}", headers=headers_b)
+        response_b_em_cache = await client.get(f"/tarefas/{tarefa_b['id']}", headers=headers_b)
+        claims_a = jwt.get_unverified_claims(headers_a["Authorization"].split()[1])
+
+        # Assert
+        assert (tarefa_a["id"], tarefa_a["dono_id"]) == (tarefa_b["id"], tarefa_b["dono_id"]) == (1, 1)
+        assert response_a.json()["titulo"] == "Tarefa A"
+        assert response_b.json()["titulo"] == response_b_em_cache.json()["titulo"] == "Tarefa B"
+        assert claims_a["shd"] == shard_a
+        assert await self._contar(mapa.fabricas[shard_a], models.Tarefa) == 1
+        assert await self._contar(mapa.fabricas[shard_b], models.Tarefa) == 1
+        assert await self._contar(mapa.fabricas[3 - shard_a - shard_b], models.Usuario) == 0
+
+    @pytest.mark.asyncio
+    async def test_escrita_em_lote_separa_os_shards(self, client: AsyncClient, mapa, monkeypatch):
+        """Garante que um lote com utilizadores de shards diferentes grava cada tarefa no shard do seu dono."""
+        # Arrange
+        email_a, email_b = self._emails_em_shards_diferentes(mapa)
+        headers_a = await self._registar_e_entrar(client, email_a)
+        headers_b = await self._registar_e_entrar(client, email_b)
+        escritor = escrita_em_lote.EscritorEmLote(TestingSessionLocal, janela=0.05)
+        await escritor.iniciar()
+        monkeypatch.setattr(escrita_em_lote, "escritor", escritor)
+
+        # Act
+        try:
+            await asyncio.gather(*(
+                client.post("/tarefas/", json={"titulo": f"Tarefa {i}"}, headers=headers)
+                for i, headers in enumerate([headers_a, headers_b] * 3)
+            ))
+        finally:
+            await escritor.parar()
+        response_a = await client.get("/tarefas/", headers=headers_a)
+
+        # Assert
+        assert sorted(t["titulo"] for t in response_a.json()) == ["Tarefa 0", "Tarefa 2", "Tarefa 4"]
+        assert await self._contar(mapa.fabricas[mapa.indice_por_hash(email_b)], models.Tarefa) == 3
+
+    @pytest.mark.asyncio
+    async def test_rebalancear_move_utilizador_com_tarefas(self, client: AsyncClient, mapa):
+        """Verifica se a ferramenta move a conta e as tarefas (ativas e arquivadas) e atualiza o diretório."""
+        # Arrange
+        email = self._emails_em_shards_diferentes(mapa, 1)[0]
+        origem = mapa.indice_por_hash(email)
+        destino = (origem + 1) % len(mapa)
+        headers = await self._registar_e_entrar(client, email)
+        for titulo, concluida, etiquetas in [
+            ("Ativa 1", False, ["casa"]), ("Ativa 2", False, []), ("Arquivada", True, ["casa", "papelada"]),
+        ]:
+            await client.post(
+                "/tarefas/", json={"titulo": titulo, "concluida": concluida, "etiquetas": etiquetas}, headers=headers
+            )
+        async with mapa.fabricas[origem]() as db:
+            await crud.arquivar_tarefas_concluidas(db, crud.agora_utc() + timedelta(days=1))
+
+        # Act
+        novo_id = await rebalancear.mover_usuario(email, destino, tamanho_lote=1)
+        response_token_antigo = await client.get("/tarefas/", headers=headers)
+        headers_novos = await self._registar_e_entrar(client, email)  # O registo falha: o email já existe no destino
+        response_lista = await client.get("/tarefas/", headers=headers_novos)
+        response_arquivo = await client.get("/tarefas/arquivo", headers=headers_novos)
+        response_restauro = await client.post(
+            f"/tarefas/arquivo/{response_arquivo.json()[0]['id']}/restaurar", headers=headers_novos
+        )
+        de_volta = await rebalancear.mover_usuario(email, origem)
+
+        # Assert
+        assert novo_id is not None
+        assert response_token_antigo.status_code == 401
+        assert jwt.get_unverified_claims(headers_novos["Authorization"].split()[1])["shd"] == destino
+        assert [(t["titulo"], t["etiquetas"]) for t in response_lista.json()] == [("Ativa 1", ["casa"]), ("Ativa 2", [])]
+        assert [(t["titulo"], t["etiquetas"]) for t in response_arquivo.json()] == [("Arquivada", ["casa", "papelada"])]
+        assert response_restauro.json()["etiquetas"] == ["casa", "papelada"]
+        assert response_restauro.status_code == 200
+        assert de_volta is not None
+        assert await self._contar(mapa.fabricas[destino], models.Usuario) == 0
+        assert await self._contar(mapa.fabricas[destino], models.Tarefa) == 0
+        assert await self._contar(mapa.fabricas[destino], models.Etiqueta) == 0
+        assert await self._contar(mapa.fabricas[origem], models.Tarefa) == 3
+        assert await self._contar(mapa.fabricas[0], models.DiretorioShard) == 0
+
+
+class TestVencimentos:
+    """Testes para o varrimento das tarefas atrasadas e a vencer."""
+
+    class NotificadorDeTeste:
+        """Guarda os eventos recebidos; falha nas chamadas indicadas (contadas a partir de 1)."""
+
+        def __init__(self, falhar_em: tuple[int, ...] = ()):
+            self.eventos = []
+            self.chamadas = 0
+            self.falhar_em = falhar_em
+
+        async def notificar(self, eventos):
+            self.chamadas += 1
+            if self.chamadas in self.falhar_em:
+                raise ConnectionError("notificador indisponível")
+            self.eventos += eventos
+
+    @staticmethod
+    async def _criar(ac: AuthenticatedClient, titulo: str, dias: int, concluida: bool = False):
+        """Cria uma tarefa que vence daqui a `dias` dias (negativo: já venceu)."""
+        data_vencimento = (date.today() + timedelta(days=dias)).isoformat()
+        await ac.client.post(
+            "/tarefas/", json={"titulo": titulo, "data_vencimento": data_vencimento, "concluida": concluida},
+            headers=ac.headers,
+        )
+
+    @pytest.mark.asyncio
+    async def test_varrimento_incremental_em_lotes(self, authenticated_client: AuthenticatedClient):
+        """Verifica se cada tarefa gera um só evento e se os varrimentos seguintes só veem as novas."""
+        # Arrange
+        ac = authenticated_client
+        for titulo, dias, concluida in [
+            ("Antiga", -3, False), ("Ontem 1", -1, False), ("Ontem feita", -1, True), ("Ontem 2", -1, False),
+            ("Hoje", 0, False), ("Amanhã", 1, False), ("Longe", 5, False),
+        ]:
+            await self._criar(ac, titulo, dias, concluida)
+        notificador = self.NotificadorDeTeste()
+        agendador = vencimentos.AgendadorDeVencimentos(TestingSessionLocal, notificador, tamanho_lote=1)
+
+        # Act
+        primeiro = await agendador.varrer()
+        segundo = await agendador.varrer()
+        await self._criar(ac, "Amanhã 2", 1)
+        terceiro = await agendador.varrer()
+
+        # Assert
+        assert (primeiro, segundo, terceiro) == (4, 0, 1)
+        assert [(e.tipo, e.titulo) for e in notificador.eventos] == [
+            (vencimentos.ATRASADA, "Ontem 1"), (vencimentos.ATRASADA, "Ontem 2"),
+            (vencimentos.A_VENCER, "Hoje"), (vencimentos.A_VENCER, "Amanhã"), (vencimentos.A_VENCER, "Amanhã 2"),
+        ]
+        assert all(e.dono_id == ac.user_id and e.shard is None for e in notificador.eventos)
+
+    @pytest.mark.asyncio
+    async def test_concessao_escolhe_um_worker(self, authenticated_client: AuthenticatedClient):
+        """Garante que só o titular da concessão varre, e que outro worker a assume quando ela expira."""
+        # Arrange
+        ac = authenticated_client
+        await self._criar(ac, "Ontem", -1)
+        notificador_a, notificador_b = self.NotificadorDeTeste(), self.NotificadorDeTeste()
+        worker_a = vencimentos.AgendadorDeVencimentos(TestingSessionLocal, notificador_a)
+        worker_b = vencimentos.AgendadorDeVencimentos(TestingSessionLocal, notificador_b)
+
+        # Act
+        varridas_a = await worker_a.varrer()
+        await self._criar(ac, "Hoje", 0)
+        varridas_b_com_concessao_ocupada = await worker_b.varrer()
+        async with TestingSessionLocal() as db:
+            await db.execute(update(models.Concessao).values(expira_em=crud.agora_utc() - timedelta(seconds=1)))
+            await db.commit()
+        varridas_b = await worker_b.varrer()
+        varridas_a_sem_concessao = await worker_a.varrer()
+
+        # Assert
+        assert (varridas_a, varridas_b_com_concessao_ocupada, varridas_b, varridas_a_sem_concessao) == (1, 0, 1, 0)
+        assert [e.titulo for e in notificador_a.eventos] == ["Ontem"]
+        assert [e.titulo for e in notificador_b.eventos] == ["Hoje"]
+
+    @pytest.mark.asyncio
+    async def test_falha_do_notificador_repete_o_lote(self, authenticated_client: AuthenticatedClient):
+        """Verifica se um lote recusado pelo notificador é entregue no varrimento seguinte, sem repetir os anteriores."""
+        # Arrange
+        ac = authenticated_client
+        for i in range(3):
+            await self._criar(ac, f"Ontem {i}", -1)
+        notificador = self.NotificadorDeTeste(falhar_em=(2,))
+        agendador = vencimentos.AgendadorDeVencimentos(TestingSessionLocal, notificador, tamanho_lote=1)
+
+        # Act
+        with pytest.raises(ConnectionError):
+            await agendador.varrer()
+        repetidas = await agendador.varrer()
+
+        # Assert
+        assert repetidas == 2
+        assert [e.titulo for e in notificador.eventos] == ["Ontem 0", "Ontem 1", "Ontem 2"]
+
+    @pytest.mark.asyncio
+    async def test_consulta_usa_indice_de_vencimento(self):
+        """Garante que o SQLite lê cada lote pelo índice `ix_tarefas_vencimento`, sem percorrer a tabela."""
+        # Arrange
+        comandos = []
+
+        def registar(conn, cursor, statement, parameters, context, executemany):
+            comandos.append((statement, parameters))
+
+        # Act
+        event.listen(engine.sync_engine, "before_cursor_execute", registar)
+        try:
+            async with TestingSessionLocal() as db:
+                await crud.get_tarefas_a_vencer(db, apos=(date.today(), 0), ate=date.today(), desde=date.today())
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", registar)
+        statement, parameters = comandos[0]
+        async with engine.connect() as conn:
+            plano = (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)).all()
+
+        # Assert
+        assert any("USING INDEX ix_tarefas_vencimento" in linha[-1] for linha in plano)
+        assert not any("SCAN" in linha[-1] or "TEMP B-TREE" in linha[-1] for linha in plano)
+
+
+class TestEtiquetas:
+    """Testes para as etiquetas das tarefas: filtros, atualização, arquivo e carregamento sem N+1."""
+
+    @staticmethod
+    async def _criar(ac: AuthenticatedClient, titulo: str, etiquetas: list[str], **campos) -> dict:
+        response = await ac.client.post(
+            "/tarefas/", json={"titulo": titulo, "etiquetas": etiquetas, **campos}, headers=ac.headers
+        )
+        return response.json()
+
+    @staticmethod
+    async def _listar_contando_sql(ac: AuthenticatedClient, limit: int) -> tuple[list, list[str]]:
+        """Lista uma página de tarefas e devolve-a com os comandos SQL executados."""
+        comandos = []
+
+        def registar(conn, cursor, statement, parameters, context, executemany):
+            comandos.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", registar)
+        try:
+            response = await ac.client.get(f"/tarefas/?limit={limit}", headers=ac.headers)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", registar)
+        return response.json(), comandos
+
+    @pytest.mark.asyncio
+    async def test_listar_100_tarefas_com_etiquetas_sem_n_mais_1(self, authenticated_client: AuthenticatedClient):
+        """Garante que listar 100 tarefas com etiquetas custa o mesmo número de comandos SQL que listar 10."""
+        # Arrange
+        ac = authenticated_client
+        nomes = ["casa", "trabalho", "urgente", "compras", "saúde"]
+        async with TestingSessionLocal() as db:
+            await crud.create_tarefas_em_lote(db, [
+                (schemas.TarefaCreate(titulo=f"Tarefa {i}", etiquetas=[nomes[i % 5], nomes[(i + 1) % 5]]), ac.user_id)
+                for i in range(100)
+            ])
+
+        # Act
+        pagina_10, comandos_10 = await self._listar_contando_sql(ac, limit=10)
+        pagina_100, comandos_100 = await self._listar_contando_sql(ac, limit=100)
+
+        # Assert
+        assert len(pagina_100) == 100
+        assert pagina_100[7]["etiquetas"] == sorted([nomes[2], nomes[3]])
+        assert len(comandos_100) == len(comandos_10) == 3  # Utilizador, página de tarefas e etiquetas da página
+        assert len([c for c in comandos_100 if "FROM tarefas_etiquetas" in c or "JOIN tarefas_etiquetas" in c]) == 1
+        async with TestingSessionLocal() as db:
+            assert (await db.execute(select(func.count()).select_from(models.Etiqueta))).scalar_one() == 5
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("com_cache", [False, True])
+    async def test_apagar_tarefa_com_etiquetas(
+        self, authenticated_client: AuthenticatedClient, monkeypatch, com_cache
+    ):
+        """Verifica se o DELETE de uma tarefa com etiquetas devolve a tarefa apagada, com e sem cache."""
+        # Arrange
+        ac = authenticated_client
+        if com_cache:
+            monkeypatch.setattr(cache, "backend", cache.CacheEmMemoria(max_itens=100))
+        tarefa = await self._criar(ac, "Com etiquetas", ["casa", "urgente"])
+        await ac.client.get(f"/tarefas/{tarefa['id']}", headers=ac.headers)  # Fica em cache, se ativo
+
+        # Act
+        response = await ac.client.delete(f"/tarefas/{tarefa['id']}", headers=ac.headers)
+        response_depois = await ac.client.get(f"/tarefas/{tarefa['id']}", headers=ac.headers)
+
+        # Assert
+        assert response.status_code == 200
+        assert response.json() == tarefa
+        assert response_depois.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_filtrar_e_atualizar_etiquetas_com_cache(
+        self, authenticated_client: AuthenticatedClient, monkeypatch
+    ):
+        """Verifica o filtro (todas as etiquetas pedidas), o PUT que mantém ou substitui e a invalidação do cache."""
+        # Arrange
+        ac = authenticated_client
+        monkeypatch.setattr(cache, "backend", cache.CacheEmMemoria(max_itens=100))
+        a = await self._criar(ac, "A", [" urgente", "casa", "casa"])
+        b = await self._criar(ac, "B", ["casa"])
+        await self._criar(ac, "C", [])
+        await ac.client.get(f"/tarefas/{b['id']}", headers=ac.headers)  # Fica em cache
+
+        # Act
+        casa = await ac.client.get("/tarefas/?etiqueta=casa", headers=ac.headers)
+        casa_e_urgente = await ac.client.get("/tarefas/?etiqueta=casa&etiqueta=urgente", headers=ac.headers)
+        inexistente = await ac.client.get("/tarefas/?etiqueta=férias", headers=ac.headers)
+        mantida = await ac.client.put(f"/tarefas/{a['id']}", json={"titulo": "A2"}, headers=ac.headers)
+        substituida = await ac.client.put(
+            f"/tarefas/{b['id']}", json={"titulo": "B", "etiquetas": ["trabalho"]}, headers=ac.headers
+        )
+        casa_depois = await ac.client.get("/tarefas/?etiqueta=casa", headers=ac.headers)
+        em_msgpack = await ac.client.get(
+            "/tarefas/?etiqueta=trabalho", headers={**ac.headers, "Accept": "application/msgpack"}
+        )
+
+        # Assert
+        assert a["etiquetas"] == ["casa", "urgente"]
+        assert [t["titulo"] for t in casa.json()] == ["A", "B"]
+        assert [t["titulo"] for t in casa_e_urgente.json()] == ["A"]
+        assert inexistente.json() == []
+        assert mantida.json()["etiquetas"] == ["casa", "urgente"]
+        assert substituida.json()["etiquetas"] == ["trabalho"]
+        assert [t["titulo"] for t in casa_depois.json()] == ["A2"]
+        assert [t["etiquetas"] for t in msgpack.unpackb(em_msgpack.content)] == [["trabalho"]]
+
+    @pytest.mark.asyncio
+    async def test_etiquetas_acompanham_arquivo_e_restauro(self, authenticated_client: AuthenticatedClient):
+        """Verifica se as etiquetas de uma tarefa arquivada aparecem no arquivo e voltam com o restauro."""
+        # Arrange
+        ac = authenticated_client
+        tarefa = await self._criar(ac, "IRS", ["finanças", "casa"], concluida=True)
+        await TestArquivo._envelhecer(tarefa["id"])
+        await arquivo.Arquivador(TestingSessionLocal, idade=timedelta(days=30)).arquivar()
+
+        # Act
+        response_arquivo = await ac.client.get("/tarefas/arquivo", headers=ac.headers)
+        response_restauro = await ac.client.post(f"/tarefas/arquivo/{tarefa['id']}/restaurar", headers=ac.headers)
+        response_filtro = await ac.client.get("/tarefas/?etiqueta=finanças", headers=ac.headers)
+
+        # Assert
+        assert response_arquivo.json()[0]["etiquetas"] == ["casa", "finanças"]
+        assert response_restauro.json()["etiquetas"] == ["casa", "finanças"]
+        assert [t["id"] for t in response_filtro.json()] == [tarefa["id"]]
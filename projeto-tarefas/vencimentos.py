@@ -0,0 +1,239 @@
+"""
+Módulo de Vencimentos (Tarefas Atrasadas e a Vencer)
+
+Este ficheiro implementa um agendador em segundo plano que, periodicamente,
+procura as tarefas pendentes que passaram a estar atrasadas ou a vencer em
+breve e entrega um evento por tarefa a um notificador.
+
+- O varrimento é incremental: para cada tipo de evento, guarda a última tarefa
+  processada (data de vencimento, ID) em `marcas_vencimento` e continua a partir
+  dela, pelo índice `ix_tarefas_vencimento`, em lotes de tamanho limitado.
+- Com vários workers, só o titular da concessão "vencimentos" (tabela
+  `concessoes`) faz o varrimento; se ele parar, outro assume-o quando a
+  concessão expirar. No modo de sharding, cada shard tem a sua concessão e as suas marcas.
+- A marca só avança depois de o notificador aceitar o lote: se ele falhar, o
+  lote é repetido no próximo ciclo (entrega "pelo menos uma vez").
+- Só são notificadas as tarefas à frente da marca: uma tarefa criada ou editada
+  com uma data de vencimento já ultrapassada pelo varrimento não gera evento.
+
+O agendador é ativado por variáveis de ambiente (ver `configurar_a_partir_do_ambiente`)
+e iniciado no `lifespan` da aplicação.
+"""
+import asyncio
+import importlib
+import os
+import socket
+import uuid
+from datetime import date, timedelta
+from typing import NamedTuple
+
+import crud
+import registos
+import shards
+
+# Tipos de evento (também as chaves das marcas em `marcas_vencimento`).
+ATRASADA = "atrasada"
+A_VENCER = "a_vencer"
+
+# Nome da concessão que escolhe o worker que faz o varrimento.
+CONCESSAO = "vencimentos"
+
+
+class EventoVencimento(NamedTuple):
+    """Uma tarefa que passou a estar atrasada (`ATRASADA`) ou a vencer em breve (`A_VENCER`)."""
+    tipo: str
+    tarefa_id: int
+    dono_id: int
+    titulo: str
+    data_vencimento: date
+    shard: int | None = None
+
+
+# --- Notificadores ---
+
+class NotificadorRegisto:
+    """
+    Notificador padrão: escreve cada evento no registo da aplicação.
+
+    Qualquer objeto com um método `async notificar(eventos)` pode substituí-lo
+    (ver `VENCIMENTOS_NOTIFICADOR`); uma exceção nesse método faz repetir o lote.
+    """
+
+    async def notificar(self, eventos: list[EventoVencimento]) -> None:
+        for evento in eventos:
+            # Sem o título: o registo não guarda conteúdo escrito pelos utilizadores.
+            dados = {campo: valor for campo, valor in evento._asdict().items() if campo != "titulo"}
+            dados["data_vencimento"] = evento.data_vencimento.isoformat()
+            registos.logger.info("Vencimentos: tarefa %s", evento.tipo.replace("_", " "), extra={"dados": dados})
+
+
+def criar_notificador(especificacao: str):
+    """
+    Cria o notificador indicado por `VENCIMENTOS_NOTIFICADOR`.
+
+    Args:
+        especificacao: "" ou "registo" para o `NotificadorRegisto`, ou
+                       "pacote.modulo:nome" para uma classe (que é instanciada
+                       sem argumentos) ou um objeto desse módulo.
+    """
+    if especificacao in ("", "registo"):
+        return NotificadorRegisto()
+    modulo, separador, nome = especificacao.partition(":")
+    if not separador:
+        raise ValueError(f"VENCIMENTOS_NOTIFICADOR não suportado: {especificacao!r}")
+    alvo = getattr(importlib.import_module(modulo), nome)
+    return alvo() if isinstance(alvo, type) else alvo
+
+
+# --- Agendador ---
+
+class _ConcessaoPerdida(Exception):
+    """Outro worker assumiu a concessão durante o varrimento."""
+
+
+class AgendadorDeVencimentos:
+    """
+    Tarefa em segundo plano que notifica as tarefas atrasadas e a vencer.
+
+    Args:
+        fabrica_de_sessoes: Fábrica de sessões assíncronas (ex.: `database.SessionLocal`).
+        notificador: Recebe os eventos, lote a lote (ex.: `NotificadorRegisto()`).
+        intervalo: Segundos entre dois varrimentos.
+        antecedencia: Com quanto tempo de antecedência uma tarefa está "a vencer".
+        tamanho_lote: Número máximo de tarefas por consulta e por notificação.
+        duracao_concessao: Prazo da concessão; deve ser maior do que o `intervalo`,
+                           para que o titular a renove antes de ela expirar.
+    """
+
+    def __init__(
+        self,
+        fabrica_de_sessoes,
+        notificador,
+        intervalo: float = 60,
+        antecedencia: timedelta = timedelta(days=1),
+        tamanho_lote: int = 500,
+        duracao_concessao: timedelta = timedelta(minutes=5),
+    ):
+        self.fabrica_de_sessoes = fabrica_de_sessoes
+        self.notificador = notificador
+        self.intervalo = intervalo
+        self.antecedencia = antecedencia
+        self.tamanho_lote = tamanho_lote
+        self.duracao_concessao = duracao_concessao
+        # Único por processo, mesmo com vários workers na mesma máquina.
+        self.titular = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tarefa_de_fundo: asyncio.Task | None = None
+
+    async def iniciar(self):
+        """Arranca o ciclo do agendador em segundo plano."""
+        if self._tarefa_de_fundo is None:
+            self._tarefa_de_fundo = asyncio.create_task(self._executar())
+
+    async def parar(self):
+        """Termina o agendador. A concessão expira sozinha, e um lote interrompido é repetido."""
+        if self._tarefa_de_fundo is not None:
+            self._tarefa_de_fundo.cancel()
+            try:
+                await self._tarefa_de_fundo
+            except asyncio.CancelledError:
+                pass
+            self._tarefa_de_fundo = None
+
+    async def varrer(self) -> int:
+        """
+        Faz um varrimento em cada banco de dados (cada shard) cuja concessão este worker obtenha.
+
+        Na primeira execução, sem marcas, começa nas tarefas que venceram ontem
+        (atrasadas) e nas que vencem hoje (a vencer), sem notificar o histórico.
+
+        Returns:
+            O número total de eventos notificados.
+        """
+        hoje = date.today()
+        total = 0
+        for fabrica in shards.todas_as_fabricas(self.fabrica_de_sessoes):
+            async with fabrica() as db:
+                if not await crud.adquirir_concessao(db, CONCESSAO, self.titular, self.duracao_concessao):
+                    continue
+            try:
+                total += await self._varrer_tipo(
+                    fabrica, ATRASADA, ate=hoje - timedelta(days=1), inicio=(hoje - timedelta(days=1), 0)
+                )
+                total += await self._varrer_tipo(
+                    fabrica, A_VENCER, ate=hoje + self.antecedencia, desde=hoje, inicio=(hoje, 0)
+                )
+            except _ConcessaoPerdida:
+                registos.logger.warning("Vencimentos: concessão perdida a meio do varrimento")
+        return total
+
+    async def _varrer_tipo(
+        self, fabrica, tipo: str, ate: date, inicio: tuple[date, int], desde: date | None = None
+    ) -> int:
+        """Notifica, lote a lote, as tarefas do `tipo` à frente da marca, avançando-a após cada lote."""
+        async with fabrica() as db:
+            marca = await crud.get_marca_vencimentos(db, tipo) or inicio
+        total = 0
+        while True:
+            async with fabrica() as db:
+                lote = await crud.get_tarefas_a_vencer(db, marca, ate, desde, self.tamanho_lote)
+                shard = shards.shard_da_sessao(db)
+            if not lote:
+                return total
+            await self.notificador.notificar([
+                EventoVencimento(tipo, t.id, t.dono_id, t.titulo, t.data_vencimento, shard) for t in lote
+            ])
+            marca = (lote[-1].data_vencimento, lote[-1].id)
+            async with fabrica() as db:
+                if not await crud.avancar_marca_vencimentos(
+                    db, tipo, marca, CONCESSAO, self.titular, self.duracao_concessao
+                ):
+                    raise _ConcessaoPerdida()
+            total += len(lote)
+            if len(lote) < self.tamanho_lote:
+                return total
+            await asyncio.sleep(0)  # Deixa as requisições correr entre lotes
+
+    async def _executar(self):
+        """Ciclo principal: varre e espera pelo próximo intervalo, até ser cancelado."""
+        while True:
+            try:
+                total = await self.varrer()
+                if total:
+                    registos.logger.info("Vencimentos: %d eventos notificados", total)
+            except Exception:
+                # Uma falha (ex.: banco de dados ou notificador indisponível) não termina o ciclo.
+                registos.logger.exception("Vencimentos: falha no varrimento")
+            await asyncio.sleep(self.intervalo)
+
+
+# --- Instância Global da Aplicação ---
+
+# None quando o agendador está desativado (o padrão).
+agendador: AgendadorDeVencimentos | None = None
+
+
+def configurar_a_partir_do_ambiente(fabrica_de_sessoes) -> AgendadorDeVencimentos | None:
+    """
+    Cria o agendador global se `VENCIMENTOS_ATIVO` estiver ativa.
+
+    Variáveis de ambiente:
+        VENCIMENTOS_ATIVO: "1"/"true" para ativar (padrão: desativado).
+        VENCIMENTOS_INTERVALO_S: segundos entre varrimentos (padrão: 60).
+        VENCIMENTOS_ANTECEDENCIA_DIAS: dias de antecedência do evento "a vencer" (padrão: 1).
+        VENCIMENTOS_TAMANHO_LOTE: tarefas por lote (padrão: 500).
+        VENCIMENTOS_CONCESSAO_S: prazo da concessão entre workers (padrão: 300).
+        VENCIMENTOS_NOTIFICADOR: "registo" (padrão) ou "pacote.modulo:Classe".
+    """
+    global agendador
+    if os.getenv("VENCIMENTOS_ATIVO", "").lower() not in ("1", "true", "sim"):
+        agendador = None
+        return None
+    agendador = AgendadorDeVencimentos(
+        fabrica_de_sessoes,
+        criar_notificador(os.getenv("VENCIMENTOS_NOTIFICADOR", "")),
+        intervalo=float(os.getenv("VENCIMENTOS_INTERVALO_S", "60")),
+        antecedencia=timedelta(days=float(os.getenv("VENCIMENTOS_ANTECEDENCIA_DIAS", "1"))),
+        tamanho_lote=int(os.getenv("VENCIMENTOS_TAMANHO_LOTE", "500")),
+        duracao_concessao=timedelta(seconds=float(os.getenv("VENCIMENTOS_CONCESSAO_S", "300"))),
+    )
+    return agendador